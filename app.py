@@ -3,102 +3,317 @@ import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
+import os
+import uuid
+from datetime import date
+
+from engine import PLEngine, load_position_workbook
+from engine.attribution import attribute_strategy
+from engine.cache import content_hash, result_cache, workbook_cache
+from engine.columnar import cache_path_for, is_cache_fresh, read_columnar_cache
+from engine.columns import default_period, find_common_columns
+from engine.formatting import format_number, format_table
+from engine.hedge import optimal_hedge
+from engine.incremental import get_incremental_state
+from engine.live import FileTailSource, SocketSource, get_live_session, start_live, stop_live_session
+from engine.montecarlo import monte_carlo_risk
+from engine.pipeline import Pipeline
+from engine.portfolio import METALS, build_portfolio, guess_metal
+from engine.profiling import StageProfiler
+from engine.snapshots import needs_reference_year, snapshot_axis
+from engine.store import DEFAULT_DB, HistoryStore
+from engine.scenario import scenario_grid_pl, scenario_pl
+from engine.spread import adjacent_pairs, cash_3m_spread, find_cash_3m, spread_table
+from engine.tenor import BUCKET_LEVEL_NAMES, auto_bucket_level, bucket_codes, finer_level
+
+# ヒートマップ: 自動集約時の1軸あたりの最大セル数、セル内に数値を表示する最大セル数
+HEATMAP_MAX_AXIS = 60
+HEATMAP_TEXT_MAX_CELLS = 900
+
+# モンテカルロのP/L分布: サーバー側で集計するビンの数（パスごとの値はブラウザに送らない）
+MC_HISTOGRAM_BINS = 100
+
+# ビューごとの設定ウィジェットのキー（非表示の間も値を保持する。
+# 選択肢がデータに依存するものは、描画前に drop_stale_choice で選択肢にない値を破棄する）
+VIEW_WIDGET_KEYS = [
+    ('multi_period_dates', 'multi_period_range', 'multi_period_kind',
+     'history_metal', 'history_year', 'history_prompt', 'history_last'),
+    ('spread_pair_mode', 'spread_kind'),
+    ('attribution_scope', 'attribution_bucket_level', 'attribution_drilldown',
+     'hedge_limit', 'hedge_max_lots', 'hedge_restarts', 'hedge_workers', 'run_hedge'),
+    ('pair_strategy', 'heatmap_bucket_level', 'heatmap_drilldown', 'pair_rank_top', 'pair_rank_sign',
+     'pair_rank_level', 'pair_rank_buckets', 'pair_rank_legs'),
+    ('parallel_range', 'parallel_steps', 'tilt_range', 'tilt_steps', 'scenario_strategy',
+     'mc_paths', 'var_level', 'mc_workers', 'run_montecarlo'),
+]
 
 st.set_page_config(page_title="非鉄ポジションP/Lシミュレーター", layout="wide")
 
 st.title("非鉄金属ポジション損益シミュレーター（MVP）")
 
+def load_workbook_cached(data):
+    """ファイル内容のハッシュをキーにワークブックをキャッシュして読み込む"""
+    key = content_hash(data)
+    workbook = workbook_cache.get_or_compute(key, lambda: load_position_workbook(data))
+    return key, workbook
+
+
+def load_default_workbook(path):
+    """デフォルトファイルを読み込む（新しい列指向キャッシュがあれば優先）"""
+    if is_cache_fresh(path):
+        workbook = read_columnar_cache(cache_path_for(path))
+        return workbook['source']['hash'], workbook
+    with open(path, 'rb') as f:
+        return load_workbook_cached(f.read())
+
+
+def drop_stale_choice(key, options):
+    """保持している選択が選択肢にない場合は破棄する（複数選択は選択肢にあるものだけ残す）"""
+    if key not in st.session_state:
+        return
+    value = st.session_state[key]
+    if isinstance(value, list):
+        st.session_state[key] = [v for v in value if v in options]
+    elif value not in options:
+        del st.session_state[key]
+
+
+def editor_data(key, default, is_valid):
+    """data_editor に渡す初期データ（非表示の間に破棄された編集内容を復元する）
+
+    data_editor のキーには書き戻せないため、編集後の表は f'{key}_edited' に保持し、
+    ウィジェットの状態がない（前回は非表示だった）ときに初期データとして使う。
+    表示中は初期データを変えない（変えると編集内容が二重に適用される）。
+    保持している表がデータに合わなくなった場合（is_valid が偽）は default に戻す。
+    """
+    data_key, edited_key = f'{key}_data', f'{key}_edited'
+    if key not in st.session_state:
+        st.session_state[data_key] = st.session_state.get(edited_key, default)
+    if not is_valid(st.session_state[data_key]):
+        st.session_state[data_key] = default
+    return st.session_state[data_key]
+
+
 # サイドバー: データアップロード
 with st.sidebar:
-    st.header("データ入力")
-    uploaded_file = st.file_uploader("Excelファイルをアップロード", type=['xlsx'])
-    
-    # デフォルトファイルの読み込み
-    default_file_path = "数量価格.xlsx"
-    use_default = False
-    
-    if not uploaded_file:
-        try:
-            # デフォルトファイルを読み込もうとする
-            df_price_default = pd.read_excel(default_file_path, sheet_name='価格', index_col=0, header=0)
-            df_qty_default = pd.read_excel(default_file_path, sheet_name='数量', index_col=0, header=0)
-            
-            # 列名がUnnamedの場合は、最初の行を列名として再読み込み
-            if any('Unnamed' in str(col) for col in df_price_default.columns):
-                df_price_default = pd.read_excel(default_file_path, sheet_name='価格', header=0)
-                if len(df_price_default.columns) > 0:
-                    df_price_default = df_price_default.set_index(df_price_default.columns[0])
-            
-            if any('Unnamed' in str(col) for col in df_qty_default.columns):
-                df_qty_default = pd.read_excel(default_file_path, sheet_name='数量', header=0)
-                if len(df_qty_default.columns) > 0:
-                    df_qty_default = df_qty_default.set_index(df_qty_default.columns[0])
-            
-            use_default = True
-            st.info(f"デフォルトファイル（{default_file_path}）を使用しています")
-        except Exception as e:
-            st.info("👈 Excelファイルをアップロードするか、デフォルトファイル（数量価格.xlsx）を配置してください")
-    
-    if uploaded_file:
-        try:
-            # Excelファイルのシート名を確認
-            xl_file = pd.ExcelFile(uploaded_file)
-            sheet_names = xl_file.sheet_names
-            st.info(f"検出されたシート: {', '.join(sheet_names)}")
-            
-            # シート名の柔軟な検出
-            price_sheet = None
-            qty_sheet = None
-            
-            for sheet in sheet_names:
-                if '価格' in sheet or 'price' in sheet.lower():
-                    price_sheet = sheet
-                if '数量' in sheet or 'qty' in sheet.lower() or 'quantity' in sheet.lower():
-                    qty_sheet = sheet
-            
-            # デフォルトで最初の2つのシートを使用
-            if price_sheet is None and len(sheet_names) >= 1:
-                price_sheet = sheet_names[0]
-            if qty_sheet is None and len(sheet_names) >= 2:
-                qty_sheet = sheet_names[1]
-            elif qty_sheet is None and len(sheet_names) >= 1:
-                qty_sheet = sheet_names[0]
-            
-            if price_sheet is None or qty_sheet is None:
-                st.error("価格または数量のシートが見つかりません。")
+    # 表示順: データ入力 → 表示設定（計測設定は読み込み前に必要なため先に作成）
+    input_area = st.container()
+    settings_area = st.container()
+    
+    with settings_area:
+        # 表示設定
+        st.header("表示設定")
+        portfolio_mode = st.checkbox("ポートフォリオモード（複数ブック・金属）", value=False)
+        multi_period_mode = st.checkbox("複数期間モード（全スナップショット）", value=False)
+        
+        # 履歴ストア（取り込んだスナップショットと期間別P/LをSQLiteに保存）
+        history_mode = st.checkbox("履歴ストアに保存・参照", value=False)
+        history_path = st.text_input("履歴ストア", value=DEFAULT_DB) if history_mode else None
+        
+        # ライブ価格（日中の価格ティックを取り込んでP/Lを更新）
+        live_mode = st.checkbox("ライブ価格（日中）", value=False)
+        # ライブセッション・メモリ計測はブラウザのセッションごとに管理する（他のセッションの停止・置き換えをしない）
+        session_owner = st.session_state.setdefault("session_owner", uuid.uuid4().hex)
+        if live_mode:
+            live_source_type = st.radio("価格ソース", ["ファイル", "ソケット"], horizontal=True, key="live_source_type")
+            if live_source_type == "ファイル":
+                live_path = st.text_input("ティックファイル（1行: 限月,価格）", value="ticks.csv")
+            else:
+                live_address = st.text_input("接続先（ホスト:ポート）", value="127.0.0.1:9009")
+            live_interval = st.slider("画面更新間隔（秒）", 1, 10, 2)
+        else:
+            stop_live_session(session_owner)
+        
+        # 計測モード（処理時間・メモリ）
+        profile_mode = st.checkbox("計測モード（処理時間・メモリ）", value=False)
+        profile_log_path = None
+        if profile_mode and st.checkbox("計測結果をログファイルに追記", value=False):
+            profile_log_path = st.text_input("ログファイル", value="profile_log.jsonl")
+    
+    profiler = StageProfiler(enabled=profile_mode, owner=session_owner)
+    
+    with input_area:
+        st.header("データ入力")
+        if portfolio_mode:
+            # ポートフォリオモード: 複数ブックを読み込み、ブックごとに金属とブック名を指定
+            portfolio_files = st.file_uploader(
+                "Excelファイルをアップロード（複数可）", type=['xlsx'], accept_multiple_files=True
+            )
+            uploaded_file = None
+            portfolio_books = None
+            if portfolio_files:
+                portfolio_books = st.data_editor(
+                    pd.DataFrame({
+                        'ファイル': [f.name for f in portfolio_files],
+                        '金属': [guess_metal(f.name) for f in portfolio_files],
+                        'ブック': [f.name.rsplit('.', 1)[0] for f in portfolio_files],
+                    }),
+                    column_config={
+                        'ファイル': st.column_config.TextColumn('ファイル', disabled=True),
+                        '金属': st.column_config.SelectboxColumn('金属', options=METALS, required=True),
+                        'ブック': st.column_config.TextColumn('ブック', required=True),
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                    key="portfolio_books"
+                )
+        else:
+            uploaded_file = st.file_uploader("Excelファイルをアップロード", type=['xlsx'])
+        
+        # デフォルトファイルの読み込み
+        default_file_path = "数量価格.xlsx"
+        use_default = False
+        data_key = None
+        price_validity = qty_validity = None
+        book_name = uploaded_file.name if uploaded_file else default_file_path
+        
+        if not uploaded_file and not portfolio_mode:
+            try:
+                # デフォルトファイルを読み込もうとする
+                with profiler.stage('load') as stage:
+                    data_key, workbook_default = load_default_workbook(default_file_path)
+                    stage['rows'], stage['cols'] = workbook_default['df_price'].shape
+                df_price_default = workbook_default['df_price']
+                df_qty_default = workbook_default['df_qty']
+                validity_default = (workbook_default.get('price_validity'), workbook_default.get('qty_validity'))
+                
+                use_default = True
+                st.info(f"デフォルトファイル（{default_file_path}）を使用しています")
+            except Exception as e:
+                st.info("👈 Excelファイルをアップロードするか、デフォルトファイル（数量価格.xlsx）を配置してください")
+        
+        if uploaded_file:
+            try:
+                with profiler.stage('load') as stage:
+                    data_key, workbook = load_workbook_cached(uploaded_file.getvalue())
+                    stage['rows'], stage['cols'] = workbook['df_price'].shape
+                st.info(f"検出されたシート: {', '.join(workbook['sheet_names'])}")
+                
+                df_price = workbook['df_price']
+                df_qty = workbook['df_qty']
+                price_validity = workbook.get('price_validity')
+                qty_validity = workbook.get('qty_validity')
+                
+                st.success(f"データ読み込み完了（価格: {workbook['price_sheet']}, 数量: {workbook['qty_sheet']}）")
+            except Exception as e:
+                st.error(f"エラー: {str(e)}")
+                st.error("Excelファイルの形式を確認してください。")
                 st.stop()
-            
-            # 価格データ読み込み（header=0で最初の行を列名として使用）
-            df_price = pd.read_excel(uploaded_file, sheet_name=price_sheet, index_col=0, header=0)
-            # 数量データ読み込み
-            df_qty = pd.read_excel(uploaded_file, sheet_name=qty_sheet, index_col=0, header=0)
-            
-            # 列名がUnnamedの場合は、最初の行を列名として再読み込み
-            if any('Unnamed' in str(col) for col in df_price.columns):
-                df_price = pd.read_excel(uploaded_file, sheet_name=price_sheet, header=0)
-                if len(df_price.columns) > 0:
-                    df_price = df_price.set_index(df_price.columns[0])
-            
-            if any('Unnamed' in str(col) for col in df_qty.columns):
-                df_qty = pd.read_excel(uploaded_file, sheet_name=qty_sheet, header=0)
-                if len(df_qty.columns) > 0:
-                    df_qty = df_qty.set_index(df_qty.columns[0])
-            
-            st.success(f"データ読み込み完了（価格: {price_sheet}, 数量: {qty_sheet}）")
-        except Exception as e:
-            st.error(f"エラー: {str(e)}")
-            st.error("Excelファイルの形式を確認してください。")
-            st.stop()
-    elif use_default:
-        df_price = df_price_default
-        df_qty = df_qty_default
-        st.success("デフォルトデータ読み込み完了")
-    else:
-        df_price = None
-        df_qty = None
+        elif use_default:
+            df_price = df_price_default
+            df_qty = df_qty_default
+            price_validity, qty_validity = validity_default
+            st.success("デフォルトデータ読み込み完了")
+        else:
+            df_price = None
+            df_qty = None
+
+# ポートフォリオモード: 全ブック・全金属を積み上げ配列にまとめて集計
+if portfolio_mode:
+    st.header("📦 ポートフォリオP/L（複数金属・複数ブック）")
+    
+    if not portfolio_files:
+        st.info("👈 サイドバーから金属・ブックごとのExcelファイルを複数アップロードしてください")
+        st.stop()
+    
+    portfolio_entries = []
+    with profiler.stage('portfolio_load', rows=len(portfolio_files)):
+        for file, (_, book_row) in zip(portfolio_files, portfolio_books.iterrows()):
+            try:
+                file_key, file_workbook = load_workbook_cached(file.getvalue())
+            except Exception as e:
+                st.error(f"{file.name}: {str(e)}")
+                continue
+            portfolio_entries.append({
+                'key': file_key,
+                'metal': book_row['金属'],
+                'book': book_row['ブック'] or file.name,
+                'df_price': file_workbook['df_price'],
+                'df_qty': file_workbook['df_qty'],
+            })
+    if not portfolio_entries:
+        st.stop()
+    
+    # 同じファイル構成・金属/ブック指定なら積み上げ配列を再利用
+    portfolio_key = ('portfolio',) + tuple((e['key'], e['metal'], e['book']) for e in portfolio_entries)
+    with profiler.stage('portfolio_build') as stage_record:
+        portfolio = result_cache.get_or_compute(portfolio_key, lambda: build_portfolio(portfolio_entries))
+        stage_record['rows'] = len(portfolio.prompts)
+        stage_record['cols'] = len(portfolio.columns)
+    
+    if len(portfolio.columns) < 2:
+        st.error("ポートフォリオ全体で日付列が2つ以上必要です。")
+        st.stop()
+    
+    st.caption(
+        f"金属: {', '.join(portfolio.metals)} ／ ブック: {len(portfolio.books)} ／ "
+        f"限月: {len(portfolio.prompts)} ／ 日付列: {len(portfolio.columns)}"
+    )
+    portfolio_start, portfolio_end = st.select_slider(
+        "分析期間",
+        options=portfolio.columns,
+        value=(portfolio.columns[0], portfolio.columns[1]),
+        format_func=str,
+        key="portfolio_period"
+    )
+    
+    with profiler.stage('portfolio_pl', rows=int(portfolio.positions.sum())):
+        portfolio_totals = portfolio.totals(portfolio_start, portfolio_end)
+        df_portfolio = portfolio.pl_frame(portfolio_start, portfolio_end)
+    
+    df_unpriced = portfolio.unpriced(portfolio_start, portfolio_end)
+    if len(df_unpriced):
+        st.warning(
+            f"{portfolio_start} または {portfolio_end} の価格がない限月が{len(df_unpriced)}件あります。"
+            "これらはP/Lの集計から除外しています。"
+        )
+        with st.expander("価格のない限月", expanded=False):
+            st.dataframe(df_unpriced, use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Hold P/L合計", f"{portfolio_totals['total_hold_pl']:,.0f} USD")
+    col2.metric("Actual P/L合計", f"{portfolio_totals['total_actual_pl']:,.0f} USD")
+    col3.metric("戦略効果", f"{portfolio_totals['strategy_effect']:,.0f} USD")
+    
+    # 集計単位ごとのP/L
+    rollup_labels = {
+        "金属別": ['金属'],
+        "金属×ブック別": ['金属', 'ブック'],
+        "ブック別": ['ブック'],
+        "金属×限月別": ['金属', 'Prompt'],
+    }
+    rollup_choice = st.radio("集計単位", list(rollup_labels), horizontal=True, key="portfolio_rollup")
+    df_rollup = portfolio.rollup(df_portfolio, by=rollup_labels[rollup_choice])
+    st.dataframe(format_table(df_rollup.reset_index(), list(df_rollup.columns)),
+                 use_container_width=True, hide_index=True)
+    
+    # 金属別・ブック別のActual P/L（積み上げ棒グラフ）
+    df_by_book = portfolio.rollup(df_portfolio, by=('ブック', '金属'))['Actual P/L'].unstack(fill_value=0)
+    fig_portfolio = go.Figure()
+    for metal in df_by_book.columns:
+        fig_portfolio.add_trace(go.Bar(name=metal, x=df_by_book.index, y=df_by_book[metal]))
+    fig_portfolio.update_layout(
+        title='ブック別 Actual P/L（金属別の積み上げ、USD）',
+        xaxis_title='ブック',
+        yaxis_title='P/L (USD)',
+        barmode='relative',
+        height=450
+    )
+    with profiler.stage('portfolio_chart'):
+        st.plotly_chart(fig_portfolio, use_container_width=True)
+    
+    with st.expander("金属×ブック×限月 P/L明細", expanded=False):
+        numeric_cols = [col for col in df_portfolio.columns if col not in ('金属', 'ブック', 'Prompt')]
+        st.dataframe(format_table(df_portfolio, numeric_cols), use_container_width=True, hide_index=True)
+    
+    if profile_mode:
+        with st.expander("⏱ 処理時間・メモリ計測", expanded=True):
+            st.dataframe(profiler.frame(), use_container_width=True, hide_index=True)
+        if profile_log_path:
+            profiler.write_log(profile_log_path, book='portfolio')
 
 # データが読み込まれている場合のみ処理を実行
-if df_price is not None and df_qty is not None:
+elif df_price is not None and df_qty is not None:
     # データ検証
     if df_price.empty or df_qty.empty:
         st.error("データが空です。Excelファイルの形式を確認してください。")
@@ -114,122 +329,163 @@ if df_price is not None and df_qty is not None:
         st.write(f"数量インデックス: {df_qty.index.tolist()}")
         st.write(f"価格列: {df_price.columns.tolist()}")
         st.write(f"数量列: {df_qty.columns.tolist()}")
+        if price_validity is not None and qty_validity is not None:
+            st.write("**列ごとの数値判定（セル数）:**")
+            st.dataframe(pd.concat({'価格': price_validity, '数量': qty_validity}, axis=1))
     
-    # 列名の確認と統一（日付列を取得）
-    # Unnamed列を除外
-    price_cols = [col for col in df_price.columns if not str(col).startswith('Unnamed')]
-    qty_cols = [col for col in df_qty.columns if not str(col).startswith('Unnamed')]
-    
-    # 数値列のみを取得（文字列の列を除外）
-    def is_numeric_column(df, col):
-        """列が数値データを含むかチェック"""
-        try:
-            sample = df[col].dropna().head(5)
-            if len(sample) == 0:
-                return False
-            # 数値に変換可能かチェック
-            for val in sample:
-                if pd.isna(val):
-                    continue
-                if isinstance(val, str):
-                    try:
-                        float(val.replace(',', ''))
-                    except:
-                        return False
-                else:
-                    float(val)
-            return True
-        except:
-            return False
+    # 処理時間・メモリ計測（計測モード時のみ、内容はスクリプトの最後に表示）
+    profile_panel = st.expander("⏱ 処理時間・メモリ計測", expanded=True) if profile_mode else None
     
-    # 数値列のみをフィルタリング
-    price_numeric_cols = [col for col in price_cols if is_numeric_column(df_price, col)]
-    qty_numeric_cols = [col for col in qty_cols if is_numeric_column(df_qty, col)]
+    # 計算結果のキャッシュ（キー: (データハッシュ, ...)）
+    def cached_result(*key, compute):
+        """同じデータ・同じ条件の計算結果を再実行間で再利用"""
+        return result_cache.get_or_compute((data_key,) + key, compute)
     
-    # 共通の数値列を取得
-    common_cols = list(set(price_numeric_cols) & set(qty_numeric_cols))
+    # 計算段階（依存関係を明示し、表示するビューが要求した段階とその依存先だけを計算する）
+    pipeline = Pipeline(cache=result_cache, key=(data_key,), profiler=profiler)
+    pipeline.stage('columns', lambda: find_common_columns(df_price, df_qty, price_validity, qty_validity),
+                   key=(), size=lambda _: df_price.shape)
+    pipeline.stage('snapshot_axis', lambda info: snapshot_axis(info['common_cols']), depends=['columns'], key=())
+    # P/L計算エンジン（価格・数量を一度だけ数値行列に変換）
+    pipeline.stage('engine', lambda: PLEngine(df_price, df_qty), key=(), size=lambda _: df_price.shape)
+    
+    # 列名の確認と統一（日付列を取得）
+    columns_info = pipeline['columns']
+    price_cols = columns_info['price_cols']
+    qty_cols = columns_info['qty_cols']
+    common_cols = columns_info['common_cols']
     
     if len(common_cols) < 2:
-        # 数値列が見つからない場合、すべての共通列を使用
-        common_cols = list(set(price_cols) & set(qty_cols))
-        if len(common_cols) < 2:
-            st.error(f"価格と数量のデータに共通の日付列が2つ以上必要です。")
-            st.error(f"価格シートの列: {', '.join(map(str, price_cols))}")
-            st.error(f"数量シートの列: {', '.join(map(str, qty_cols))}")
-            st.error(f"共通列: {', '.join(map(str, common_cols))}")
-            st.stop()
-    
-    # 最初の2つの日付列を使用（1月末、2月末と仮定）
-    date_cols = sorted(common_cols)[:2]
-    date_start = date_cols[0]
-    date_end = date_cols[1]
+        st.error(f"価格と数量のデータに共通の日付列が2つ以上必要です。")
+        st.error(f"価格シートの列: {', '.join(map(str, price_cols))}")
+        st.error(f"数量シートの列: {', '.join(map(str, qty_cols))}")
+        st.error(f"共通列: {', '.join(map(str, common_cols))}")
+        st.stop()
+    
+    # 日付列のラベルを一度だけ日付に変換し、時系列順に並べる
+    axis = pipeline['snapshot_axis']
+    # 複数期間モード・Spread系列用：全スナップショット列（時系列順）
+    snapshot_cols = axis.columns
+    
+    # 分析期間（既定は時系列順で最初の2つの日付列）
+    date_start, date_end = st.select_slider(
+        "分析期間",
+        options=snapshot_cols,
+        value=default_period(common_cols),
+        format_func=str,
+        key="analysis_period"
+    )
+    if date_start == date_end:
+        st.warning("開始と終了に同じ日付列が選択されています。価格変動は0になります。")
     
     st.info(f"分析期間: {date_start} → {date_end}")
     
-    # メインエリア: 4つのタブ
-    tab1, tab2, tab3, tab4 = st.tabs([
-        "📊 限月別P/L", 
-        "📈 Spread分析", 
+    # 分析期間に依存する段階: P/L → Spread → ペアマトリクス（図は各ビューで生成）
+    pipeline.stage('pl_table', lambda engine: engine.pl_table(date_start, date_end),
+                   depends=['engine'], key=(date_start, date_end), size=lambda df: df.shape)
+    pipeline.stage('strategy_totals', lambda engine: engine.strategy_totals(date_start, date_end),
+                   depends=['engine'], key=(date_start, date_end))
+    pipeline.stage('cash_3m', lambda engine: find_cash_3m(engine.prompts), depends=['engine'])
+    pipeline.stage('cash_3m_spread',
+                   lambda engine, found: None if found[0] is None or found[1] is None
+                   else cash_3m_spread(engine, date_start, date_end, *found),
+                   depends=['engine', 'cash_3m'], key=(date_start, date_end))
+    for pair_strategy in ('actual', 'hold', 'diff'):
+        # 逆方向のポジションを持つ Long × Short の限月ペアだけを疎に保持
+        pipeline.stage(f'pairs_{pair_strategy}',
+                       lambda engine, strategy=pair_strategy: engine.sparse_pair_pl(date_start, date_end, strategy),
+                       depends=['engine'], key=(date_start, date_end), size=lambda pairs: (pairs.nnz, 1))
+    
+    # 期間別P/L・限月ペア別Spread系列（前回計算済みの列は再利用し、追加された日付列の分だけ計算）
+    def sync_incremental(engine):
+        incremental = get_incremental_state(book_name, engine.prompts)
+        return incremental, incremental.sync(engine.prices, engine.quantities, snapshot_cols, data_key=data_key)
+    pipeline.stage('incremental', sync_incremental, depends=['engine'])
+    
+    pl_engine = pipeline['engine']
+    
+    # ライブ評価: 開始時点の価格を基準に、日中のライブ価格を終了時点の価格とみなしてP/Lを更新
+    if live_mode:
+        with st.expander("⚡ ライブ評価（日中価格）", expanded=True):
+            live_source = None
+            if live_source_type == "ファイル":
+                if os.path.exists(live_path):
+                    live_source = FileTailSource(live_path)
+                else:
+                    st.warning(f"ティックファイルが見つかりません: {live_path}")
+            else:
+                live_host, _, live_port = live_address.rpartition(':')
+                if live_host and live_port.isdigit():
+                    live_source = SocketSource(live_host, int(live_port))
+                else:
+                    st.warning("接続先は「ホスト:ポート」の形式で入力してください。")
+            
+            if live_source is not None:
+                live_cash, live_m3 = find_cash_3m(pl_engine.prompts)
+                live, live_runner = get_live_session(
+                    session_owner, (data_key, repr(live_source), date_start, date_end),
+                    lambda: start_live(pl_engine, date_start, date_end, live_source, live_cash, live_m3,
+                                       flush_interval=live_interval / 2)
+                )
+                
+                # 画面は live_interval 秒ごとにこの部分だけ再描画（ティックごとには再計算しない）
+                @st.fragment(run_every=live_interval)
+                def live_panel():
+                    snapshot = live.snapshot()
+                    if live_runner.feed.error is not None:
+                        st.error(f"価格ソースのエラー: {live_runner.feed.error}")
+                    st.caption(
+                        f"基準: {date_start} の価格 ／ 受信ティック: {live_runner.feed.received:,} ／ "
+                        f"反映バッチ: {snapshot['batches']:,}"
+                    )
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Hold P/L", f"{snapshot['total_hold_pl']:,.0f} USD")
+                    col2.metric("Actual P/L", f"{snapshot['total_actual_pl']:,.0f} USD")
+                    col3.metric("戦略効果", f"{snapshot['strategy_effect']:,.0f} USD")
+                    
+                    live_spread = live.spread()
+                    if live_spread is not None:
+                        st.write(
+                            f"**Cash-3M Spread**: {live_spread['spread_live']:,.0f}（変動 {live_spread['spread_change']:,.0f}）　"
+                            f"**Spread P/L**: Hold {live_spread['spread_pl_hold']:,.0f} ／ Actual {live_spread['spread_pl_actual']:,.0f} USD"
+                        )
+                    
+                    col_table, col_pairs = st.columns(2)
+                    with col_table:
+                        st.dataframe(format_table(snapshot['table'], ['ライブ価格', '価格変動', 'Hold P/L', 'Actual P/L']),
+                                     use_container_width=True, hide_index=True)
+                    with col_pairs:
+                        rows, cols, values = snapshot['pairs']['actual'].top(k=10)
+                        st.dataframe(format_table(pd.DataFrame({
+                            'From': [pl_engine.prompts[i] for i in rows],
+                            'To': [pl_engine.prompts[j] for j in cols],
+                            'Actual Spread P/L': values,
+                        }), ['Actual Spread P/L']), use_container_width=True, hide_index=True)
+                
+                live_panel()
+    
+    # メインエリア: 選択したビューだけを計算・描画する（st.tabs は全タブを毎回実行するため使わない）
+    views = [
+        "📊 限月別P/L",
+        "📈 Spread分析",
         "🔄 戦略比較",
-        "🔥 限月間P/L寄与分析"
-    ])
+        "🔥 限月間P/L寄与分析",
+        "🧪 シナリオ分析"
+    ]
+    active_view = st.radio("表示", views, horizontal=True, key="active_view", label_visibility="collapsed")
+    
+    # 描画されなかったウィジェットの状態は実行の終わりに破棄されるため、非表示のビューの設定を書き戻して保持する
+    for view, widget_keys in zip(views, VIEW_WIDGET_KEYS):
+        if view != active_view:
+            for widget_key in widget_keys:
+                if widget_key in st.session_state:
+                    st.session_state[widget_key] = st.session_state[widget_key]
     
-    with tab1:
+    if active_view == views[0]:
         st.header("限月別損益")
         
-        # データの準備
-        prompts = df_price.index.tolist()
-        
-        # P/L計算用のデータフレーム作成
-        pl_data = []
-        
-        for prompt in prompts:
-            if prompt not in df_qty.index:
-                continue
-            
-            # データ取得と型変換（安全な方法）
-            def safe_get_value(df, idx, col, default=0):
-                """安全にデータを取得して数値に変換"""
-                try:
-                    if col not in df.columns:
-                        return default
-                    value = df.loc[idx, col]
-                    if pd.isna(value):
-                        return default
-                    # 文字列の場合は数値に変換を試みる
-                    if isinstance(value, str):
-                        # 数値文字列かチェック
-                        try:
-                            return float(value.replace(',', ''))
-                        except:
-                            return default
-                    return float(value)
-                except (KeyError, ValueError, TypeError):
-                    return default
-            
-            qty_start = safe_get_value(df_qty, prompt, date_start, 0)
-            qty_end = safe_get_value(df_qty, prompt, date_end, 0)
-            price_start = safe_get_value(df_price, prompt, date_start, 0)
-            price_end = safe_get_value(df_price, prompt, date_end, 0)
-            
-            price_change = price_end - price_start
-            
-            # P/L計算
-            hold_pl = qty_start * price_change
-            actual_pl = qty_end * price_change
-            
-            pl_data.append({
-                'Prompt': prompt,
-                f'数量({date_start})': qty_start,
-                f'数量({date_end})': qty_end,
-                f'価格({date_start})': price_start,
-                f'価格({date_end})': price_end,
-                '価格変動': price_change,
-                'Hold P/L': hold_pl,
-                'Actual P/L': actual_pl
-            })
-        
-        df_pl = pd.DataFrame(pl_data)
+        # P/L計算（エンジンで一括計算）
+        df_pl = pipeline['pl_table']
         
         # 合計行を追加
         total_row = {
@@ -244,22 +500,20 @@ if df_price is not None and df_qty is not None:
         }
         df_pl = pd.concat([df_pl, pd.DataFrame([total_row])], ignore_index=True)
         
-        # 数値フォーマット（千円単位、カンマ区切り）
-        def format_number(x):
-            if isinstance(x, (int, float)) and not pd.isna(x):
-                return f"{x:,.0f}"
-            return x
-        
-        # 表示用データフレーム
-        df_display = df_pl.copy()
+        # 表示用データフレーム（数値はカンマ区切り）
         numeric_cols = [f'数量({date_start})', f'数量({date_end})', f'価格({date_start})', 
                        f'価格({date_end})', '価格変動', 'Hold P/L', 'Actual P/L']
-        for col in numeric_cols:
-            if col in df_display.columns:
-                df_display[col] = df_display[col].apply(format_number)
+        df_display = format_table(df_pl, numeric_cols)
         
         st.dataframe(df_display, use_container_width=True, hide_index=True)
         
+        unpriced_prompts = pl_engine.unpriced(date_start, date_end)
+        if unpriced_prompts:
+            st.warning(
+                f"{date_start} または {date_end} の価格がない保有限月をP/Lの合計から除外しています: "
+                f"{', '.join(map(str, unpriced_prompts))}"
+            )
+        
         # グラフ表示
         st.subheader("限月別P/L比較")
         df_pl_chart = df_pl[df_pl['Prompt'] != '合計'].copy()
@@ -286,120 +540,255 @@ if df_price is not None and df_qty is not None:
             height=500
         )
         
-        st.plotly_chart(fig, use_container_width=True)
+        with profiler.stage('tab1_chart'):
+            st.plotly_chart(fig, use_container_width=True)
+        
+        # 複数期間モード：連続する全スナップショットペアを一括計算
+        if multi_period_mode:
+            st.subheader("期間別P/L（全スナップショット）")
+            
+            # 表示範囲（すべての列が日付として解釈できれば日付で、それ以外は列で指定）
+            if axis.n_dated == len(snapshot_cols):
+                range_dates = st.date_input(
+                    "表示範囲",
+                    value=(axis.dates[0].date(), axis.dates[-1].date()),
+                    min_value=axis.dates[0].date(),
+                    max_value=axis.dates[-1].date(),
+                    key="multi_period_dates"
+                )
+                range_cols = axis.range(*range_dates) if len(range_dates) == 2 else snapshot_cols
+            else:
+                range_cols = axis.between(*st.select_slider(
+                    "表示範囲",
+                    options=snapshot_cols,
+                    value=(snapshot_cols[0], snapshot_cols[-1]),
+                    format_func=str,
+                    key="multi_period_range"
+                ))
+            st.caption(f"対象列: {' → '.join(map(str, range_cols))}")
+            
+            # 前回計算済みの期間は再利用し、追加された日付列の分だけ計算（範囲外も含む全列）
+            incremental, n_new_cols = pipeline['incremental']
+            if 0 < n_new_cols < len(snapshot_cols):
+                st.caption(f"追加された{n_new_cols}列のみ差分計算しました")
+            
+            # 範囲内の期間（i番目の期間 = 列 i → 列 i+1）
+            if len(range_cols) < 2:
+                st.warning("表示範囲に2つ以上の日付列を含めてください。")
+                range_cols = snapshot_cols
+            first_period = axis.position(range_cols[0])
+            last_period = axis.position(range_cols[-1])
+            multi_pl = incremental.result().select(first_period, last_period)
+            df_period_totals = incremental.period_totals().iloc[first_period:last_period]
+            df_cumulative = df_period_totals.cumsum()
+            
+            df_period_display = pd.concat(
+                [df_period_totals, df_cumulative.add_prefix('累積 ')], axis=1
+            ).reset_index(names='期間')
+            for col in df_period_display.columns[1:]:
+                df_period_display[col] = df_period_display[col].apply(format_number)
+            st.dataframe(df_period_display, use_container_width=True, hide_index=True)
+            
+            fig_cumulative = go.Figure()
+            fig_cumulative.add_trace(go.Scatter(
+                x=df_cumulative.index,
+                y=df_cumulative['Hold P/L'],
+                mode='lines+markers',
+                name='累積 Hold P/L',
+                line=dict(color='lightblue')
+            ))
+            fig_cumulative.add_trace(go.Scatter(
+                x=df_cumulative.index,
+                y=df_cumulative['Actual P/L'],
+                mode='lines+markers',
+                name='累積 Actual P/L',
+                line=dict(color='lightcoral')
+            ))
+            fig_cumulative.update_layout(
+                title='累積P/L推移（USD）',
+                xaxis_title='期間',
+                yaxis_title='P/L (USD)',
+                height=400
+            )
+            with profiler.stage('tab1_multi_period_chart'):
+                st.plotly_chart(fig_cumulative, use_container_width=True)
+            
+            with st.expander("限月×期間 P/L明細", expanded=False):
+                kind_label = st.radio(
+                    "表示する戦略",
+                    ["Actual P/L", "Hold P/L"],
+                    horizontal=True,
+                    key="multi_period_kind"
+                )
+                kind = 'actual' if kind_label == "Actual P/L" else 'hold'
+                df_matrix = multi_pl.frame(kind)
+                df_matrix['累積'] = df_matrix.sum(axis=1)
+                st.dataframe(format_table(df_matrix), use_container_width=True)
     
-    with tab2:
+        # 履歴ストア: 取り込み済みの全期間から限月ごとのP/Lを参照
+        if history_mode:
+            st.subheader("📚 履歴（保存済み期間別P/L）")
+            try:
+                history_store = HistoryStore(history_path)
+            except ValueError as e:
+                st.error(str(e))
+                history_store = None
+        if history_mode and history_store is not None:
+            history_metal = st.selectbox(
+                "金属", METALS, index=METALS.index(guess_metal(book_name)), key="history_metal"
+            )
+            # 年のないラベル（1月末など）だけの場合は基準の年を指定（日付が実行した年に依存しないように）
+            history_year = None
+            if needs_reference_year(snapshot_cols):
+                history_year = st.number_input(
+                    "日付列の基準の年（最初の年なしラベルの年）", min_value=1990, max_value=2100,
+                    value=date.today().year, step=1, key="history_year"
+                )
+            # 基準の年を変えた場合は取り込み直す
+            history_hash = data_key if history_year is None else f'{data_key}:{history_year}'
+            with profiler.stage('history_import', rows=len(pl_engine.prompts), cols=len(snapshot_cols)):
+                if history_store.import_frames(df_price, df_qty, history_metal, book_name.rsplit('.', 1)[0],
+                                               source_hash=history_hash, name=book_name, year=history_year):
+                    st.caption(f"{book_name} を履歴ストアに取り込みました")
+            
+            col_prompt, col_last = st.columns(2)
+            with col_prompt:
+                history_prompts = history_store.prompts(history_metal)
+                drop_stale_choice("history_prompt", history_prompts)
+                history_prompt = st.selectbox("限月", history_prompts, key="history_prompt")
+            with col_last:
+                history_last = st.number_input("直近の日数", min_value=2, max_value=5000, value=250, step=50, key="history_last")
+            
+            with profiler.stage('history_query'):
+                df_history = history_store.prompt_pl(history_metal, history_prompt, last=history_last)
+            if df_history.empty:
+                st.info("日付として解釈できる期間のP/Lがまだ保存されていません。")
+            else:
+                df_history_cum = df_history[['Hold P/L', 'Actual P/L']].cumsum()
+                fig_history = go.Figure()
+                fig_history.add_trace(go.Scatter(x=df_history_cum.index, y=df_history_cum['Hold P/L'],
+                                                 mode='lines', name='累積 Hold P/L', line=dict(color='lightblue')))
+                fig_history.add_trace(go.Scatter(x=df_history_cum.index, y=df_history_cum['Actual P/L'],
+                                                 mode='lines', name='累積 Actual P/L', line=dict(color='lightcoral')))
+                fig_history.update_layout(
+                    title=f'{history_metal} {history_prompt} の累積P/L（直近{len(df_history)}期間、全ブック合計、USD）',
+                    xaxis_title='日付',
+                    yaxis_title='P/L (USD)',
+                    height=400
+                )
+                st.plotly_chart(fig_history, use_container_width=True)
+                with st.expander("保存済みのブック", expanded=False):
+                    st.dataframe(history_store.catalog(), use_container_width=True, hide_index=True)
+    
+    if active_view == views[1]:
         st.header("Cash-3M Spread分析")
         
         # Cashと3Mのデータを取得
-        cash_prompt = None
-        m3_prompt = None
-        
-        for prompt in prompts:
-            if 'Cash' in str(prompt) or 'cash' in str(prompt).lower():
-                cash_prompt = prompt
-            if '3M' in str(prompt) or '3m' in str(prompt).lower():
-                m3_prompt = prompt
+        cash_prompt, m3_prompt = pipeline['cash_3m']
         
         if cash_prompt is None or m3_prompt is None:
             st.warning("Cashまたは3Mのデータが見つかりません。Prompt名を確認してください。")
         else:
-            # 安全なデータ取得関数（Tab1と同じ）
-            def safe_get_value(df, idx, col, default=0):
-                """安全にデータを取得して数値に変換"""
-                try:
-                    if col not in df.columns:
-                        return default
-                    value = df.loc[idx, col]
-                    if pd.isna(value):
-                        return default
-                    if isinstance(value, str):
-                        try:
-                            return float(value.replace(',', ''))
-                        except:
-                            return default
-                    return float(value)
-                except (KeyError, ValueError, TypeError):
-                    return default
-            
-            # 価格データ
-            cash_price_start = safe_get_value(df_price, cash_prompt, date_start, 0)
-            cash_price_end = safe_get_value(df_price, cash_prompt, date_end, 0)
-            m3_price_start = safe_get_value(df_price, m3_prompt, date_start, 0)
-            m3_price_end = safe_get_value(df_price, m3_prompt, date_end, 0)
-            
-            # 数量データ
-            cash_qty_start = safe_get_value(df_qty, cash_prompt, date_start, 0)
-            cash_qty_end = safe_get_value(df_qty, cash_prompt, date_end, 0)
-            m3_qty_start = safe_get_value(df_qty, m3_prompt, date_start, 0)
-            m3_qty_end = safe_get_value(df_qty, m3_prompt, date_end, 0)
-            
-            # Spread計算
-            spread_start = cash_price_start - m3_price_start
-            spread_end = cash_price_end - m3_price_end
-            spread_change = spread_end - spread_start
-            
-            # Spread Qty計算（Cashと3Mの絶対値の小さい方）
-            spread_qty_start = min(abs(cash_qty_start), abs(m3_qty_start)) if cash_qty_start * m3_qty_start < 0 else 0
-            spread_qty_end = min(abs(cash_qty_end), abs(m3_qty_end)) if cash_qty_end * m3_qty_end < 0 else 0
-            
-            # Spread P/L計算
-            spread_pl_hold = spread_qty_start * spread_change
-            spread_pl_actual = spread_qty_end * spread_change
+            # Spread・Spread Qty・Spread P/L計算
+            spread = pipeline['cash_3m_spread']
             
             # 結果表示
-            spread_data = {
-                '項目': [
-                    f'Spread({date_start})',
-                    f'Spread({date_end})',
-                    'Spread変動',
-                    f'Spread Qty({date_start})',
-                    f'Spread Qty({date_end})',
-                    'Spread P/L(Hold)',
-                    'Spread P/L(Actual)'
-                ],
-                '値': [
-                    f"{spread_start:,.0f}",
-                    f"{spread_end:,.0f}",
-                    f"{spread_change:,.0f}",
-                    f"{spread_qty_start:,.0f}",
-                    f"{spread_qty_end:,.0f}",
-                    f"{spread_pl_hold:,.0f}",
-                    f"{spread_pl_actual:,.0f}"
-                ]
-            }
-            
-            df_spread = pd.DataFrame(spread_data)
+            df_spread = spread_table(spread, date_start, date_end)
+            df_spread['値'] = df_spread['値'].apply(lambda x: f"{x:,.0f}")
             st.dataframe(df_spread, use_container_width=True, hide_index=True)
+        
+        # 任意の限月ペアのSpread分析（全スナップショット列）
+        st.subheader("限月ペア別Spread推移")
+        pair_mode = st.radio(
+            "対象ペア",
+            ["Cash-3M", "隣接限月すべて", "任意のペア"],
+            horizontal=True,
+            key="spread_pair_mode"
+        )
+        if pair_mode == "隣接限月すべて":
+            spread_pairs = adjacent_pairs(pl_engine.prompts)
+        elif pair_mode == "任意のペア":
+            default_near, default_far = find_cash_3m(pl_engine.prompts)
+            df_pair_input = st.data_editor(
+                editor_data(
+                    "spread_pair_input",
+                    pd.DataFrame({
+                        '期近': [default_near or pl_engine.prompts[0]],
+                        '期先': [default_far or pl_engine.prompts[-1]]
+                    }),
+                    lambda df: pd.concat([df['期近'], df['期先']]).dropna().isin(pl_engine.prompts).all(),
+                ),
+                column_config={
+                    '期近': st.column_config.SelectboxColumn('期近', options=pl_engine.prompts, required=True),
+                    '期先': st.column_config.SelectboxColumn('期先', options=pl_engine.prompts, required=True),
+                },
+                num_rows="dynamic",
+                use_container_width=True,
+                hide_index=True,
+                key="spread_pair_input"
+            )
+            st.session_state["spread_pair_input_edited"] = df_pair_input
+            spread_pairs = [
+                (near, far) for near, far in zip(df_pair_input['期近'], df_pair_input['期先'])
+                if pd.notna(near) and pd.notna(far) and near != far
+            ]
+        else:
+            spread_pairs = [] if cash_prompt is None or m3_prompt is None else [(cash_prompt, m3_prompt)]
+        spread_pairs = [pair for pair in spread_pairs if pair[0] in pl_engine.prompts and pair[1] in pl_engine.prompts]
+        
+        if not spread_pairs:
+            st.warning("対象の限月ペアがありません。")
+        else:
+            incremental, _ = pipeline['incremental']
+            with profiler.stage('tab2_spread', rows=len(spread_pairs), cols=len(snapshot_cols)):
+                spread_result = incremental.spread_result(spread_pairs)
             
-            # Spread可視化
-            st.subheader("Spread推移")
+            df_spread_summary = spread_result.summary().reset_index()
+            for col in df_spread_summary.columns[1:]:
+                df_spread_summary[col] = df_spread_summary[col].apply(format_number)
+            st.dataframe(df_spread_summary, use_container_width=True, hide_index=True)
+            
+            # Spread可視化（全スナップショット）
+            df_levels = spread_result.level_frame()
             fig_spread = go.Figure()
-            fig_spread.add_trace(go.Scatter(
-                x=[date_start, date_end],
-                y=[spread_start, spread_end],
-                mode='lines+markers',
-                name='Spread',
-                line=dict(width=3),
-                marker=dict(size=10)
-            ))
+            for label, row in df_levels.iterrows():
+                fig_spread.add_trace(go.Scatter(
+                    x=[str(col) for col in df_levels.columns],
+                    y=row.to_numpy(),
+                    mode='lines+markers',
+                    name=label,
+                    line=dict(width=3 if len(df_levels) == 1 else 2),
+                    marker=dict(size=10 if len(df_levels) == 1 else 6)
+                ))
             fig_spread.update_layout(
-                title='Cash-3M Spread推移',
+                title='限月ペア別Spread推移',
                 xaxis_title='日付',
                 yaxis_title='Spread (USD)',
                 height=400
             )
-            st.plotly_chart(fig_spread, use_container_width=True)
+            with profiler.stage('tab2_chart'):
+                st.plotly_chart(fig_spread, use_container_width=True)
+            
+            with st.expander("ペア×期間 Spread P/L明細", expanded=False):
+                spread_kind = st.radio(
+                    "表示する戦略",
+                    ["Actual", "Hold"],
+                    horizontal=True,
+                    key="spread_kind"
+                )
+                df_spread_matrix = spread_result.frame(spread_kind.lower())
+                st.dataframe(format_table(df_spread_matrix), use_container_width=True)
     
-    with tab3:
+    if active_view == views[2]:
         st.header("戦略比較: Hold vs Actual")
         
         # 全体のP/L計算
-        df_pl_for_strategy = df_pl[df_pl['Prompt'] != '合計'].copy()
+        df_pl_for_strategy = pipeline['pl_table']
         
-        total_hold_pl = df_pl_for_strategy['Hold P/L'].sum()
-        total_actual_pl = df_pl_for_strategy['Actual P/L'].sum()
-        strategy_effect = total_actual_pl - total_hold_pl
+        strategy_totals = pipeline['strategy_totals']
+        total_hold_pl = strategy_totals['total_hold_pl']
+        total_actual_pl = strategy_totals['total_actual_pl']
+        strategy_effect = strategy_totals['strategy_effect']
         
         # 結果表示
         strategy_data = {
@@ -414,21 +803,54 @@ if df_price is not None and df_qty is not None:
         df_strategy = pd.DataFrame(strategy_data)
         st.dataframe(df_strategy, use_container_width=True, hide_index=True)
         
-        # ウォーターフォールチャート
+        # 要因分解: バケット内の入れ替え / バケット間の移転（ネットフラット） / 残余アウトライト
         st.subheader("P/L分解（ウォーターフォール）")
         
+        attribution_col1, attribution_col2 = st.columns(2)
+        with attribution_col1:
+            attribution_scope = "分析期間"
+            if len(snapshot_cols) > 2:
+                attribution_scope = st.radio(
+                    "分解の対象",
+                    ["分析期間", "全期間（連続する日付列ごとに分解して合計）"],
+                    horizontal=True,
+                    key="attribution_scope"
+                )
+        with attribution_col2:
+            attribution_levels = {"月": 'month', "年": 'year', "限月": 'prompt'}
+            attribution_level = attribution_levels[st.radio(
+                "バケット単位", list(attribution_levels), horizontal=True, key="attribution_bucket_level"
+            )]
+        
+        attribution_cols = [date_start, date_end] if attribution_scope == "分析期間" else snapshot_cols
+        with profiler.stage('tab3_attribution', rows=len(pl_engine.prompts), cols=len(attribution_cols)):
+            attribution = cached_result(
+                tuple(attribution_cols), attribution_level, 'attribution',
+                compute=lambda: attribute_strategy(pl_engine, attribution_cols, attribution_level)
+            )
+        
+        if attribution_scope == "分析期間":
+            waterfall_hold, waterfall_actual = total_hold_pl, total_actual_pl
+        else:
+            all_period_totals = cached_result('multi_period_totals', compute=lambda: pl_engine.multi_period(snapshot_cols).period_totals())
+            waterfall_hold = float(all_period_totals['Hold P/L'].sum())
+            waterfall_actual = float(all_period_totals['Actual P/L'].sum())
+        
+        steps = attribution.waterfall_steps(top=5)
+        waterfall_x = ["Hold P/L"] + [label for label, _ in steps] + ["Actual P/L"]
+        waterfall_y = [waterfall_hold] + [value for _, value in steps] + [waterfall_actual]
         fig_waterfall = go.Figure(go.Waterfall(
             name="P/L分解",
             orientation="v",
-            measure=["absolute", "relative", "total"],
-            x=["Hold P/L", "ポジション変更効果", "Actual P/L"],
-            y=[total_hold_pl, strategy_effect, total_actual_pl],
+            measure=["absolute"] + ["relative"] * len(steps) + ["total"],
+            x=waterfall_x,
+            y=waterfall_y,
             connector={"line": {"color": "rgb(63, 63, 63)"}},
             increasing={"marker": {"color": "green"}},
             decreasing={"marker": {"color": "red"}},
             totals={"marker": {"color": "blue"}},
             textposition="outside",
-            text=[f"{total_hold_pl:,.0f}", f"{strategy_effect:,.0f}", f"{total_actual_pl:,.0f}"]
+            text=[f"{value:,.0f}" for value in waterfall_y]
         ))
         
         fig_waterfall.update_layout(
@@ -437,21 +859,47 @@ if df_price is not None and df_qty is not None:
             height=500
         )
         
-        st.plotly_chart(fig_waterfall, use_container_width=True)
+        with profiler.stage('tab3_chart'):
+            st.plotly_chart(fig_waterfall, use_container_width=True)
+        st.caption(
+            f"ポジション変更効果 {waterfall_actual - waterfall_hold:,.0f} USD を、"
+            f"{BUCKET_LEVEL_NAMES[attribution_level]}単位のバケット内の入れ替え・バケット間の移転（ネット数量0）・"
+            "残余アウトライト（数量変化の合計 × 参照価格変動）に分解"
+        )
+        
+        # ドリルダウン
+        if len(attribution.periods) > 1:
+            with st.expander(f"期間別の分解（{len(attribution.periods):,}期間）"):
+                df_attribution_periods = attribution.period_totals().reset_index(names='期間')
+                st.dataframe(format_table(df_attribution_periods, df_attribution_periods.columns[1:]),
+                             use_container_width=True, hide_index=True)
+        
+        col_buckets, col_transfers = st.columns(2)
+        with col_buckets:
+            st.markdown(f"**{BUCKET_LEVEL_NAMES[attribution_level]}別の数量変化**")
+            st.dataframe(format_table(attribution.bucket_frame(), ['数量変化', '平均価格変動', 'バケット内の入れ替え']),
+                         use_container_width=True, hide_index=True)
+        with col_transfers:
+            st.markdown("**バケット間の移転**")
+            st.dataframe(format_table(attribution.transfer_frame(), ['移転数量', '効果']),
+                         use_container_width=True, hide_index=True)
         
         # 内訳テーブル
         st.subheader("限月別内訳")
-        breakdown_data = []
-        for _, row in df_pl_for_strategy.iterrows():
-            breakdown_data.append({
-                '限月': row['Prompt'],
-                'Hold P/L': f"{row['Hold P/L']:,.0f}",
-                'Actual P/L': f"{row['Actual P/L']:,.0f}",
-                '差分': f"{row['Actual P/L'] - row['Hold P/L']:,.0f}"
-            })
-        
-        df_breakdown = pd.DataFrame(breakdown_data)
-        st.dataframe(df_breakdown, use_container_width=True, hide_index=True)
+        df_breakdown = attribution.prompt_frame()
+        if attribution_scope == "分析期間":
+            df_breakdown.insert(2, 'Hold P/L', df_pl_for_strategy['Hold P/L'].to_numpy())
+            df_breakdown.insert(3, 'Actual P/L', df_pl_for_strategy['Actual P/L'].to_numpy())
+        drop_stale_choice("attribution_drilldown", ["（全体）"] + attribution.buckets)
+        bucket_filter = st.selectbox(
+            f"{BUCKET_LEVEL_NAMES[attribution_level]}で絞り込み",
+            ["（全体）"] + attribution.buckets,
+            key="attribution_drilldown"
+        )
+        if bucket_filter != "（全体）":
+            df_breakdown = df_breakdown[df_breakdown['バケット'] == bucket_filter]
+        st.dataframe(format_table(df_breakdown, ['Hold P/L', 'Actual P/L', '数量変化', '価格変動', '戦略効果']),
+                     use_container_width=True, hide_index=True)
         
         # 数量合計チェック
         total_qty_start = df_pl_for_strategy[f'数量({date_start})'].sum()
@@ -459,8 +907,82 @@ if df_price is not None and df_qty is not None:
         
         if abs(total_qty_start) > 0.01 or abs(total_qty_end) > 0.01:
             st.warning(f"⚠️ 数量合計が0ではありません。{date_start}: {total_qty_start:,.0f}, {date_end}: {total_qty_end:,.0f}")
-    
-    with tab4:
+
+        # 最適ヘッジの探索
+        st.subheader("最適ヘッジの探索")
+        st.caption(
+            f"{date_end} の数量を開始点に、全日付列（{len(snapshot_cols)}列）の期間ごとの価格変動から推定した共分散で"
+            "1期間P/Lの分散が最小になるポジションを探索します（ネット数量0・限月ごとの上限・取引ロット数の上限）。"
+        )
+        qty_actual = pl_engine.qty(date_end)
+        col_limit, col_lots, col_restarts, col_hedge_workers = st.columns(4)
+        with col_limit:
+            hedge_limit = st.number_input(
+                "限月ごとの上限（絶対値）", min_value=0.0, value=float(np.abs(qty_actual).max()), step=10.0,
+                key="hedge_limit"
+            )
+        with col_lots:
+            hedge_max_lots = st.number_input(
+                "取引ロット数の上限", min_value=0.0, value=float(np.abs(qty_actual).sum() / 4), step=10.0,
+                key="hedge_max_lots"
+            )
+        with col_restarts:
+            hedge_restarts = st.number_input("探索回数", min_value=1, max_value=64, value=2, key="hedge_restarts")
+        with col_hedge_workers:
+            hedge_workers = st.number_input("並列プロセス数", min_value=1, max_value=32, value=1, key="hedge_workers")
+        st.caption(
+            "計算時間は取引ロット数の上限と探索回数に応じて増えます（500限月×260列の目安: 既定の上限 Σ|数量|/4・2回で約0.2秒、"
+            "上限 Σ|数量|/2・4回で約9秒）。"
+        )
+
+        if st.checkbox("探索を実行", value=False, key="run_hedge"):
+            try:
+                with profiler.stage('tab3_hedge', rows=len(pl_engine.prompts), cols=len(snapshot_cols)):
+                    hedge = cached_result(
+                        tuple(snapshot_cols), date_end, hedge_limit, hedge_max_lots, int(hedge_restarts), 'hedge',
+                        compute=lambda: optimal_hedge(
+                            pl_engine, snapshot_cols, date_end, hedge_limit, hedge_max_lots,
+                            restarts=int(hedge_restarts), workers=int(hedge_workers)
+                        )
+                    )
+            except ValueError as e:
+                st.warning(str(e))
+            else:
+                col1, col2, col3 = st.columns(3)
+                col1.metric("P/L標準偏差（現在）", f"{hedge.std_current:,.0f} USD")
+                col2.metric(
+                    "P/L標準偏差（提案）", f"{hedge.std_proposed:,.0f} USD",
+                    delta=f"{hedge.std_proposed - hedge.std_current:,.0f} USD", delta_color="inverse"
+                )
+                col3.metric("取引ロット数", f"{hedge.lots_traded:,.0f}")
+                if hedge.over_limit.any():
+                    over_prompts = [p for p, over in zip(hedge.prompts, hedge.over_limit) if over]
+                    st.warning(
+                        f"⚠️ 提案数量が限月ごとの上限を超えている限月があります（現在の数量が上限を超えており、探索で上限内まで減らしていません）: "
+                        f"{', '.join(map(str, over_prompts))}"
+                    )
+
+                df_hedge = hedge.frame()
+                fig_hedge = go.Figure()
+                fig_hedge.add_trace(go.Bar(x=df_hedge['限月'], y=df_hedge['現在の数量'], name='現在', marker_color='lightcoral'))
+                fig_hedge.add_trace(go.Bar(x=df_hedge['限月'], y=df_hedge['提案数量'], name='提案', marker_color='seagreen'))
+                fig_hedge.update_layout(
+                    title='現在の数量と提案数量',
+                    xaxis_title='限月',
+                    yaxis_title='数量',
+                    barmode='group',
+                    height=400
+                )
+                with profiler.stage('tab3_hedge_chart'):
+                    st.plotly_chart(fig_hedge, use_container_width=True)
+
+                st.dataframe(
+                    format_table(df_hedge[(df_hedge['取引数量'] != 0) | df_hedge['上限超過']],
+                                 ['現在の数量', '提案数量', '取引数量', '上限']),
+                    use_container_width=True, hide_index=True
+                )
+
+    if active_view == views[3]:
         st.header("🔥 限月間P/L寄与分析（スプレッド損益）")
         
         st.markdown("""
@@ -473,123 +995,95 @@ if df_price is not None and df_qty is not None:
         - **対角線**：空白（i=j の場合は計算しない）
         """)
         
-        # Tab1で計算されたdf_plを使用
-        df_pl_for_contribution = df_pl[df_pl['Prompt'] != '合計'].copy()
+        # データの準備
+        prompts_list = list(pl_engine.prompts)
+        n = len(prompts_list)
         
-        if df_pl_for_contribution.empty:
+        if n == 0:
             st.warning("P/Lデータがありません。")
         else:
-            # データの準備
-            prompts_list = df_pl_for_contribution['Prompt'].tolist()
-            n = len(prompts_list)
-            
-            # 安全なデータ取得関数
-            def safe_get_value(df, idx, col, default=0):
-                """安全にデータを取得して数値に変換"""
-                try:
-                    if col not in df.columns:
-                        return default
-                    value = df.loc[idx, col]
-                    if pd.isna(value):
-                        return default
-                    if isinstance(value, str):
-                        try:
-                            return float(value.replace(',', ''))
-                        except:
-                            return default
-                    return float(value)
-                except (KeyError, ValueError, TypeError):
-                    return default
             
             # 戦略選択
             strategy_option = st.radio(
                 "分析戦略を選択",
                 ["Actual戦略", "Hold戦略", "差分（Actual - Hold）"],
-                horizontal=True
+                horizontal=True,
+                key="pair_strategy"
             )
             
-            # ダミーデータ生成関数（ヒートマップ用）
-            def generate_dummy_heatmap_data(strategy='actual'):
-                """
-                ダミーデータでヒートマップを生成
-                strategy: 'actual' または 'hold'
-                """
-                heatmap_data = np.zeros((n, n))
-                
-                # 各限月のP/Lを取得
-                pl_values = []
-                for prompt in prompts_list:
-                    if strategy == 'actual':
-                        pl = df_pl_for_contribution[df_pl_for_contribution['Prompt'] == prompt]['Actual P/L'].values
-                    else:  # hold
-                        pl = df_pl_for_contribution[df_pl_for_contribution['Prompt'] == prompt]['Hold P/L'].values
-                    
-                    if len(pl) > 0:
-                        pl_values.append(pl[0])
-                    else:
-                        pl_values.append(0)
-                
-                # ダミーデータ生成：各限月のP/Lを基に、ペア間で分配
-                np.random.seed(42)  # 再現性のため
-                
-                for i in range(n):
-                    for j in range(n):
-                        if i == j:
-                            # 対角線は空白
-                            heatmap_data[i, j] = np.nan
-                        else:
-                            # ダミー値：各限月のP/Lを基にランダムに分配
-                            base_value = (pl_values[i] + pl_values[j]) / 2
-                            # ランダムな係数（0.3～1.5倍）
-                            random_factor = np.random.uniform(0.3, 1.5)
-                            # 符号はランダム
-                            sign = np.random.choice([-1, 1])
-                            heatmap_data[i, j] = base_value * random_factor * sign
-                
-                return heatmap_data
-            
-            # ヒートマップデータの計算（ダミーデータ）
+            # ペアP/L（要求された戦略の段階だけを計算）
             if strategy_option == "Actual戦略":
-                heatmap_data = generate_dummy_heatmap_data('actual')
+                pair_data = pipeline['pairs_actual']
                 title_suffix = "（Actual戦略）"
             elif strategy_option == "Hold戦略":
-                heatmap_data = generate_dummy_heatmap_data('hold')
+                pair_data = pipeline['pairs_hold']
                 title_suffix = "（Hold戦略）"
             else:  # 差分
-                heatmap_data_actual = generate_dummy_heatmap_data('actual')
-                heatmap_data_hold = generate_dummy_heatmap_data('hold')
-                heatmap_data = heatmap_data_actual - heatmap_data_hold
+                pair_data = pipeline['pairs_diff']
                 title_suffix = "（Actual - Hold）"
             
             # セクション1: ヒートマップ表示
             st.subheader(f"1. 限月間スプレッドP/Lヒートマップ{title_suffix}")
             
+            # 集約単位（限月数が多い場合は月・年のテナーにまとめて表示）
+            level_labels = {"自動": None, "限月": 'prompt', "月": 'month', "年": 'year'}
+            level_choice = st.radio("集約単位", list(level_labels), horizontal=True, key="heatmap_bucket_level")
+            bucket_level = level_labels[level_choice] or auto_bucket_level(prompts_list, HEATMAP_MAX_AXIS)
+            
+            with profiler.stage('tab4_bucket', rows=n, cols=n) as stage_record:
+                axis_prompts = prompts_list
+                axis_pairs = pair_data
+                if bucket_level != 'prompt':
+                    # ドリルダウン: 選択したバケット内の限月を1段細かい単位で表示
+                    codes, bucket_labels = bucket_codes(axis_prompts, bucket_level)
+                    drop_stale_choice("heatmap_drilldown", ["（全体）"] + bucket_labels)
+                    drilldown = st.selectbox(
+                        f"ドリルダウン（{BUCKET_LEVEL_NAMES[bucket_level]}を選択）",
+                        ["（全体）"] + bucket_labels,
+                        key="heatmap_drilldown"
+                    )
+                    if drilldown != "（全体）":
+                        mask = codes == bucket_labels.index(drilldown)
+                        axis_prompts = [p for p, keep in zip(axis_prompts, mask) if keep]
+                        axis_pairs = axis_pairs.subset(mask)
+                        bucket_level = finer_level(bucket_level)
+                
+                if bucket_level == 'prompt':
+                    if len(axis_prompts) > HEATMAP_MAX_AXIS:
+                        # 限月単位で軸が長い場合は、ペアを持つ限月だけを表示
+                        held = np.zeros(len(axis_prompts), dtype=bool)
+                        held[axis_pairs.rows] = held[axis_pairs.cols] = True
+                        st.caption(f"{len(axis_prompts):,}限月のうち、逆方向のポジションのペアを持つ{int(held.sum()):,}限月を表示")
+                        axis_prompts = [p for p, keep in zip(axis_prompts, held) if keep]
+                        axis_pairs = axis_pairs.subset(held)
+                    axis_labels = axis_prompts
+                    axis_matrix = axis_pairs.to_dense()
+                else:
+                    codes, axis_labels = bucket_codes(axis_prompts, bucket_level)
+                    axis_matrix = axis_pairs.aggregate(codes, len(axis_labels))
+                    st.caption(
+                        f"{len(axis_prompts):,}限月を{len(axis_labels):,}個の{BUCKET_LEVEL_NAMES[bucket_level]}単位に集約"
+                        "（各セルは限月ペアP/Lの合計）"
+                    )
+                stage_record['rows'] = stage_record['cols'] = len(axis_labels)
+            
             # カラースケールの設定（マイナスからプラスまで）
             # NaNを除外して最大絶対値を計算
-            valid_values = heatmap_data[~np.isnan(heatmap_data)]
+            valid_values = axis_matrix[~np.isnan(axis_matrix)]
             if len(valid_values) > 0:
-                max_abs = max(abs(val) for val in valid_values)
+                max_abs = np.abs(valid_values).max()
                 if max_abs == 0:
                     max_abs = 1
             else:
                 max_abs = 1
             
-            # テキスト表示用の準備
-            text_data = []
-            for i in range(n):
-                row_text = []
-                for j in range(n):
-                    val = heatmap_data[i, j]
-                    if np.isnan(val):
-                        row_text.append('')
-                    else:
-                        row_text.append(f'{val:,.0f}')
-                text_data.append(row_text)
+            # セルの数値はブラウザ側で z から整形（大きなマトリクスでは表示しない）
+            show_cell_text = axis_matrix.size <= HEATMAP_TEXT_MAX_CELLS
             
             fig_heatmap = go.Figure(data=go.Heatmap(
-                z=heatmap_data,
-                x=prompts_list,
-                y=prompts_list,
+                z=axis_matrix,
+                x=axis_labels,
+                y=axis_labels,
                 colorscale=[
                     [0.0, 'darkred'],      # マイナス（濃い赤）
                     [0.25, 'red'],         # マイナス（赤）
@@ -600,9 +1094,9 @@ if df_price is not None and df_qty is not None:
                 zmid=0,  # 0を中心に色分け
                 zmin=-max_abs,
                 zmax=max_abs,
-                text=text_data,
-                texttemplate='%{text}',
+                texttemplate='%{z:,.0f}' if show_cell_text else None,
                 textfont={"size": 9},
+                hovertemplate='From: %{x}<br>To: %{y}<br>P/L: %{z:,.0f}<extra></extra>',
                 colorbar=dict(title="Spread P/L (USD)")
             ))
             
@@ -614,45 +1108,58 @@ if df_price is not None and df_qty is not None:
                 width=700
             )
             
-            st.plotly_chart(fig_heatmap, use_container_width=True)
+            with profiler.stage('tab4_heatmap_render'):
+                st.plotly_chart(fig_heatmap, use_container_width=True)
             
             # セクション2: ペア別P/Lランキング
             st.subheader("2. 限月ペア別P/Lランキング（絶対値順）")
             
-            # ペアデータを作成
-            pair_data = []
-            for i in range(n):
-                for j in range(n):
-                    if i != j:  # 対角線を除外
-                        pl = heatmap_data[i, j]
-                        if not np.isnan(pl):
-                            pair_data.append({
-                                'From': prompts_list[i],
-                                'To': prompts_list[j],
-                                'P/L (USD)': pl
-                            })
+            # 絞り込み条件
+            col_k, col_sign, col_bucket = st.columns([1, 1, 2])
+            with col_k:
+                top_k = st.number_input("表示件数", min_value=1, max_value=1000, value=20, step=10, key="pair_rank_top")
+            with col_sign:
+                sign_labels = {"すべて": None, "利益のみ": 'positive', "損失のみ": 'negative'}
+                sign_choice = st.radio("符号", list(sign_labels), horizontal=True, key="pair_rank_sign")
+            with col_bucket:
+                rank_level = {"月": 'month', "年": 'year'}[
+                    st.radio("テナー単位", ["月", "年"], horizontal=True, key="pair_rank_level")
+                ]
+                rank_codes, rank_buckets = bucket_codes(prompts_list, rank_level)
+                drop_stale_choice("pair_rank_buckets", rank_buckets)
+                selected_buckets = st.multiselect("テナーで絞り込み（未選択はすべて）", rank_buckets, key="pair_rank_buckets")
+                rank_legs = st.radio(
+                    "対象ペア", ["いずれかの限月が該当", "両方の限月が該当"], horizontal=True, key="pair_rank_legs"
+                )
             
-            if pair_data:
-                df_pairs = pd.DataFrame(pair_data)
-                # 絶対値で降順ソート
-                df_pairs['abs_pl'] = df_pairs['P/L (USD)'].abs()
-                df_pairs = df_pairs.sort_values('abs_pl', ascending=False).reset_index(drop=True)
-                df_pairs = df_pairs.drop('abs_pl', axis=1)
-                df_pairs['順位'] = range(1, len(df_pairs) + 1)
-                
-                # 順位を最初の列に
-                cols = ['順位'] + [col for col in df_pairs.columns if col != '順位']
-                df_pairs = df_pairs[cols]
+            prompt_mask = None
+            if selected_buckets:
+                selected_codes = [rank_buckets.index(bucket) for bucket in selected_buckets]
+                prompt_mask = np.isin(rank_codes, selected_codes)
+            
+            # 非ゼロのペア（各ペア1回）から部分選択で上位のみ取得
+            with profiler.stage('tab4_ranking', rows=pair_data.nnz, cols=1):
+                rank_rows, rank_cols, rank_values = pair_data.top(
+                    k=int(top_k),
+                    prompt_mask=prompt_mask,
+                    legs='any' if rank_legs == "いずれかの限月が該当" else 'both',
+                    sign=sign_labels[sign_choice],
+                )
+            
+            if len(rank_values) > 0:
+                df_pairs = pd.DataFrame({
+                    '順位': range(1, len(rank_values) + 1),
+                    'From': [prompts_list[i] for i in rank_rows],
+                    'To': [prompts_list[j] for j in rank_cols],
+                    'P/L (USD)': rank_values,
+                })
                 
                 # フォーマット
-                df_pairs_display = df_pairs.copy()
-                df_pairs_display['P/L (USD)'] = df_pairs_display['P/L (USD)'].apply(lambda x: f'{x:,.0f}')
-                
-                # 上位20件を表示
-                st.dataframe(df_pairs_display.head(20), use_container_width=True, hide_index=True)
+                df_pairs_display = format_table(df_pairs, ['P/L (USD)'])
+                st.dataframe(df_pairs_display, use_container_width=True, hide_index=True)
                 
-                # 合計P/L
-                total_spread_pl = df_pairs['P/L (USD)'].sum()
+                # 合計P/L（マトリクス全体、From/To 両方向を含む）
+                total_spread_pl = pair_data.total()
                 st.info(f"**スプレッドP/L合計**: {total_spread_pl:,.0f} USD")
             else:
                 st.warning("ペアデータがありません。")
@@ -684,6 +1191,159 @@ if df_price is not None and df_qty is not None:
                 - **セルの値**：そのペアのスプレッドP/L
                 - **対角線**：空白（同じ限月同士は計算しない）
                 """)
+    
+    if active_view == views[4]:
+        st.header("🧪 シナリオ分析（価格ショック）")
+        
+        st.markdown(f"""
+        **このタブでは**：限月カーブに価格ショックを与えた場合のP/Lを計算します。
+        - **Hold**：{date_start}の数量、**Actual**：{date_end}の数量（Tab1と同じ数量ベクトル）
+        - **平行シフト**：全限月の価格を同じ幅だけ変動
+        - **ティルト**：Cashを -ティルト/2、最期先を +ティルト/2 として線形に変動（期先 - Cash の価格差がティルト分変化）
+        """)
+        
+        # シナリオグリッドの設定
+        col_parallel, col_tilt = st.columns(2)
+        with col_parallel:
+            parallel_range = st.slider("平行シフト範囲 (USD)", -5000, 5000, (-2000, 2000), step=100, key="parallel_range")
+            parallel_steps = st.number_input("平行シフト分割数", min_value=2, max_value=200, value=40, key="parallel_steps")
+        with col_tilt:
+            tilt_range = st.slider("ティルト範囲 (USD)", -3000, 3000, (-1000, 1000), step=100, key="tilt_range")
+            tilt_steps = st.number_input("ティルト分割数", min_value=2, max_value=200, value=25, key="tilt_steps")
+        
+        parallel_shifts = np.linspace(parallel_range[0], parallel_range[1], int(parallel_steps))
+        tilts = np.linspace(tilt_range[0], tilt_range[1], int(tilt_steps))
+        
+        with profiler.stage('tab5_scenarios', rows=len(parallel_shifts) * len(tilts), cols=len(pl_engine.prompts)):
+            df_scenarios = scenario_grid_pl(pl_engine, date_start, date_end, parallel_shifts, tilts)
+        st.caption(f"シナリオ数: {len(df_scenarios):,}")
+        
+        scenario_strategy = st.radio(
+            "表示する戦略",
+            ["Actual P/L", "Hold P/L", "差分"],
+            horizontal=True,
+            key="scenario_strategy"
+        )
+        
+        # セクション1: シナリオグリッドのヒートマップ
+        st.subheader("1. シナリオ別P/Lグリッド")
+        grid_values = df_scenarios[scenario_strategy].to_numpy().reshape(len(parallel_shifts), len(tilts))
+        grid_max_abs = np.abs(grid_values).max() or 1
+        fig_grid = go.Figure(data=go.Heatmap(
+            z=grid_values.T,
+            x=parallel_shifts,
+            y=tilts,
+            colorscale='RdBu',
+            zmid=0,
+            zmin=-grid_max_abs,
+            zmax=grid_max_abs,
+            colorbar=dict(title="P/L (USD)")
+        ))
+        fig_grid.update_layout(
+            title=f"シナリオ別{scenario_strategy}（USD）",
+            xaxis_title="平行シフト (USD)",
+            yaxis_title="ティルト (USD)",
+            height=500
+        )
+        with profiler.stage('tab5_grid_chart'):
+            st.plotly_chart(fig_grid, use_container_width=True)
+        
+        # セクション2: 損失の大きいシナリオ
+        st.subheader("2. 損失の大きいシナリオ（上位10件）")
+        df_worst = df_scenarios.nsmallest(10, scenario_strategy)
+        st.dataframe(format_table(df_worst), use_container_width=True, hide_index=True)
+        
+        # セクション3: 限月別の個別ショック
+        st.subheader("3. 限月別の個別ショック")
+        df_custom = st.data_editor(
+            editor_data(
+                "custom_shock",
+                pd.DataFrame({'Prompt': pl_engine.prompts, 'ショック (USD)': 0.0}),
+                lambda df: df['Prompt'].tolist() == list(pl_engine.prompts),
+            ),
+            use_container_width=True,
+            hide_index=True,
+            disabled=['Prompt'],
+            key="custom_shock"
+        )
+        st.session_state["custom_shock_edited"] = df_custom
+        custom_hold, custom_actual = scenario_pl(
+            df_custom['ショック (USD)'].to_numpy(dtype='float64'),
+            pl_engine.qty(date_start),
+            pl_engine.qty(date_end)
+        )
+        st.info(
+            f"**Hold P/L**: {custom_hold[0]:,.0f} USD　"
+            f"**Actual P/L**: {custom_actual[0]:,.0f} USD　"
+            f"**差分**: {custom_actual[0] - custom_hold[0]:,.0f} USD"
+        )
+        
+        # セクション4: モンテカルロシミュレーション
+        st.subheader("4. モンテカルロ P/L分布・VaR")
+        st.caption(
+            f"価格シートの全日付列（{len(snapshot_cols)}列）の期間ごとの価格変動から限月間の共分散を推定し、"
+            "相関のある1期間の価格変動を生成します。"
+        )
+        col_paths, col_level, col_workers = st.columns(3)
+        with col_paths:
+            n_paths = st.select_slider("パス数", options=[10_000, 50_000, 100_000, 200_000, 500_000], value=100_000, key="mc_paths")
+        with col_level:
+            var_level = st.select_slider("信頼水準", options=[0.95, 0.975, 0.99, 0.995], value=0.99, key="var_level")
+        with col_workers:
+            mc_workers = st.number_input("並列プロセス数", min_value=1, max_value=32, value=1, key="mc_workers")
+        
+        if st.checkbox("シミュレーションを実行", value=False, key="run_montecarlo"):
+            try:
+                df_risk, pl_samples = cached_result(
+                    tuple(snapshot_cols), date_start, date_end, n_paths, var_level, 'montecarlo',
+                    compute=lambda: monte_carlo_risk(
+                        pl_engine, snapshot_cols, date_start, date_end,
+                        n_paths=n_paths, level=var_level, workers=int(mc_workers)
+                    )
+                )
+            except ValueError as e:
+                st.warning(str(e))
+            else:
+                st.dataframe(format_table(df_risk), use_container_width=True)
+                
+                # Hold / Actual で共通のビン
+                edges = np.histogram_bin_edges(pl_samples, bins=MC_HISTOGRAM_BINS)
+                centers = (edges[:-1] + edges[1:]) / 2
+                fig_mc = go.Figure()
+                for k, (name, color) in enumerate([('Hold P/L', 'lightblue'), ('Actual P/L', 'lightcoral')]):
+                    counts, _ = np.histogram(pl_samples[:, k], bins=edges)
+                    fig_mc.add_trace(go.Bar(x=centers, y=counts, width=np.diff(edges), name=name,
+                                            opacity=0.6, marker_color=color))
+                fig_mc.update_layout(
+                    title='1期間P/L分布（USD）',
+                    xaxis_title='P/L (USD)',
+                    yaxis_title='パス数',
+                    barmode='overlay',
+                    height=450
+                )
+                with profiler.stage('tab5_montecarlo_chart'):
+                    st.plotly_chart(fig_mc, use_container_width=True)
+    
+    # 計測結果の表示とログ出力
+    if profile_panel is not None:
+        with profile_panel:
+            df_profile = profiler.frame()
+            st.caption(f"計測合計: {profiler.total_seconds() * 1000:,.1f} ms（{len(df_profile)}段階）")
+            st.caption(f"このビューで要求された計算段階: {' → '.join(pipeline.computed)}")
+            st.dataframe(
+                df_profile,
+                column_config={
+                    'stage': '段階',
+                    'seconds': st.column_config.NumberColumn('時間 (秒)', format="%.4f"),
+                    'peak_mb': st.column_config.NumberColumn('ピークメモリ (MB)', format="%.2f"),
+                    'rows': '行数',
+                    'cols': '列数',
+                },
+                use_container_width=True,
+                hide_index=True
+            )
+        if profile_log_path:
+            profiler.write_log(profile_log_path, book=book_name, data_key=data_key)
 
 else:
     st.info("👈 サイドバーからExcelファイルをアップロードしてください")
@@ -701,3 +1361,4 @@ else:
     - 日付列には各時点の価格・数量を記載
     """)
 
+profiler.finish()
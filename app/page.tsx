@@ -7,10 +7,12 @@ import Tab2 from '@/components/Tab2'
 import Tab3 from '@/components/Tab3'
 import Tab4 from '@/components/Tab4'
 import { processExcelData } from '@/utils/dataProcessor'
+import { API_URL, uploadWorkbook } from '@/utils/api'
 
 export default function Home() {
   const [priceData, setPriceData] = useState<any>(null)
   const [qtyData, setQtyData] = useState<any>(null)
+  const [workbookId, setWorkbookId] = useState<string | null>(null)
   const [dateStart, setDateStart] = useState<string>('')
   const [dateEnd, setDateEnd] = useState<string>('')
   const [activeTab, setActiveTab] = useState(0)
@@ -21,6 +23,18 @@ export default function Home() {
     if (!file) return
 
     try {
+      if (API_URL) {
+        // APIサーバーで一度だけ解析し、各タブは集計済みの結果を取得する
+        const meta = await uploadWorkbook(file)
+        setWorkbookId(meta.id)
+        setPriceData(null)
+        setQtyData(null)
+        setDateStart(meta.dateStart)
+        setDateEnd(meta.dateEnd)
+        setError('')
+        return
+      }
+
       const data = await file.arrayBuffer()
       const workbook = XLSX.read(data, { type: 'array' })
       
@@ -31,6 +45,7 @@ export default function Home() {
         return
       }
 
+      setWorkbookId(null)
       setPriceData(result.priceData)
       setQtyData(result.qtyData)
       setDateStart(result.dateStart)
@@ -41,6 +56,8 @@ export default function Home() {
     }
   }
 
+  const loaded = workbookId !== null || (priceData && qtyData)
+
   const tabs = [
     { id: 0, label: '📊 限月別P/L', component: Tab1 },
     { id: 1, label: '📈 Spread分析', component: Tab2 },
@@ -99,7 +116,7 @@ export default function Home() {
               {error}
             </div>
           )}
-          {priceData && qtyData && (
+          {loaded && (
             <div style={{ 
               padding: '0.75rem',
               marginTop: '1rem',
@@ -134,7 +151,7 @@ export default function Home() {
           非鉄金属ポジション損益シミュレーター（MVP）
         </h1>
 
-        {!priceData || !qtyData ? (
+        {!loaded ? (
           <div style={{ 
             padding: '3rem', 
             textAlign: 'center', 
@@ -231,6 +248,7 @@ export default function Home() {
                     qtyData={qtyData}
                     dateStart={dateStart}
                     dateEnd={dateEnd}
+                    workbookId={workbookId}
                   />
                 </div>
               )
@@ -0,0 +1,233 @@
+"""計算パイプラインのベンチマーク
+
+合成した価格・数量ワークブック（限月数 × 日付列数）を使い、次の各段階を個別に計測する。
+
+- load: ワークブック読み込み（engine.loader）
+- columns: 数値列の検出（engine.columns）
+- tab1_pl: PLEngine構築と限月別P/Lテーブル
+- tab2_spread: 隣接限月すべてのSpread系列（全日付列）
+- tab4_pairs: 限月ペアP/Lマトリクス（Actual / Hold / 差分）
+- tab4_sparse_pairs: 非ゼロの限月ペアだけの疎なペアP/L（Actual / Hold / 差分）
+- format: Tab1テーブルの表示用フォーマット
+
+結果はJSON Lines形式で出力し、--compare で以前の結果と比較できる。
+
+使い方:
+    python -m benchmarks.bench --prompts 10,100,500 --dates 2,100,1000 --out bench.jsonl
+    python -m benchmarks.bench --preset quick --compare bench_before.jsonl
+    python -m benchmarks.bench --prompts 5000 --dates 2 --held 0.02 --stages tab4_pairs,tab4_sparse_pairs
+"""
+
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from engine.columns import default_period, find_common_columns
+from engine.formatting import format_table
+from engine.loader import load_position_workbook
+from engine.pl import PLEngine
+from engine.spread import adjacent_pairs, spread_series
+
+PRESETS = {
+    'quick': {'prompts': [10, 100], 'dates': [2, 50]},
+    'default': {'prompts': [10, 100, 500], 'dates': [2, 100, 1000]},
+    'full': {'prompts': [10, 100, 500, 2000], 'dates': [2, 100, 1000, 5000]},
+}
+
+
+def prompt_labels(n_prompts):
+    """Cash、3M、M+4 … の限月ラベル"""
+    labels = ['Cash', '3M'] + [f'M+{i}' for i in range(4, n_prompts + 2)]
+    return labels[:n_prompts]
+
+
+def synthetic_frames(n_prompts, n_dates, seed=0, held=None):
+    """合成した価格・数量のDataFrame（数量は各日付で合計0）
+
+    held: 数量を持つ限月の割合（省略時はすべての限月。日次プロンプトのようにほとんどが0のカーブ用）
+    """
+    rng = np.random.default_rng(seed)
+    prompts = prompt_labels(n_prompts)
+    columns = [f'D{j + 1:05d}' for j in range(n_dates)]
+
+    curve = 27000 - 50 * np.arange(n_prompts)[:, None]
+    level = np.cumsum(rng.normal(0, 300, n_dates))[None, :]
+    prices = np.round(curve + level + np.cumsum(rng.normal(0, 30, (n_prompts, n_dates)), axis=1))
+
+    quantities = np.round(rng.normal(0, 100, (n_prompts, n_dates)))
+    if held is not None:
+        quantities[rng.random(n_prompts) >= held] = 0.0
+    quantities[0] -= quantities.sum(axis=0)
+
+    df_price = pd.DataFrame(prices, index=pd.Index(prompts, name='Prompt'), columns=columns)
+    df_qty = pd.DataFrame(quantities, index=pd.Index(prompts, name='Prompt'), columns=columns)
+    return df_price, df_qty
+
+
+def synthetic_workbook(n_prompts, n_dates, seed=0, held=None):
+    """合成ワークブック（価格・数量シート）のバイト列"""
+    df_price, df_qty = synthetic_frames(n_prompts, n_dates, seed, held)
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, df in (('価格', df_price), ('数量', df_qty)):
+        sheet = workbook.create_sheet(name)
+        sheet.append(['Prompt'] + list(df.columns))
+        for prompt, row in zip(df.index, df.to_numpy().tolist()):
+            sheet.append([prompt] + row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _timed(func, repeat):
+    """func を repeat 回実行し、最短時間（秒）と最後の戻り値を返す"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def run_case(n_prompts, n_dates, repeat=3, max_load_cells=2_000_000, stages=None, held=None):
+    """1サイズ分の各段階を計測し、段階ごとの結果を返す"""
+    results = []
+
+    def record(stage, seconds, **extra):
+        results.append({'stage': stage, 'prompts': n_prompts, 'dates': n_dates, 'seconds': seconds, **extra})
+
+    def wanted(stage):
+        return stages is None or stage in stages
+
+    if wanted('load') and n_prompts * n_dates <= max_load_cells:
+        data = synthetic_workbook(n_prompts, n_dates, held=held)
+        seconds, workbook = _timed(lambda: load_position_workbook(data), repeat)
+        record('load', seconds, bytes=len(data))
+        df_price, df_qty = workbook['df_price'], workbook['df_qty']
+    else:
+        df_price, df_qty = synthetic_frames(n_prompts, n_dates, held=held)
+
+    seconds, columns_info = _timed(lambda: find_common_columns(df_price, df_qty), repeat)
+    if wanted('columns'):
+        record('columns', seconds)
+    common_cols = columns_info['common_cols']
+    start, end = default_period(common_cols)
+
+    def tab1():
+        pl_engine = PLEngine(df_price, df_qty)
+        return pl_engine, pl_engine.pl_table(start, end)
+
+    seconds, (pl_engine, df_pl) = _timed(tab1, repeat)
+    if wanted('tab1_pl'):
+        record('tab1_pl', seconds)
+
+    if wanted('tab2_spread'):
+        pairs = adjacent_pairs(pl_engine.prompts)
+        seconds, _ = _timed(lambda: spread_series(pl_engine, pairs, common_cols), repeat)
+        record('tab2_spread', seconds, pairs=len(pairs))
+
+    if wanted('tab4_pairs'):
+        def tab4():
+            return [pl_engine.pair_pl(start, end, strategy) for strategy in ('actual', 'hold', 'diff')]
+        seconds, _ = _timed(tab4, repeat)
+        record('tab4_pairs', seconds)
+
+    if wanted('tab4_sparse_pairs'):
+        def tab4_sparse():
+            return [pl_engine.sparse_pair_pl(start, end, strategy) for strategy in ('actual', 'hold', 'diff')]
+        seconds, pairs = _timed(tab4_sparse, repeat)
+        record('tab4_sparse_pairs', seconds, nnz=pairs[0].nnz)
+
+    if wanted('format'):
+        numeric_cols = [col for col in df_pl.columns if col != 'Prompt']
+        seconds, _ = _timed(lambda: format_table(df_pl, numeric_cols), repeat)
+        record('format', seconds)
+
+    return results
+
+
+def environment():
+    """計測環境の情報"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, check=False).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+    }
+
+
+def compare(results, baseline_path):
+    """以前の結果（JSON Lines）と段階・サイズごとに比較した表"""
+    keys = ['stage', 'prompts', 'dates']
+    # 同じ条件が複数回記録されている場合は最新の結果を使用
+    baseline = pd.read_json(baseline_path, lines=True).drop_duplicates(keys, keep='last')
+    current = pd.DataFrame(results)
+    merged = current[keys + ['seconds']].merge(
+        baseline[keys + ['seconds']], on=keys, how='left', suffixes=('', '_baseline')
+    )
+    merged['ratio'] = merged['seconds'] / merged['seconds_baseline']
+    return merged
+
+
+def _int_list(text):
+    return [int(v) for v in text.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="読み込み・P/L・Spread・ヒートマップ計算のベンチマーク")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='default', help="計測サイズのプリセット")
+    parser.add_argument('--prompts', type=_int_list, help="限月数（カンマ区切り、プリセットより優先）")
+    parser.add_argument('--dates', type=_int_list, help="日付列数（カンマ区切り、プリセットより優先）")
+    parser.add_argument('--stages', help="計測する段階（カンマ区切り、省略時はすべて）")
+    parser.add_argument('--repeat', type=int, default=3, help="各段階の繰り返し回数（最短時間を記録）")
+    parser.add_argument('--max-load-cells', type=int, default=2_000_000,
+                        help="このセル数を超えるサイズではワークブック読み込みを計測しない")
+    parser.add_argument('--held', type=float, help="数量を持つ限月の割合（省略時はすべての限月）")
+    parser.add_argument('--out', help="結果を追記するJSON Linesファイル")
+    parser.add_argument('--compare', help="比較対象の以前の結果（JSON Lines）")
+    args = parser.parse_args(argv)
+
+    prompts = args.prompts or PRESETS[args.preset]['prompts']
+    dates = args.dates or PRESETS[args.preset]['dates']
+    stages = set(args.stages.split(',')) if args.stages else None
+    env = environment()
+
+    results = []
+    for n_prompts in prompts:
+        for n_dates in dates:
+            for row in run_case(n_prompts, n_dates, repeat=args.repeat,
+                                max_load_cells=args.max_load_cells, stages=stages, held=args.held):
+                row.update(env)
+                results.append(row)
+                print(f"{row['stage']:<17} prompts={n_prompts:>5} dates={n_dates:>5} {row['seconds'] * 1000:>10.2f} ms",
+                      file=sys.stderr)
+
+    if args.out:
+        with open(args.out, 'a', encoding='utf-8') as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+    else:
+        for row in results:
+            print(json.dumps(row, ensure_ascii=False))
+
+    if args.compare:
+        print(compare(results, args.compare).to_string(index=False), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
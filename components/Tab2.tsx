@@ -3,16 +3,25 @@
 import { useMemo } from 'react'
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts'
 import { safeGetValue } from '@/utils/calculations'
+import { useTabData } from '@/utils/api'
 
 interface Tab2Props {
   priceData: any
   qtyData: any
   dateStart: string
   dateEnd: string
+  workbookId?: string | null
 }
 
-export default function Tab2({ priceData, qtyData, dateStart, dateEnd }: Tab2Props) {
+export default function Tab2({ priceData, qtyData, dateStart, dateEnd, workbookId }: Tab2Props) {
+  const remote = useTabData<{ spread: any }>(workbookId, 'tab2', { start: dateStart, end: dateEnd })
+
   const spreadData = useMemo(() => {
+    if (workbookId) {
+      // APIサーバーで計算済みのSpread
+      return remote.data ? remote.data.spread : null
+    }
+
     const prompts = Object.keys(priceData).filter(p => priceData[p] && qtyData[p])
     
     // Cashと3Mを検出
@@ -72,12 +81,16 @@ export default function Tab2({ priceData, qtyData, dateStart, dateEnd }: Tab2Pro
       spreadPLHold,
       spreadPLActual
     }
-  }, [priceData, qtyData, dateStart, dateEnd])
+  }, [priceData, qtyData, dateStart, dateEnd, workbookId, remote.data])
 
   const formatNumber = (num: number) => {
     return new Intl.NumberFormat('ja-JP').format(Math.round(num))
   }
 
+  if (workbookId && !remote.data && !remote.error) {
+    return <div style={{ color: '#808495', fontSize: '0.875rem' }}>計算中...</div>
+  }
+
   if (!spreadData) {
     return (
       <div>
@@ -1,20 +1,18 @@
 'use client'
 
-import { useMemo } from 'react'
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, Cell } from 'recharts'
-import { calculatePLData } from '@/utils/calculations'
+import { usePLData } from '@/utils/api'
 
 interface Tab3Props {
   priceData: any
   qtyData: any
   dateStart: string
   dateEnd: string
+  workbookId?: string | null
 }
 
-export default function Tab3({ priceData, qtyData, dateStart, dateEnd }: Tab3Props) {
-  const plData = useMemo(() => {
-    return calculatePLData(priceData, qtyData, dateStart, dateEnd)
-  }, [priceData, qtyData, dateStart, dateEnd])
+export default function Tab3({ priceData, qtyData, dateStart, dateEnd, workbookId }: Tab3Props) {
+  const plData = usePLData(priceData, qtyData, dateStart, dateEnd, workbookId)
 
   const totalHoldPL = plData.reduce((sum, d) => sum + d.holdPL, 0)
   const totalActualPL = plData.reduce((sum, d) => sum + d.actualPL, 0)
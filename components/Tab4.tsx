@@ -2,21 +2,20 @@
 
 import { useMemo, useState } from 'react'
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, Cell } from 'recharts'
-import { calculatePLData } from '@/utils/calculations'
+import { Column, decodeMatrix, usePLData, useTabData } from '@/utils/api'
 
 interface Tab4Props {
   priceData: any
   qtyData: any
   dateStart: string
   dateEnd: string
+  workbookId?: string | null
 }
 
-export default function Tab4({ priceData, qtyData, dateStart, dateEnd }: Tab4Props) {
+export default function Tab4({ priceData, qtyData, dateStart, dateEnd, workbookId }: Tab4Props) {
   const [strategy, setStrategy] = useState<'actual' | 'hold' | 'diff'>('actual')
 
-  const plData = useMemo(() => {
-    return calculatePLData(priceData, qtyData, dateStart, dateEnd)
-  }, [priceData, qtyData, dateStart, dateEnd])
+  const plData = usePLData(priceData, qtyData, dateStart, dateEnd, workbookId)
 
   const generateDummyHeatmapData = (strategyType: 'actual' | 'hold') => {
     const n = plData.length
@@ -56,7 +55,15 @@ export default function Tab4({ priceData, qtyData, dateStart, dateEnd }: Tab4Pro
     [plData]
   )
 
-  const currentData = strategy === 'diff'
+  // APIを使う場合はサーバーで計算・集約済みの限月ペアP/Lマトリクス
+  const remote = useTabData<{ labels: string[]; matrix: Column }>(
+    workbookId, 'tab4', { start: dateStart, end: dateEnd, strategy }
+  )
+  const remoteData = useMemo(() => (remote.data ? decodeMatrix(remote.data.matrix) : []), [remote.data])
+
+  const currentData = workbookId
+    ? remoteData
+    : strategy === 'diff'
     ? actualData.map((row, i) => row.map((val, j) => {
         const actualVal = actualData[i][j]
         const holdVal = holdData[i][j]
@@ -67,7 +74,9 @@ export default function Tab4({ priceData, qtyData, dateStart, dateEnd }: Tab4Pro
     ? actualData
     : holdData
 
-  const currentPrompts = strategy === 'actual' ? actualPrompts : holdPrompts
+  const currentPrompts = workbookId
+    ? (remote.data ? remote.data.labels : [])
+    : strategy === 'actual' ? actualPrompts : holdPrompts
 
   // 最大絶対値を計算
   const maxAbs = useMemo(() => {
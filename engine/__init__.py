@@ -0,0 +1,19 @@
+"""非鉄ポジションP/Lシミュレーターの計算エンジン
+
+Streamlit (app.py) から独立してimportできる計算ロジックをまとめたパッケージ。
+"""
+
+from engine.loader import detect_sheets, load_position_workbook
+from engine.pairs import pair_pl_matrix
+from engine.pl import MultiPeriodPL, PLEngine, align_frames, to_float_frame, to_numeric_frame
+
+__all__ = [
+    'MultiPeriodPL',
+    'PLEngine',
+    'align_frames',
+    'detect_sheets',
+    'load_position_workbook',
+    'pair_pl_matrix',
+    'to_float_frame',
+    'to_numeric_frame',
+]
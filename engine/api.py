@@ -0,0 +1,444 @@
+"""計算エンジンのHTTP/JSON API
+
+Next.js版（ブラウザ）とStreamlit版で同じ計算エンジンを使うためのローカルサーバー。
+ワークブックは登録時に一度だけ解析し（キー: ファイル内容ハッシュ）、PLEngine と
+タブごとの計算結果（エンコード済みの応答）をサーバー側のLRUキャッシュに保持する。
+
+エンドポイント（start / end は日付列のラベル、省略時は既定の分析期間）:
+    POST /workbooks                      xlsxのバイト列を登録 → id・限月・日付列・既定の分析期間
+    GET  /workbooks/{id}                 登録済みワークブックの情報
+    GET  /workbooks/{id}/tab1            限月別P/L
+    GET  /workbooks/{id}/tab2            Cash-3M Spread（全日付列のSpread水準を含む）
+    GET  /workbooks/{id}/tab3?level=     戦略比較と戦略効果の要因分解
+    GET  /workbooks/{id}/tab4?strategy=&level=&top=   限月ペアP/Lマトリクス（集約済み）と上位ペア
+
+表は {列名: 配列} の列指向で返す。encoding=binary を指定すると数値配列を Plotly の
+typed array と同じ {"dtype": "f8", "bdata": base64, "shape": "行, 列"}（リトルエンディアン）で返す。
+JSONの配列では NaN を null にする。
+
+使い方:
+    python -m engine.api [--host 127.0.0.1] [--port 8000] [--allow-origin http://localhost:3000]
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import re
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from engine.attribution import attribute_strategy
+from engine.cache import LRUCache, content_hash, result_cache, workbook_cache
+from engine.columns import default_period, find_common_columns
+from engine.loader import load_position_workbook
+from engine.pl import PLEngine
+from engine.snapshots import snapshot_axis
+from engine.spread import cash_3m_spread, find_cash_3m, spread_series
+from engine.tenor import auto_bucket_level, bucket_codes
+
+# ヒートマップの軸の上限（app.py と同じ。自動集約・限月単位の表示限月数）
+HEATMAP_MAX_AXIS = 60
+
+# アップロードの上限（バイト）
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+
+# この大きさ以上の応答は gzip で圧縮（クライアントが対応している場合）
+GZIP_MIN_BYTES = 1024
+
+_PATH = re.compile(r'^/workbooks(?:/([0-9a-f]{32})(?:/(tab[1-4]))?)?/?$')
+_STRATEGIES = ('actual', 'hold', 'diff')
+_LEVELS = ('auto', 'prompt', 'month', 'year')
+
+
+class ApiError(Exception):
+    """HTTPステータスつきのエラー（応答は {"error": メッセージ}）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class WorkbookSession:
+    """登録済みワークブック（共通列の検出・時系列の並べ替え・PLEngine の構築は登録時に1回）"""
+
+    def __init__(self, key, workbook):
+        common_cols = find_common_columns(
+            workbook['df_price'], workbook['df_qty'], workbook.get('price_validity'), workbook.get('qty_validity')
+        )['common_cols']
+        if len(common_cols) < 2:
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, "価格と数量のデータに共通の日付列が2つ以上必要です。")
+
+        self.key = key
+        self.columns = list(snapshot_axis(common_cols).columns)
+        self.default_period = default_period(common_cols)
+        self.engine = PLEngine(workbook['df_price'], workbook['df_qty'])
+        self.cash_prompt, self.m3_prompt = find_cash_3m(self.engine.prompts)
+        self._labels = {str(col): col for col in self.columns}
+
+    def meta(self):
+        start, end = self.default_period
+        return {
+            'id': self.key,
+            'prompts': [str(p) for p in self.engine.prompts],
+            'columns': list(self._labels),
+            'dateStart': str(start),
+            'dateEnd': str(end),
+            'cashPrompt': None if self.cash_prompt is None else str(self.cash_prompt),
+            'm3Prompt': None if self.m3_prompt is None else str(self.m3_prompt),
+        }
+
+    def period(self, query):
+        """クエリの start / end を日付列のラベルに変換（省略時は既定の分析期間）"""
+        period = []
+        for name, default in zip(('start', 'end'), self.default_period):
+            text = query.get(name)
+            if text is None:
+                period.append(default)
+            elif text in self._labels:
+                period.append(self._labels[text])
+            else:
+                raise ApiError(HTTPStatus.BAD_REQUEST, f"日付列 {text} がありません。")
+        return tuple(period)
+
+    def cached(self, *key, compute):
+        """同じワークブック・同じ条件の計算結果を再利用"""
+        return result_cache.get_or_compute((self.key,) + key, compute)
+
+
+# 登録済みワークブック（キー: ファイル内容ハッシュ）
+sessions = LRUCache(max_entries=8)
+
+
+def register_workbook(data):
+    """xlsxのバイト列を登録（同じ内容なら解析済みのセッションを返す）"""
+    key = content_hash(data)
+
+    def create():
+        try:
+            workbook = workbook_cache.get_or_compute(key, lambda: load_position_workbook(data))
+        except Exception as e:
+            raise ApiError(HTTPStatus.UNPROCESSABLE_ENTITY, f"ワークブックを読み込めません: {e}")
+        return WorkbookSession(key, workbook)
+
+    return sessions.get_or_compute(key, create)
+
+
+def get_session(key):
+    session = sessions.get(key)
+    if session is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, "ワークブックが登録されていません。再度アップロードしてください。")
+    return session
+
+
+def tab1_payload(session, start, end):
+    """限月別P/L（列名は Next.js の PLData と同じ）"""
+    engine = session.engine
+    price_start, price_end = engine.price(start), engine.price(end)
+    qty_start, qty_end = engine.qty(start), engine.qty(end)
+    price_change = price_end - price_start
+    hold, actual = qty_start * price_change, qty_end * price_change
+    return {
+        'start': start,
+        'end': end,
+        'table': {
+            'prompt': engine.prompts,
+            'qtyStart': qty_start,
+            'qtyEnd': qty_end,
+            'priceStart': price_start,
+            'priceEnd': price_end,
+            'priceChange': price_change,
+            'holdPL': hold,
+            'actualPL': actual,
+        },
+        'totals': {
+            'qtyStart': qty_start.sum(),
+            'qtyEnd': qty_end.sum(),
+            'holdPL': hold.sum(),
+            'actualPL': actual.sum(),
+            'strategyEffect': actual.sum() - hold.sum(),
+        },
+    }
+
+
+def tab2_payload(session, start, end):
+    """Cash-3M Spread（Cash・3Mが見つからなければ spread は null）"""
+    cash, m3 = session.cash_prompt, session.m3_prompt
+    if cash is None or m3 is None:
+        return {'start': start, 'end': end, 'spread': None, 'levels': None}
+
+    spread = cash_3m_spread(session.engine, start, end, cash, m3)
+    series = spread_series(session.engine, [(cash, m3)], session.columns)
+    return {
+        'start': start,
+        'end': end,
+        'spread': {
+            'cashPrompt': cash,
+            'm3Prompt': m3,
+            'spreadStart': spread['spread_start'],
+            'spreadEnd': spread['spread_end'],
+            'spreadChange': spread['spread_change'],
+            'spreadQtyStart': spread['spread_qty_start'],
+            'spreadQtyEnd': spread['spread_qty_end'],
+            'spreadPLHold': spread['spread_pl_hold'],
+            'spreadPLActual': spread['spread_pl_actual'],
+        },
+        'levels': {'date': series.columns, 'spread': series.levels[0]},
+    }
+
+
+def tab3_payload(session, start, end, level='month'):
+    """戦略比較（合計・限月別）と分析期間の戦略効果の要因分解"""
+    payload = tab1_payload(session, start, end)
+    table = payload['table']
+    result = {
+        'start': start,
+        'end': end,
+        'totals': payload['totals'],
+        'table': {
+            'prompt': table['prompt'],
+            'holdPL': table['holdPL'],
+            'actualPL': table['actualPL'],
+            'strategyEffect': table['actualPL'] - table['holdPL'],
+        },
+    }
+
+    attribution = attribute_strategy(session.engine, [start, end], level)
+    steps = attribution.waterfall_steps()
+    buckets = attribution.bucket_frame()
+    transfers = attribution.transfer_frame(k=20)
+    result['attribution'] = {
+        'level': level,
+        'waterfall': {'label': [label for label, _ in steps], 'value': np.array([value for _, value in steps])},
+        'buckets': {
+            'bucket': buckets['バケット'].tolist(),
+            'qtyDelta': buckets['数量変化'].to_numpy(),
+            'priceChange': buckets['平均価格変動'].to_numpy(),
+            'intra': buckets['バケット内の入れ替え'].to_numpy(),
+        },
+        'transfers': {
+            'from': transfers['From'].tolist(),
+            'to': transfers['To'].tolist(),
+            'quantity': transfers['移転数量'].to_numpy(),
+            'effect': transfers['効果'].to_numpy(),
+        },
+    }
+    return result
+
+
+def tab4_payload(session, start, end, strategy='actual', level='auto', top=20):
+    """限月ペアP/Lマトリクス（軸が HEATMAP_MAX_AXIS 以下になるよう集約）と絶対値の大きいペア
+
+    限月単位で限月数が多い場合は、逆方向のポジションのペアを持つ限月だけを軸にする（app.py と同じ）。
+    """
+    pairs = session.cached(start, end, strategy, compute=lambda: session.engine.sparse_pair_pl(start, end, strategy))
+    prompts = session.engine.prompts
+    if level == 'auto':
+        level = auto_bucket_level(prompts, HEATMAP_MAX_AXIS)
+
+    if level == 'prompt':
+        axis_pairs = pairs
+        labels = prompts
+        if len(prompts) > HEATMAP_MAX_AXIS:
+            held = np.zeros(len(prompts), dtype=bool)
+            held[pairs.rows] = held[pairs.cols] = True
+            axis_pairs = pairs.subset(held)
+            labels = [p for p, keep in zip(prompts, held) if keep]
+        matrix = axis_pairs.to_dense()
+    else:
+        codes, labels = bucket_codes(prompts, level)
+        matrix = pairs.aggregate(codes, len(labels))
+
+    rows, cols, values = pairs.top(k=top)
+    prompt_labels = np.asarray([str(p) for p in prompts], dtype=object)
+    return {
+        'start': start,
+        'end': end,
+        'strategy': strategy,
+        'level': level,
+        'labels': labels,
+        'matrix': matrix.astype(np.float32),
+        'total': pairs.total(),
+        'nnz': pairs.nnz,
+        'top': {'from': prompt_labels[rows], 'to': prompt_labels[cols], 'pl': values},
+    }
+
+
+def _query_choice(query, name, choices, default):
+    value = query.get(name, default)
+    if value not in choices:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} は {' / '.join(choices)} のいずれかを指定してください。")
+    return value
+
+
+def _query_int(query, name, default, low, high):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} は整数で指定してください。")
+    return min(max(value, low), high)
+
+
+def tab_payload(session, tab, query):
+    """タブの応答（クエリを検証し、計算結果をサーバー側で再利用）"""
+    start, end = session.period(query)
+    if tab == 'tab1':
+        return session.cached(start, end, 'api_tab1', compute=lambda: tab1_payload(session, start, end))
+    if tab == 'tab2':
+        return session.cached(start, end, 'api_tab2', compute=lambda: tab2_payload(session, start, end))
+    if tab == 'tab3':
+        level = _query_choice(query, 'level', _LEVELS[1:], 'month')
+        return session.cached(start, end, level, 'api_tab3', compute=lambda: tab3_payload(session, start, end, level))
+    strategy = _query_choice(query, 'strategy', _STRATEGIES, 'actual')
+    level = _query_choice(query, 'level', _LEVELS, 'auto')
+    top = _query_int(query, 'top', 20, 1, 1000)
+    return session.cached(start, end, strategy, level, top, 'api_tab4',
+                          compute=lambda: tab4_payload(session, start, end, strategy, level, top))
+
+
+def typed_array(values):
+    """数値配列を Plotly の typed array 形式（base64、リトルエンディアン）に変換"""
+    values = np.asarray(values)
+    dtype = '<f4' if values.dtype == np.float32 else '<f8'
+    item = {
+        'dtype': dtype[1:],
+        'bdata': base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii'),
+    }
+    if values.ndim > 1:
+        item['shape'] = ', '.join(str(size) for size in values.shape)
+    return item
+
+
+def encode(value, binary=False):
+    """応答をJSONに変換できる値へ（数値配列は binary なら typed array、JSON配列では NaN を null に）"""
+    if isinstance(value, dict):
+        return {str(k): encode(v, binary) for k, v in value.items()}
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'fiub':
+        if binary:
+            return typed_array(value)
+        if value.dtype.kind == 'f':
+            return np.where(np.isfinite(value), value, None).tolist()
+        return value.tolist()
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [encode(v, binary) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else None
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)  # 日付列のラベル（datetime など）
+
+
+def dump(value, binary=False):
+    """応答本文（UTF-8のJSON）"""
+    return json.dumps(encode(value, binary), ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """ルーティングと応答（CORS・gzip）"""
+
+    allow_origin = '*'
+    server_version = 'hitetsu-pl-api'
+
+    def _send(self, status, body):
+        gzipped = len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            body = gzip.compress(body, compresslevel=5)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self._cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cors_headers(self):
+        self.send_header('Access-Control-Allow-Origin', self.allow_origin)
+        self.send_header('Vary', 'Origin, Accept-Encoding')
+
+    def _route(self):
+        url = urlsplit(self.path)
+        match = _PATH.match(url.path)
+        if match is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, "エンドポイントがありません。")
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        return match.group(1), match.group(2), query
+
+    def _handle(self, method):
+        try:
+            key, tab, query = self._route()
+            binary = query.get('encoding') == 'binary'
+            if method == 'POST':
+                if key is not None:
+                    raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, "POST は /workbooks のみです。")
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0:
+                    raise ApiError(HTTPStatus.BAD_REQUEST, "ワークブックの内容が空です。")
+                if length > MAX_UPLOAD_BYTES:
+                    raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "ワークブックが大きすぎます。")
+                session = register_workbook(self.rfile.read(length))
+                self._send(HTTPStatus.CREATED, dump(session.meta()))
+            elif key is None:
+                raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, "ワークブックを POST で登録してください。")
+            elif tab is None:
+                self._send(HTTPStatus.OK, dump(get_session(key).meta()))
+            else:
+                session = get_session(key)
+                # エンコード済みの応答を再利用（同じ条件のリクエストはシリアライズもしない）
+                body = session.cached(tab, tuple(sorted(query.items())), 'api_body',
+                                      compute=lambda: dump(tab_payload(session, tab, query), binary))
+                self._send(HTTPStatus.OK, body)
+        except ApiError as e:
+            self._send(e.status, dump({'error': str(e)}))
+        except ValueError as e:
+            self._send(HTTPStatus.BAD_REQUEST, dump({'error': str(e)}))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_OPTIONS(self):
+        """CORSのプリフライト"""
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self._cors_headers()
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.end_headers()
+
+
+def make_server(host='127.0.0.1', port=8000, allow_origin='*'):
+    """APIサーバー（リクエストごとにスレッドで処理）"""
+    handler = type('ConfiguredApiHandler', (ApiHandler,), {'allow_origin': allow_origin})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="計算エンジンをHTTP/JSON APIとして起動します")
+    parser.add_argument('--host', default='127.0.0.1', help="待ち受けるアドレス")
+    parser.add_argument('--port', type=int, default=8000, help="待ち受けるポート")
+    parser.add_argument('--allow-origin', default='http://localhost:3000', help="CORSで許可するオリジン（Next.jsの開発サーバー）")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.allow_origin)
+    print(f"http://{args.host}:{args.port}/workbooks で待ち受け中（Ctrl+C で停止）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,202 @@
+"""戦略効果（Actual − Hold）の要因分解
+
+各期間の戦略効果 Σ_i ΔQty_i × ΔPrice_i（ΔQty = 終了時点の数量 − 開始時点の数量）を、
+テナーのバケット（engine.tenor）を使って次の3つに分解する。
+
+- バケット内の入れ替え: Σ_{i∈b} ΔQty_i × (ΔPrice_i − P_b)   ※ P_b: バケット内の価格変動の平均
+- バケット間の移転（ネットフラット）: Σ_{a,b} T_ab × (P_b − P_a)
+- 残余アウトライト: N × P_ref   ※ N: 数量変化の合計、P_ref: 参照価格変動
+
+バケットの数量変化 D_b からアウトライト分 N × w_b（w_b ∝ |D_b|、P_ref = Σ w_b P_b）を除いた
+D'_b（合計0）について、売り越しのバケット a から買い越しのバケット b への移転量を
+T_ab = D'_a⁻ × D'_b⁺ / Σ D'⁺ と比例配分する。3つの合計は戦略効果と一致する。
+
+全期間を 限月 × 期間 の行列演算で一括計算する。開始・終了いずれかの価格がない限月・期間の
+セルは、戦略効果・バケットの数量変化・平均価格変動のいずれからも除外する。
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from engine.tenor import bucket_codes
+
+
+@dataclass
+class Attribution:
+    """要因分解の結果
+
+    qty_delta, price_change, effect: 限月 × 期間
+    bucket_change, intra, flat_delta: バケット × 期間
+    sold, bought: バケット × 期間（移転元・移転先の数量。bought は Σ D'⁺ で割った値）
+    outright, net_delta, reference_change: 期間
+
+    期間ごとの移転量 T_ab = sold_a × bought_b は外積のため保持せず、全期間の合計を
+    バケット × バケット の行列積で求める。
+    """
+    prompts: list
+    periods: list
+    buckets: list
+    codes: np.ndarray
+    qty_delta: np.ndarray
+    price_change: np.ndarray
+    effect: np.ndarray
+    bucket_change: np.ndarray
+    intra: np.ndarray
+    flat_delta: np.ndarray
+    sold: np.ndarray
+    bought: np.ndarray
+    outright: np.ndarray
+    net_delta: np.ndarray
+    reference_change: np.ndarray
+
+    def period_totals(self):
+        """期間ごとの戦略効果と3要因"""
+        return pd.DataFrame({
+            '戦略効果': self.effect.sum(axis=0),
+            'バケット内の入れ替え': self.intra.sum(axis=0),
+            'バケット間の移転': (self.flat_delta * self.bucket_change).sum(axis=0),
+            '残余アウトライト': self.outright,
+        }, index=self.periods)
+
+    def prompt_frame(self):
+        """限月ごとの数量変化・価格変動・戦略効果（全期間の合計）"""
+        return pd.DataFrame({
+            '限月': self.prompts,
+            'バケット': [self.buckets[c] for c in self.codes],
+            '数量変化': self.qty_delta.sum(axis=1),
+            '価格変動': self.price_change.sum(axis=1),
+            '戦略効果': self.effect.sum(axis=1),
+        })
+
+    def bucket_frame(self):
+        """バケットごとの数量変化・平均価格変動・バケット内の入れ替え効果（全期間の合計）"""
+        n_buckets = len(self.buckets)
+        return pd.DataFrame({
+            'バケット': self.buckets,
+            '数量変化': np.bincount(self.codes, weights=self.qty_delta.sum(axis=1), minlength=n_buckets),
+            '平均価格変動': self.bucket_change.sum(axis=1),
+            'バケット内の入れ替え': self.intra.sum(axis=1),
+        })
+
+    def transfer_matrices(self):
+        """全期間合計の移転数量と効果（いずれも バケット(From) × バケット(To)）
+
+        効果 Σ_t T_abt × (P_bt − P_at) = sold @ (bought × P)ᵀ − (sold × P) @ boughtᵀ
+        """
+        quantity = self.sold @ self.bought.T
+        effect = self.sold @ (self.bought * self.bucket_change).T - (self.sold * self.bucket_change) @ self.bought.T
+        return quantity, effect
+
+    def transfer_frame(self, k=None):
+        """バケット間の移転（全期間の合計、効果の絶対値の降順、移転のないペアは除外）
+
+        k: 上位 k 件のみ（省略時はすべて）
+        """
+        quantity, effect = self.transfer_matrices()
+        rows, cols = np.nonzero(quantity > 0)
+        if k is not None and len(rows) > k:
+            keep = np.argpartition(-np.abs(effect[rows, cols]), k - 1)[:k]
+            rows, cols = rows[keep], cols[keep]
+        frame = pd.DataFrame({
+            'From': [self.buckets[a] for a in rows],
+            'To': [self.buckets[b] for b in cols],
+            '移転数量': quantity[rows, cols],
+            '効果': effect[rows, cols],
+        })
+        order = np.argsort(-np.abs(frame['効果'].to_numpy()), kind='stable')
+        return frame.iloc[order].reset_index(drop=True)
+
+    def waterfall_steps(self, top=5):
+        """ウォーターフォールの段階（バケット内 → 主な移転 → その他の移転 → アウトライト）
+
+        戻り値: [(ラベル, 効果)]（合計は戦略効果）
+        """
+        steps = [('バケット内の入れ替え', float(self.intra.sum()))]
+        head = self.transfer_frame(k=top)
+        for source, target, effect in zip(head['From'], head['To'], head['効果']):
+            steps.append((f'移転 {source}→{target}', float(effect)))
+        rest = float((self.flat_delta * self.bucket_change).sum()) - float(head['効果'].sum())
+        if abs(rest) > 1e-6:
+            steps.append(('その他の移転', rest))
+        steps.append(('残余アウトライト', float(self.outright.sum())))
+        return steps
+
+
+def _bucket_sum(codes, n_buckets, values):
+    """限月 × 期間 の行列をバケットごとに合計（バケット × 期間）"""
+    out = np.zeros((n_buckets, values.shape[1]))
+    np.add.at(out, codes, values)
+    return out
+
+
+def attribute(prompts, prices, quantities, periods=None, level='month'):
+    """連続する日付列間の戦略効果を要因分解
+
+    prices, quantities: 限月 × 日付列（時系列順）の行列（価格のないセルは NaN）
+    level: バケットの粒度（'prompt' / 'month' / 'year'）
+    """
+    prices = np.asarray(prices, dtype='float64')
+    quantities = np.asarray(quantities, dtype='float64')
+    price_change = np.diff(prices, axis=1)
+    priced = ~np.isnan(price_change)
+    price_change = np.where(priced, price_change, 0.0)
+    qty_delta = np.where(priced, np.diff(quantities, axis=1), 0.0)
+    effect = qty_delta * price_change
+
+    codes, buckets = bucket_codes(prompts, level)
+    n_buckets = len(buckets)
+    counts = _bucket_sum(codes, n_buckets, priced.astype('float64'))
+
+    # バケットの数量変化と価格のある限月の平均価格変動（バケット × 期間）
+    bucket_delta = _bucket_sum(codes, n_buckets, qty_delta)
+    bucket_change = np.divide(_bucket_sum(codes, n_buckets, price_change), counts,
+                              out=np.zeros((n_buckets, price_change.shape[1])), where=counts > 0)
+    intra = _bucket_sum(codes, n_buckets, qty_delta * (price_change - bucket_change[codes]))
+
+    # アウトライト分（|D_b| に比例して配分）を除いたネットフラットの数量変化
+    net_delta = bucket_delta.sum(axis=0)
+    abs_total = np.abs(bucket_delta).sum(axis=0)
+    weights = np.divide(np.abs(bucket_delta), abs_total, out=np.zeros_like(bucket_delta), where=abs_total > 0)
+    reference_change = (weights * bucket_change).sum(axis=0)
+    flat_delta = bucket_delta - net_delta * weights
+
+    # 売り越し(a) → 買い越し(b) の移転量を比例配分
+    bought = np.maximum(flat_delta, 0.0)
+    sold = np.maximum(-flat_delta, 0.0)
+    volume = bought.sum(axis=0)
+    scale = np.divide(1.0, volume, out=np.zeros_like(volume), where=volume > 0)
+
+    if periods is None:
+        periods = [f'期間{t + 1}' for t in range(price_change.shape[1])]
+    return Attribution(
+        prompts=list(prompts),
+        periods=list(periods),
+        buckets=buckets,
+        codes=codes,
+        qty_delta=qty_delta,
+        price_change=price_change,
+        effect=effect,
+        bucket_change=bucket_change,
+        intra=intra,
+        flat_delta=flat_delta,
+        sold=sold,
+        bought=bought * scale,
+        outright=net_delta * reference_change,
+        net_delta=net_delta,
+        reference_change=reference_change,
+    )
+
+
+def attribute_strategy(pl_engine, columns, level='month'):
+    """PLEngine の指定した日付列（時系列順）について戦略効果を要因分解"""
+    columns = list(columns)
+    periods = [f'{start}→{end}' for start, end in zip(columns[:-1], columns[1:])]
+    return attribute(
+        pl_engine.prompts,
+        pl_engine.prices[columns].to_numpy(dtype='float64'),
+        pl_engine.quantities[columns].to_numpy(dtype='float64'),
+        periods=periods,
+        level=level,
+    )
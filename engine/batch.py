@@ -0,0 +1,160 @@
+"""ワークブック一括計算（ヘッドレス実行）
+
+ディレクトリ内のワークブックごとにTab1〜Tab4の計算結果
+（限月別P/L・Cash-3M Spread・戦略比較・限月ペアP/L）を出力する。
+ワークブック単位でプロセスプールに分散して実行する。
+
+使い方:
+    python -m engine.batch 入力ディレクトリ --out 出力ディレクトリ [--workers 8] [--format parquet]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from engine.columnar import cache_path_for, is_cache_fresh, read_columnar_cache
+from engine.columns import default_period, find_common_columns
+from engine.loader import load_position_workbook
+from engine.pl import PLEngine
+from engine.spread import cash_3m_spread, find_cash_3m, spread_table
+
+
+def find_workbooks(directory, pattern='*.xlsx'):
+    """ディレクトリ内のワークブック（Excelのロックファイル ~$ は除外）"""
+    return sorted(p for p in Path(directory).glob(pattern) if not p.name.startswith('~$'))
+
+
+def read_workbook(path):
+    """ワークブックを読み込む（新しい列指向キャッシュがあれば優先）"""
+    if is_cache_fresh(path):
+        return read_columnar_cache(cache_path_for(path))
+    return load_position_workbook(path)
+
+
+def pair_table(pl_engine, start, end):
+    """限月ペア別P/L（対角線を除く縦持ち）"""
+    actual = pl_engine.pair_pl(start, end, 'actual')
+    hold = pl_engine.pair_pl(start, end, 'hold')
+    n = len(pl_engine.prompts)
+    rows, cols = np.nonzero(~np.eye(n, dtype=bool))
+    prompts = np.asarray(pl_engine.prompts, dtype=object)
+    return pd.DataFrame({
+        'From': prompts[rows],
+        'To': prompts[cols],
+        'Actual P/L': actual[rows, cols],
+        'Hold P/L': hold[rows, cols],
+        '差分': actual[rows, cols] - hold[rows, cols],
+    })
+
+
+def analyze_workbook(workbook, start=None, end=None):
+    """Tab1〜Tab4の計算結果をDataFrameとして返す"""
+    df_price = workbook['df_price']
+    df_qty = workbook['df_qty']
+    common_cols = find_common_columns(
+        df_price, df_qty, workbook.get('price_validity'), workbook.get('qty_validity')
+    )['common_cols']
+    if len(common_cols) < 2:
+        raise ValueError("価格と数量のデータに共通の日付列が2つ以上必要です。")
+    if start is None or end is None:
+        start, end = default_period(common_cols)
+
+    pl_engine = PLEngine(df_price, df_qty)
+    results = {'pl': pl_engine.pl_table(start, end)}
+
+    cash_prompt, m3_prompt = find_cash_3m(pl_engine.prompts)
+    if cash_prompt is not None and m3_prompt is not None:
+        spread = cash_3m_spread(pl_engine, start, end, cash_prompt, m3_prompt)
+        results['spread'] = spread_table(spread, start, end)
+
+    totals = pl_engine.strategy_totals(start, end)
+    results['strategy'] = pd.DataFrame({
+        '戦略': ['Hold', 'Actual', 'Strategy Effect'],
+        'Total P/L': [totals['total_hold_pl'], totals['total_actual_pl'], totals['strategy_effect']],
+    })
+    results['pairs'] = pair_table(pl_engine, start, end)
+    return results, (start, end), totals
+
+
+def write_frame(df, path, fmt):
+    """CSV（Excelで開けるようBOM付きUTF-8）またはParquetで保存"""
+    if fmt == 'parquet':
+        # Parquetは列名を文字列に揃える
+        df = df.copy()
+        df.columns = [str(col) for col in df.columns]
+        df.to_parquet(path.with_suffix('.parquet'), index=False)
+    else:
+        df.to_csv(path.with_suffix('.csv'), index=False, encoding='utf-8-sig')
+
+
+def process_workbook(path, out_dir, fmt='csv'):
+    """1ファイル分の計算と出力（プロセスプールのワーカーで実行）"""
+    path = Path(path)
+    started = time.perf_counter()
+    try:
+        results, (start, end), totals = analyze_workbook(read_workbook(path))
+        book_dir = Path(out_dir) / path.stem
+        book_dir.mkdir(parents=True, exist_ok=True)
+        for name, df in results.items():
+            write_frame(df, book_dir / name, fmt)
+        return {
+            'workbook': path.name,
+            'status': 'ok',
+            'start': str(start),
+            'end': str(end),
+            'Hold P/L': totals['total_hold_pl'],
+            'Actual P/L': totals['total_actual_pl'],
+            'Strategy Effect': totals['strategy_effect'],
+            'seconds': time.perf_counter() - started,
+            'error': '',
+        }
+    except Exception as e:
+        return {
+            'workbook': path.name,
+            'status': 'error',
+            'seconds': time.perf_counter() - started,
+            'error': str(e),
+        }
+
+
+def run_batch(directory, out_dir, workers=None, fmt='csv', pattern='*.xlsx'):
+    """ディレクトリ内の全ワークブックを処理し、サマリーを返す"""
+    paths = find_workbooks(directory, pattern)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    if workers == 1:
+        summary = [process_workbook(path, out_dir, fmt) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_workbook, path, out_dir, fmt) for path in paths]
+            summary = [future.result() for future in as_completed(futures)]
+
+    df_summary = pd.DataFrame(summary)
+    if not df_summary.empty:
+        df_summary = df_summary.sort_values('workbook').reset_index(drop=True)
+    write_frame(df_summary, Path(out_dir) / 'summary', fmt)
+    return df_summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ワークブックを一括計算してCSV/Parquetに出力します")
+    parser.add_argument('directory', help="ワークブックのあるディレクトリ")
+    parser.add_argument('--out', required=True, help="出力ディレクトリ")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="並列プロセス数（1で逐次実行）")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="出力形式")
+    parser.add_argument('--pattern', default='*.xlsx', help="対象ファイルのパターン")
+    args = parser.parse_args(argv)
+
+    df_summary = run_batch(args.directory, args.out, workers=args.workers, fmt=args.format, pattern=args.pattern)
+    n_error = int((df_summary['status'] == 'error').sum()) if not df_summary.empty else 0
+    print(f"{len(df_summary)}件処理（エラー {n_error}件） -> {args.out}")
+    return 1 if n_error else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,81 @@
+"""再実行をまたいで保持するキャッシュ
+
+Streamlitはウィジェット操作のたびにapp.pyを先頭から再実行するが、importした
+モジュールは保持される。ここに置いたキャッシュは再実行後も有効で、
+上限件数を超えると最も長く使われていないエントリから破棄する（LRU）。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """上限件数つきのLRUキャッシュ（スレッドセーフ）
+
+    キャッシュした値は呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, max_entries=32):
+        if max_entries < 1:
+            raise ValueError("max_entries は1以上を指定してください")
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """値を取得し、最近使用したエントリとして記録"""
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        """値を登録し、上限を超えた古いエントリを破棄"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """キャッシュにあれば返し、なければ compute() の結果を登録して返す"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        """全エントリを破棄"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def content_hash(data):
+    """バイト列の内容ハッシュ（ファイル内容のキャッシュキー用）"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# 読み込み済みワークブック（キー: ファイル内容ハッシュ）
+workbook_cache = LRUCache(max_entries=8)
+
+# 計算結果（キー: (データハッシュ, 開始, 終了, 戦略) など）
+result_cache = LRUCache(max_entries=128)
@@ -0,0 +1,89 @@
+"""Excel入力の数値変換
+
+価格・数量シート全体を1回のベクトル演算で数値に変換し、セルごとの
+変換結果（数値 / 空白 / 変換不可）と列ごとの数値判定を返す。
+
+対応する表記:
+- カンマ区切り（1,234）、全角数字・記号（１２３４、－５）
+- 括弧付き・▲/△付きの負数（(1,234) / ▲1,234 → -1234）
+- 空白・空文字・「-」のみのセルは空白（NaN）として扱う
+"""
+
+from dataclasses import dataclass
+
+import pandas as pd
+
+_FULLWIDTH = str.maketrans({
+    **{chr(ord('０') + i): str(i) for i in range(10)},
+    '，': ',', '．': '.', '－': '-', '−': '-', '＋': '+',
+    '（': '(', '）': ')', '▲': '-', '△': '-', '　': ' ',
+})
+_BLANK_TOKENS = {'', '-', '－', '—'}
+
+
+def _normalize_text(text):
+    """数値として読めなかった文字列（Series）を正規化"""
+    text = text.str.translate(_FULLWIDTH).str.replace(r'[,\s]', '', regex=True)
+    negative = text.str.match(r'^\(.*\)$')
+    text = text.where(~negative, '-' + text.str[1:-1])
+    return text
+
+
+def _coerce_values(values):
+    """1次元のセル値（object）を数値化し、(数値, 空白マスク) を返す"""
+    series = pd.Series(values, dtype=object)
+    numeric = pd.to_numeric(series, errors='coerce').astype('float64')
+    blank = series.isna().to_numpy().copy()
+
+    # 直接変換できなかった文字列セルのみ正規化して再変換
+    failed = numeric.isna().to_numpy() & ~blank
+    text = series[failed]
+    text = text[text.map(type).eq(str).to_numpy(dtype=bool)].str.strip()
+    if len(text):
+        is_blank = text.isin(_BLANK_TOKENS)
+        blank[text.index[is_blank.to_numpy()]] = True
+        text = text[~is_blank]
+        numeric[text.index] = pd.to_numeric(_normalize_text(text), errors='coerce')
+    return numeric.to_numpy(), blank
+
+
+@dataclass
+class CoercedFrame:
+    """数値変換の結果（values: 数値、変換できないセルはNaN）"""
+    values: pd.DataFrame
+    valid: pd.DataFrame
+    blank: pd.DataFrame
+
+    def column_report(self):
+        """列ごとの数値・空白・変換不可のセル数と数値列の判定
+
+        数値セルが1つ以上あり、変換不可のセルが数値セルより少ない列を数値列とする。
+        """
+        n_valid = self.valid.sum()
+        n_blank = self.blank.sum()
+        n_invalid = len(self.values) - n_valid - n_blank
+        return pd.DataFrame({
+            '数値': n_valid,
+            '空白': n_blank,
+            '変換不可': n_invalid,
+            '数値列': (n_valid > 0) & (n_invalid < n_valid),
+        })
+
+    @property
+    def numeric_columns(self):
+        """列ごとの数値列判定（bool Series）"""
+        return self.column_report()['数値列']
+
+
+def coerce_frame(df):
+    """DataFrame全体を数値へ一括変換"""
+    if df.empty or all(pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes):
+        values = df.astype('float64')
+        blank = values.isna()
+        return CoercedFrame(values=values, valid=~blank, blank=blank)
+
+    numeric, blank = _coerce_values(df.to_numpy(dtype=object).ravel())
+    shape = df.shape
+    values = pd.DataFrame(numeric.reshape(shape), index=df.index, columns=df.columns)
+    blank = pd.DataFrame(blank.reshape(shape), index=df.index, columns=df.columns)
+    return CoercedFrame(values=values, valid=values.notna(), blank=blank)
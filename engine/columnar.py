@@ -0,0 +1,174 @@
+"""ポジションスナップショットの列指向キャッシュ
+
+ワークブックを一度だけ読み込み、価格・数量の数値行列（.npy）と
+Prompt・日付ラベル・列ごとの数値判定（meta.json）に変換して保存する。以降はExcelを解析せず、
+メモリマップで行列を読み込む。
+
+使い方:
+    python -m engine.columnar 数量価格.xlsx [--float32]
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from engine.cache import content_hash
+from engine.loader import load_position_workbook
+
+FORMAT_VERSION = 2
+CACHE_SUFFIX = '.plcache'
+
+
+def cache_path_for(workbook_path):
+    """ワークブックの隣に置くキャッシュディレクトリのパス"""
+    return Path(workbook_path).with_suffix(CACHE_SUFFIX)
+
+
+def _encode_label(label):
+    """列名・Prompt名をJSONに保存できる形式へ変換"""
+    if isinstance(label, (pd.Timestamp, dt.datetime)):
+        return {'type': 'datetime', 'value': label.isoformat()}
+    if isinstance(label, dt.date):
+        return {'type': 'date', 'value': label.isoformat()}
+    if isinstance(label, (bool, np.bool_)):
+        return {'type': 'str', 'value': str(label)}
+    if isinstance(label, (int, np.integer)):
+        return {'type': 'int', 'value': int(label)}
+    if isinstance(label, (float, np.floating)):
+        return {'type': 'float', 'value': float(label)}
+    return {'type': 'str', 'value': str(label)}
+
+
+def _decode_label(item):
+    kind = item['type']
+    value = item['value']
+    if kind == 'datetime':
+        return dt.datetime.fromisoformat(value)
+    if kind == 'date':
+        return dt.date.fromisoformat(value)
+    return value
+
+
+def _source_stat(workbook_path):
+    stat = os.stat(workbook_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_columnar_cache(workbook, cache_path, dtype='float64', source=None):
+    """load_position_workbook の結果を列指向キャッシュとして保存
+
+    source: 元ファイルの情報（サイズ・更新時刻・内容ハッシュ）。鮮度判定に使用
+    """
+    cache_path = Path(cache_path)
+    cache_path.mkdir(parents=True, exist_ok=True)
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'dtype': np.dtype(dtype).name,
+        'sheet_names': list(workbook['sheet_names']),
+        'price_sheet': workbook['price_sheet'],
+        'qty_sheet': workbook['qty_sheet'],
+        'source': source or {},
+        'frames': {},
+    }
+    for name in ('price', 'qty'):
+        df = workbook[f'df_{name}']
+        np.save(cache_path / f'{name}.npy', df.to_numpy(dtype=dtype))
+        meta['frames'][name] = {
+            'index_name': None if df.index.name is None else _encode_label(df.index.name),
+            'index': [_encode_label(v) for v in df.index],
+            'columns': [_encode_label(v) for v in df.columns],
+        }
+        validity = workbook.get(f'{name}_validity')
+        if validity is not None:
+            # 列の並びは columns と同じ
+            meta['frames'][name]['validity'] = {
+                key: [value.item() for value in validity[key].to_numpy()] for key in validity.columns
+            }
+
+    # メタデータは最後に書き込む（途中で失敗した場合は鮮度判定で無効になる）
+    (cache_path / 'meta.json').write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+    return cache_path
+
+
+def read_columnar_cache(cache_path, mmap=True):
+    """列指向キャッシュを load_position_workbook と同じ形式で読み込む"""
+    cache_path = Path(cache_path)
+    meta = json.loads((cache_path / 'meta.json').read_text(encoding='utf-8'))
+    if meta.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"未対応のキャッシュ形式です: {meta.get('format_version')}")
+
+    frames = {}
+    validities = {}
+    for name in ('price', 'qty'):
+        info = meta['frames'][name]
+        values = np.load(cache_path / f'{name}.npy', mmap_mode='r' if mmap else None)
+        index_name = None if info['index_name'] is None else _decode_label(info['index_name'])
+        frames[name] = pd.DataFrame(
+            values,
+            index=pd.Index([_decode_label(v) for v in info['index']], name=index_name, dtype=object),
+            columns=pd.Index([_decode_label(v) for v in info['columns']], dtype=object),
+            copy=False,
+        )
+        if 'validity' in info:
+            validities[name] = pd.DataFrame(info['validity'], index=frames[name].columns)
+
+    return {
+        'sheet_names': meta['sheet_names'],
+        'price_sheet': meta['price_sheet'],
+        'qty_sheet': meta['qty_sheet'],
+        'df_price': frames['price'],
+        'df_qty': frames['qty'],
+        'price_validity': validities.get('price'),
+        'qty_validity': validities.get('qty'),
+        'source': meta['source'],
+    }
+
+
+def is_cache_fresh(workbook_path, cache_path=None):
+    """キャッシュが存在し、元ファイルのサイズ・更新時刻と一致するか"""
+    cache_path = Path(cache_path) if cache_path is not None else cache_path_for(workbook_path)
+    meta_path = cache_path / 'meta.json'
+    if not meta_path.exists() or not os.path.exists(workbook_path):
+        return False
+    try:
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return False
+    if meta.get('format_version') != FORMAT_VERSION:
+        return False
+    source = meta.get('source', {})
+    current = _source_stat(workbook_path)
+    return source.get('size') == current['size'] and source.get('mtime_ns') == current['mtime_ns']
+
+
+def import_workbook(workbook_path, cache_path=None, dtype='float64'):
+    """ワークブックを読み込み、列指向キャッシュへ変換して保存"""
+    cache_path = Path(cache_path) if cache_path is not None else cache_path_for(workbook_path)
+    data = Path(workbook_path).read_bytes()
+    source = _source_stat(workbook_path)
+    source['hash'] = content_hash(data)
+
+    workbook = load_position_workbook(data)
+    return write_columnar_cache(workbook, cache_path, dtype=dtype, source=source)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ワークブックを列指向キャッシュへ変換します")
+    parser.add_argument('workbooks', nargs='+', help="変換するExcelファイル")
+    parser.add_argument('--float32', action='store_true', help="float32で保存（サイズ半減、精度は約7桁）")
+    args = parser.parse_args(argv)
+
+    dtype = 'float32' if args.float32 else 'float64'
+    for workbook_path in args.workbooks:
+        cache_path = import_workbook(workbook_path, dtype=dtype)
+        print(f"{workbook_path} -> {cache_path}")
+
+
+if __name__ == '__main__':
+    main()
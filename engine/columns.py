@@ -0,0 +1,52 @@
+"""日付（スナップショット）列の検出"""
+
+from engine.coerce import coerce_frame
+from engine.snapshots import snapshot_axis
+
+
+def numeric_column_mask(df, validity=None):
+    """列ごとの数値列判定（bool Series）
+
+    validity: 読み込み時の列ごとの判定（load_position_workbook の price_validity / qty_validity）。
+    あればそれを参照し、なければ coerce_frame で一括判定する（数値変換済みのフレームでは
+    値のある列が数値列）。
+    """
+    if validity is not None:
+        return validity['数値列'].reindex(df.columns, fill_value=False)
+    return coerce_frame(df).numeric_columns
+
+
+def find_common_columns(df_price, df_qty, price_validity=None, qty_validity=None):
+    """価格・数量シートに共通する日付列を検出
+
+    Unnamed列を除外したうえで共通の数値列を優先し、2つ未満の場合は
+    すべての共通列を使用する。
+    price_validity / qty_validity: 読み込み時の列ごとの数値判定（numeric_column_mask を参照）
+    戻り値: {'price_cols', 'qty_cols', 'common_cols'}（共通列は価格シートの並び順）
+    """
+    price_cols = [col for col in df_price.columns if not str(col).startswith('Unnamed')]
+    qty_cols = [col for col in df_qty.columns if not str(col).startswith('Unnamed')]
+
+    # 数値列のみをフィルタリング
+    price_numeric = numeric_column_mask(df_price, price_validity)
+    qty_numeric = numeric_column_mask(df_qty, qty_validity)
+    price_numeric_cols = [col for col in price_cols if price_numeric[col]]
+    qty_numeric_cols = set(col for col in qty_cols if qty_numeric[col])
+    common_cols = [col for col in price_numeric_cols if col in qty_numeric_cols]
+
+    if len(common_cols) < 2:
+        # 数値列が見つからない場合、すべての共通列を使用
+        qty_col_set = set(qty_cols)
+        common_cols = [col for col in price_cols if col in qty_col_set]
+
+    return {
+        'price_cols': price_cols,
+        'qty_cols': qty_cols,
+        'common_cols': common_cols,
+    }
+
+
+def default_period(common_cols):
+    """分析期間の既定値（時系列順で最初の2つの日付列）"""
+    date_cols = snapshot_axis(common_cols).columns[:2]
+    return date_cols[0], date_cols[1]
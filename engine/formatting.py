@@ -0,0 +1,19 @@
+"""表示用の数値フォーマット"""
+
+import pandas as pd
+
+
+def format_number(x):
+    """数値をカンマ区切り・小数点以下なしの文字列に変換（数値以外はそのまま）"""
+    if isinstance(x, (int, float)) and not pd.isna(x):
+        return f"{x:,.0f}"
+    return x
+
+
+def format_table(df, columns=None):
+    """指定列（省略時は全列）をformat_numberで整形したコピーを返す"""
+    df_display = df.copy()
+    for col in (df.columns if columns is None else columns):
+        if col in df_display.columns:
+            df_display[col] = df_display[col].apply(format_number)
+    return df_display
@@ -0,0 +1,244 @@
+"""P/L分散を最小化するポジション（最適ヘッジ）の探索
+
+過去の日付列間の価格変動から限月間の共分散 Σ を推定し、現在のポジション q0 から
+P/L分散 xᵀΣx が最小になるポジション x を探索する。制約は次のとおり。
+
+- ネット数量0: Σ x = 0（Tab3の数量合計チェックと同じ条件）
+- 限月ごとの上限: lower ≤ x ≤ upper（現在の数量が上限を超えている限月は、その数量までは許容。
+  取引ロット数の範囲で上限内に戻せなかった限月は結果の over_limit で示す）
+- 取引ロット数の上限: Σ |x − q0| ≤ max_lots
+
+探索は2段階の貪欲法で、候補をすべて行列で一括評価する。
+
+1. ネット数量が0でなければ、1限月の売買候補（限月数）の中から分散の増加が最も小さいものを選んで0にする
+2. 限月 i から j へ δ ロット移す候補（限月数 × 限月数）について、分散の変化
+   Δ = 2δ(h_j − h_i) + δ²(Σ_ii + Σ_jj − 2Σ_ij)（h = Σx）を一括計算し、最も減少する移動を繰り返す。
+   δ は最適値をロット単位に丸め、上限・取引ロット数の範囲に収める
+
+取引ロット数の制約で貪欲法の結果は経路に依存するため、候補の一部をランダムに除いた探索を
+複数回（restarts）行い、得られた候補ポジションを一括評価して最良のものを返す。
+探索はプロセスプールに分散できる（結果は workers 数によらず同じ）。
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from engine.montecarlo import estimate_covariance, price_change_matrix
+
+# 分散の変化をこれ以下なら改善なしとみなす相対許容誤差
+_TOLERANCE = 1e-12
+
+
+@dataclass
+class HedgeResult:
+    """最適ヘッジの探索結果（分散・標準偏差は1期間P/L、USD）"""
+    prompts: list
+    current: np.ndarray
+    proposed: np.ndarray
+    limit: np.ndarray
+    std_current: float
+    std_proposed: float
+    lots_traded: float
+    candidate_std: np.ndarray
+    moves: int
+
+    @property
+    def over_limit(self):
+        """提案数量の絶対値が限月ごとの上限を超える限月（現在の数量が上限を超えていた限月のみ起こりうる）"""
+        return np.abs(self.proposed) > self.limit + 1e-9
+
+    def frame(self):
+        """限月ごとの現在の数量・提案数量・取引数量・上限・上限超過"""
+        return pd.DataFrame({
+            '限月': self.prompts,
+            '現在の数量': self.current,
+            '提案数量': self.proposed,
+            '取引数量': self.proposed - self.current,
+            '上限': self.limit,
+            '上限超過': self.over_limit,
+        })
+
+
+def _round_lots(values, lot):
+    return np.floor(values / lot + 0.5) * lot
+
+
+def _flatten_net(cov, x, q0, lower, upper, remaining, lot):
+    """ネット数量を0にする（1限月ずつ、分散の増加が最小の売買を選ぶ）"""
+    diag = np.diag(cov)
+    h = cov @ x
+    moves = 0
+    net = x.sum()
+    while abs(net) > 1e-9:
+        direction = -np.sign(net)
+        room = (upper - x) if direction > 0 else (x - lower)
+        size = np.minimum(np.minimum(room, abs(net)), remaining)
+        # 分散を最小にする売買量（向きは固定）をロット単位に丸めて範囲内に収める
+        with np.errstate(divide='ignore', invalid='ignore'):
+            best = np.where(diag > 0, -direction * h / diag, size)
+        step = np.clip(_round_lots(best, lot), min(lot, abs(net)), None)
+        step = np.minimum(step, size)
+        step = np.where(size > 0, step, 0.0)
+        change = 2 * direction * step * h + step ** 2 * diag
+        change = np.where(step > 0, change, np.inf)
+        i = int(np.argmin(change))
+        if not np.isfinite(change[i]):
+            raise ValueError("限月ごとの上限・取引ロット数の範囲でネット数量を0にできません。")
+        delta = direction * step[i]
+        x[i] += delta
+        h += delta * cov[:, i]
+        remaining -= abs(x[i] - q0[i]) - abs(x[i] - delta - q0[i])
+        net = x.sum()
+        moves += 1
+    return x, remaining, moves
+
+
+def _top(score, mask, k):
+    """mask の限月のうち score の小さい順に k 個"""
+    candidates = np.flatnonzero(mask)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(score[candidates], k - 1)[:k]]
+    return candidates
+
+
+def _pair_moves(curvature, h, x, q0, lower, upper, remaining, lot, rows, cols):
+    """限月 rows → cols への移動候補の移動量・分散の変化・取引ロット数の増分（rows × cols）"""
+    slope = h[cols][None, :] - h[rows][:, None]  # 1次の係数 / 2
+    curv = curvature[np.ix_(rows, cols)]
+    cap = np.minimum((x[rows] - lower[rows])[:, None], (upper[cols] - x[cols])[None, :])
+    step = np.clip(_round_lots(-slope / curv, lot), 0.0, None)
+    step = np.where(np.isfinite(curv), np.minimum(step, cap), 0.0)
+
+    # 取引ロット数: 上限を超える候補は残りの範囲（1回の移動で最大2δ増える）に縮める
+    dev_from = (x - q0)[rows][:, None]
+    dev_to = (x - q0)[cols][None, :]
+
+    def traded(step):
+        return np.abs(dev_from - step) - np.abs(dev_from) + np.abs(dev_to + step) - np.abs(dev_to)
+
+    cost = traded(step)
+    over = cost > remaining + 1e-9
+    if over.any():
+        step = np.where(over, np.minimum(step, np.floor(max(remaining, 0.0) / 2 / lot) * lot), step)
+        cost = traded(step)
+
+    gain = 2 * step * slope + step ** 2 * np.where(np.isfinite(curv), curv, 0.0)
+    return step, np.where(step > 0, gain, 0.0), cost
+
+
+def _descend(cov, q0, lower, upper, max_lots, lot, max_iter, seed, explore, screen):
+    """1回分の探索（explore: 候補の一部をランダムに除いて経路を変える）
+
+    各回は h の大きい順に売れる限月・h の小さい順に買える限月（それぞれ取引ロット数が減る限月も含む）
+    の候補を評価し、改善がなくなったときだけ全ペアを評価する。
+    戻り値: (ポジション, 移動回数)
+    """
+    rng = np.random.default_rng(seed)
+    x = q0.copy()
+    x, remaining, moves = _flatten_net(cov, x, q0, lower, upper, max_lots, lot)
+
+    diag = np.diag(cov)
+    curvature = diag[:, None] + diag[None, :] - 2 * cov  # i → j に1ロット移したときの分散の2次の係数
+    np.fill_diagonal(curvature, np.inf)
+    curvature = np.where(curvature > 0, curvature, np.inf)
+    tolerance = _TOLERANCE * max(float(diag.max()), 1e-300)
+    everyone = np.arange(len(q0))
+    h = cov @ x
+
+    full_scan = False
+    for _ in range(max_iter):
+        if full_scan or screen >= len(q0):
+            rows = cols = everyone
+        else:
+            # 売り: h の大きい限月と、買い戻しで取引ロット数が減る限月（買い側も同様）
+            dev = x - q0
+            rows = np.union1d(_top(-h, x > lower, screen), _top(-h, (x > lower) & (dev > 0), screen))
+            cols = np.union1d(_top(h, x < upper, screen), _top(h, (x < upper) & (dev < 0), screen))
+        step, gain, cost = _pair_moves(curvature, h, x, q0, lower, upper, remaining, lot, rows, cols)
+        if explore:
+            gain = np.where(rng.random(gain.shape) < 0.5, gain, 0.0)
+
+        best = int(np.argmin(gain))
+        if gain.flat[best] >= -tolerance:
+            if rows is everyone:
+                break
+            full_scan = True
+            continue
+        full_scan = False
+        a, b = divmod(best, len(cols))
+        i, j = rows[a], cols[b]
+        delta = step[a, b]
+        x[i] -= delta
+        x[j] += delta
+        h += delta * (cov[:, j] - cov[:, i])
+        remaining -= cost[a, b]
+        moves += 1
+    return x, moves
+
+
+def _search(cov, q0, lower, upper, max_lots, lot, max_iter, seed, explore, screen):
+    """プロセスプールから呼ぶ探索（モジュールの関数として pickle できるようにする）"""
+    return _descend(cov, q0, lower, upper, max_lots, lot, max_iter, seed, explore, screen)
+
+
+def pl_variance(cov, positions):
+    """ポジション（候補数 × 限月数、または1本）ごとの1期間P/L分散を一括計算"""
+    positions = np.atleast_2d(positions)
+    return np.einsum('kn,nm,km->k', positions, cov, positions)
+
+
+def optimize_hedge(cov, current, limit, max_lots, lot=1.0, restarts=4, max_iter=5000, screen=32, seed=42,
+                   workers=1, prompts=None):
+    """P/L分散を最小化するポジションを探索
+
+    cov: 限月間の価格変動の共分散（限月数 × 限月数）
+    current: 現在の数量（探索の開始点、取引ロット数の基準）
+    limit: 限月ごとの数量の上限（絶対値、スカラーまたは限月数の配列）
+    max_lots: 取引ロット数の上限（Σ |提案 − 現在|）
+    lot: 売買の単位
+    restarts: 探索の回数（1回目は候補を除かない貪欲法）
+    screen: 1回の移動で評価する売り・買いそれぞれの限月数
+    workers: 2以上で探索をプロセスプールに分散
+    """
+    cov = np.asarray(cov, dtype='float64')
+    q0 = np.asarray(current, dtype='float64')
+    limit = np.broadcast_to(np.abs(np.asarray(limit, dtype='float64')), q0.shape)
+    lower = np.minimum(-limit, q0)
+    upper = np.maximum(limit, q0)
+
+    seeds = np.random.SeedSequence(seed).spawn(max(int(restarts), 1))
+    explore = [k > 0 for k in range(len(seeds))]
+    args = ([cov] * len(seeds), [q0] * len(seeds), [lower] * len(seeds), [upper] * len(seeds),
+            [float(max_lots)] * len(seeds), [float(lot)] * len(seeds), [int(max_iter)] * len(seeds),
+            seeds, explore, [int(screen)] * len(seeds))
+    if workers and workers > 1 and len(seeds) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_search, *args))
+    else:
+        results = [_search(*item) for item in zip(*args)]
+
+    candidates = np.vstack([x for x, _ in results])
+    variance = np.maximum(pl_variance(cov, candidates), 0.0)
+    best = int(np.argmin(variance))
+    proposed = candidates[best]
+    return HedgeResult(
+        prompts=list(prompts) if prompts is not None else list(range(len(q0))),
+        current=q0,
+        proposed=proposed,
+        limit=np.array(limit),
+        std_current=float(np.sqrt(max(pl_variance(cov, q0)[0], 0.0))),
+        std_proposed=float(np.sqrt(variance[best])),
+        lots_traded=float(np.abs(proposed - q0).sum()),
+        candidate_std=np.sqrt(variance),
+        moves=results[best][1],
+    )
+
+
+def optimal_hedge(pl_engine, columns, col, limit, max_lots, lot=1.0, restarts=4, seed=42, workers=1):
+    """日付列 col の数量を開始点に、columns（時系列順）の価格変動の共分散で最適ヘッジを探索"""
+    cov = estimate_covariance(price_change_matrix(pl_engine.prices, columns))
+    return optimize_hedge(cov, pl_engine.qty(col), limit, max_lots, lot=lot, restarts=restarts,
+                          seed=seed, workers=workers, prompts=pl_engine.prompts)
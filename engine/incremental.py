@@ -0,0 +1,240 @@
+"""スナップショット列追加時の差分計算
+
+ワークブックには営業日ごとに日付列が1列ずつ追加される。計算済みの
+期間別P/L行列・累積P/L・期間合計・Spread系列を保持しておき、
+新しく追加された列の分だけを計算して末尾に追加する（1列あたり O(限月数)）。
+
+- 計算済みの列の価格・数量も保持し、過去の列が修正されていないかを1回の配列比較で照合する
+  （修正されていれば全体を再計算）。同じ内容（data_key）での再実行では照合も省略する
+- Spread系列は要求された限月ペアの組ごとに保持し、以降は追加された列の分だけを計算する
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from engine.cache import LRUCache
+from engine.pl import MultiPeriodPL
+from engine.spread import SpreadSeries
+
+
+class _GrowableColumns:
+    """列方向に追記できる行列（容量を倍々に確保して追記を償却O(1)にする）"""
+
+    def __init__(self, n_rows, capacity=16):
+        self._data = np.empty((n_rows, capacity))
+        self.size = 0
+
+    def extend(self, block):
+        """block（n_rows × k）を末尾に追加"""
+        k = block.shape[1]
+        if self.size + k > self._data.shape[1]:
+            capacity = max(self._data.shape[1] * 2, self.size + k)
+            data = np.empty((self._data.shape[0], capacity))
+            data[:, :self.size] = self._data[:, :self.size]
+            self._data = data
+        self._data[:, self.size:self.size + k] = block
+        self.size += k
+
+    @property
+    def values(self):
+        return self._data[:, :self.size]
+
+
+class _SpreadColumns:
+    """1組の限月ペアのSpread水準・Spread Qty・Hold/Actual Spread P/L（列方向に追記）"""
+
+    def __init__(self, near, far):
+        self.near = near
+        self.far = far
+        k = len(near)
+        self.levels = _GrowableColumns(k)
+        self.effective_qty = _GrowableColumns(k)
+        self.hold = _GrowableColumns(k)
+        self.actual = _GrowableColumns(k)
+
+    def extend(self, prices, quantities, first):
+        """日付列のブロックを追加（first でなければ先頭の列は計算済みの最終列）"""
+        levels = prices[self.near] - prices[self.far]
+        qty_near = quantities[self.near]
+        qty_far = quantities[self.far]
+        effective_qty = np.where(qty_near * qty_far < 0, np.minimum(np.abs(qty_near), np.abs(qty_far)), 0.0)
+        changes = np.diff(levels, axis=1)
+        new = slice(0 if first else 1, None)
+        self.levels.extend(levels[:, new])
+        self.effective_qty.extend(effective_qty[:, new])
+        self.hold.extend(effective_qty[:, :-1] * changes)
+        self.actual.extend(effective_qty[:, 1:] * changes)
+
+
+def _take_columns(values, positions):
+    """指定位置の列（位置が連続していればコピーせずビューで返す）"""
+    if len(positions) and (np.diff(positions) == 1).all():
+        return values[:, positions[0]:positions[-1] + 1]
+    return values[:, positions]
+
+
+def _same_values(a, b):
+    """2つの行列がビット単位で等しいか（NaN も同じ値として比較する1回の配列比較）"""
+    return a.shape == b.shape and bool((a.view(np.uint64) == b.view(np.uint64)).all())
+
+
+class IncrementalPL:
+    """期間別P/LとSpread系列を差分計算で保持する"""
+
+    # 保持する限月ペアの組の数（超えたら最も長く使われていない組から破棄）
+    max_spread_sets = 8
+
+    def __init__(self, prompts):
+        self.prompts = list(prompts)
+        self._positions = {prompt: i for i, prompt in enumerate(self.prompts)}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        n = len(self.prompts)
+        self.columns = []
+        self._data_key = None
+        self._prices = _GrowableColumns(n)
+        self._quantities = _GrowableColumns(n)
+        self._price_change = _GrowableColumns(n)
+        self._hold = _GrowableColumns(n)
+        self._actual = _GrowableColumns(n)
+        self._period_totals = _GrowableColumns(2)
+        self.cumulative_hold = np.zeros(n)
+        self.cumulative_actual = np.zeros(n)
+        self._spreads = {}
+
+    def _extend(self, columns, prices, quantities):
+        """日付列のブロック（prompts × k）を追加し、直前の列との差分だけを計算"""
+        first = self._prices.size == 0
+        self._prices.extend(prices)
+        self._quantities.extend(quantities)
+        if not first:
+            prices = np.column_stack([self._prices.values[:, -len(columns) - 1], prices])
+            quantities = np.column_stack([self._quantities.values[:, -len(columns) - 1], quantities])
+
+        if prices.shape[1] >= 2:
+            price_change = np.diff(prices, axis=1)
+            hold = quantities[:, :-1] * price_change
+            actual = quantities[:, 1:] * price_change
+            self._price_change.extend(price_change)
+            self._hold.extend(hold)
+            self._actual.extend(actual)
+            # 価格のないセル（NaN）は合計から除外
+            self._period_totals.extend(np.vstack([np.nansum(hold, axis=0), np.nansum(actual, axis=0)]))
+            self.cumulative_hold += np.nansum(hold, axis=1)
+            self.cumulative_actual += np.nansum(actual, axis=1)
+
+        for spread in self._spreads.values():
+            spread.extend(prices, quantities, first)
+        self.columns.extend(columns)
+
+    def sync(self, prices, quantities, columns, data_key=None):
+        """最新の価格・数量（prompts × 日付列のDataFrame）に追従する
+
+        columns: 時系列順の日付列。計算済みの列がその先頭と一致し、それらの列の
+        価格・数量も変わっていなければ新しい列だけを計算する。それ以外は全体を再計算する。
+        data_key: データの内容ハッシュ（前回と同じなら照合を省略）
+        戻り値: 新たに計算した日付列の数
+        """
+        columns = list(columns)
+        with self._lock:
+            if data_key is not None and data_key == self._data_key and columns == self.columns:
+                return 0
+
+            price_pos = prices.columns.get_indexer(columns)
+            qty_pos = quantities.columns.get_indexer(columns)
+            if (price_pos < 0).any() or (qty_pos < 0).any():
+                raise KeyError("価格・数量にない日付列が指定されました")
+            price_values = prices.to_numpy(dtype='float64')
+            qty_values = quantities.to_numpy(dtype='float64')
+
+            n_done = len(self.columns)
+            reusable = (
+                n_done > 0
+                and columns[:n_done] == self.columns
+                and list(prices.index) == self.prompts
+                and _same_values(_take_columns(price_values, price_pos[:n_done]), self._prices.values)
+                and _same_values(_take_columns(qty_values, qty_pos[:n_done]), self._quantities.values)
+            )
+            if not reusable:
+                self._reset()
+                n_done = 0
+
+            new_columns = columns[n_done:]
+            if new_columns:
+                self._extend(
+                    new_columns,
+                    _take_columns(price_values, price_pos[n_done:]),
+                    _take_columns(qty_values, qty_pos[n_done:]),
+                )
+            self._data_key = data_key
+            return len(new_columns)
+
+    @property
+    def periods(self):
+        return [f'{start}→{end}' for start, end in zip(self.columns[:-1], self.columns[1:])]
+
+    def result(self):
+        """保持している期間別P/L（MultiPeriodPL）"""
+        return MultiPeriodPL(
+            prompts=self.prompts,
+            periods=self.periods,
+            price_change=self._price_change.values,
+            hold=self._hold.values,
+            actual=self._actual.values,
+        )
+
+    def period_totals(self):
+        """期間ごとのHold/Actual P/L合計と戦略効果（追加時に計算済みの値を使用）"""
+        hold_total, actual_total = self._period_totals.values
+        return pd.DataFrame({
+            'Hold P/L': hold_total,
+            'Actual P/L': actual_total,
+            'Strategy Effect': actual_total - hold_total,
+        }, index=self.periods)
+
+    def spread_result(self, pairs):
+        """保持しているSpread系列（SpreadSeries）。初めて要求された限月ペアの組は計算済みの列から計算する
+
+        pairs: (期近, 期先) のリスト
+        """
+        pairs = tuple(pairs)
+        missing = [p for pair in pairs for p in pair if p not in self._positions]
+        if missing:
+            raise KeyError(f"限月が見つかりません: {', '.join(map(str, missing))}")
+
+        with self._lock:
+            spread = self._spreads.pop(pairs, None)
+            if spread is None:
+                spread = _SpreadColumns(
+                    np.array([self._positions[a] for a, _ in pairs], dtype=int),
+                    np.array([self._positions[b] for _, b in pairs], dtype=int),
+                )
+                spread.extend(self._prices.values, self._quantities.values, True)
+            self._spreads[pairs] = spread
+            while len(self._spreads) > self.max_spread_sets:
+                self._spreads.pop(next(iter(self._spreads)))
+
+            levels = spread.levels.values
+            return SpreadSeries(
+                pairs=list(pairs),
+                columns=list(self.columns),
+                levels=levels,
+                effective_qty=spread.effective_qty.values,
+                changes=np.diff(levels, axis=1),
+                hold=spread.hold.values,
+                actual=spread.actual.values,
+            )
+
+
+# ブックごとの差分計算状態（キー: (ブック名, 限月)）
+incremental_states = LRUCache(max_entries=8)
+
+
+def get_incremental_state(book, prompts):
+    """ブックに対応する差分計算状態を取得（なければ作成）"""
+    key = (book, tuple(prompts))
+    return incremental_states.get_or_compute(key, lambda: IncrementalPL(prompts))
@@ -0,0 +1,365 @@
+"""日中価格の取り込みとライブP/L
+
+価格ティック（限月, 価格）を非同期のソース（ファイルの追記監視、TCPソケットなど）から受け取り、
+メモリ上の価格ベクトルに反映して Hold/Actual P/L・Cash-3M Spread・限月ペアP/Lマトリクスを差分更新する。
+
+- ティックは限月ごとに最新値だけを残してまとめ（coalesce）、一定間隔ごとに1バッチとして反映する
+- 分析期間の開始時点の価格を基準に、ライブ価格を終了時点の価格とみなす（ライブ価格 = 終了時点の価格ならTab1と一致）
+- 基準時点の価格がない限月はP/Lの合計・ペアから除外し、ライブ価格がまだない限月は基準価格のままとする
+- 数量は日中に変わらないため、ペアの重み min(|Qty_i|, |Qty_j|) × Direction は非ゼロのペア（Long × Short）
+  についてだけ一度計算し、バッチごとにそのペアの値だけを再計算する（1バッチ O(Long数 × Short数)）
+
+使い方（テスト用にランダムなティックをファイルへ追記）:
+    python -m engine.live ticks.csv --workbook 数量価格.xlsx [--rate 20]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from engine.sparse import SparsePairs, SparsePositions
+
+
+def parse_tick(line):
+    """1行のティック（"Cash,27150" または {"prompt": "Cash", "price": 27150}）、解釈できなければ None"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    try:
+        if line.startswith('{'):
+            item = json.loads(line)
+            return str(item['prompt']), float(item['price'])
+        prompt, price = line.rsplit(',', 1)
+        return prompt.strip(), float(price.replace('"', ''))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class FileTailSource:
+    """ファイルに追記された行をティックとして読み取る（tail -f 相当）"""
+
+    def __init__(self, path, from_start=False, poll_interval=0.1):
+        self.path = path
+        self.from_start = from_start
+        self.poll_interval = poll_interval
+
+    def __repr__(self):
+        return f'FileTailSource({self.path!r})'
+
+    async def ticks(self):
+        with open(self.path, encoding='utf-8') as f:
+            if not self.from_start:
+                f.seek(0, 2)
+            buffer = ''
+            while True:
+                chunk = f.readline()
+                if not chunk:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                buffer += chunk
+                if not buffer.endswith('\n'):
+                    continue  # 書き込み途中の行
+                tick = parse_tick(buffer)
+                buffer = ''
+                if tick is not None:
+                    yield tick
+
+
+class SocketSource:
+    """TCPで1行1ティックを受け取る（テスト用の配信サーバーなどに接続）"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def __repr__(self):
+        return f'SocketSource({self.host!r}, {self.port})'
+
+    async def ticks(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                tick = parse_tick(line.decode('utf-8'))
+                if tick is not None:
+                    yield tick
+        finally:
+            writer.close()
+
+
+class LivePL:
+    """ライブ価格に対するP/L・Spread・ペアマトリクスを差分更新で保持する"""
+
+    def __init__(self, prompts, base_price, price, qty_hold, qty_actual, cash_prompt=None, m3_prompt=None):
+        self.prompts = list(prompts)
+        self._positions = {str(p): i for i, p in enumerate(self.prompts)}
+        self.base_price = np.asarray(base_price, dtype='float64').copy()
+        self.price = np.asarray(price, dtype='float64').copy()
+        self.price = np.where(np.isnan(self.price), self.base_price, self.price)
+        self.qty_hold = np.asarray(qty_hold, dtype='float64')
+        self.qty_actual = np.asarray(qty_actual, dtype='float64')
+        self._priced = ~np.isnan(self.base_price)
+        self._lock = threading.Lock()
+
+        # 合計・ペアは基準価格のある限月のみ
+        change = self._change()
+        self._qty = {
+            'hold': np.where(self._priced, self.qty_hold, 0.0),
+            'actual': np.where(self._priced, self.qty_actual, 0.0),
+        }
+        self.hold_total = float(self._qty['hold'] @ change)
+        self.actual_total = float(self._qty['actual'] @ change)
+
+        # 非ゼロのペアの重み（数量のみに依存）と現在のペアP/L
+        self._pair_weight = {}
+        self.pairs = {}
+        for strategy, qty in self._qty.items():
+            rows, cols, weights = SparsePositions.from_dense(qty).pair_weights()
+            self._pair_weight[strategy] = weights
+            self.pairs[strategy] = SparsePairs(len(self.prompts), rows, cols, (change[rows] - change[cols]) * weights)
+
+        self.cash = self._positions.get(str(cash_prompt)) if cash_prompt is not None else None
+        self.m3 = self._positions.get(str(m3_prompt)) if m3_prompt is not None else None
+
+        self.version = 0
+        self.updates = 0
+        self.batches = 0
+        self.updated_at = None
+
+    def _change(self):
+        """基準価格からの変動（基準価格のない限月は0）"""
+        return np.where(self._priced, self.price - self.base_price, 0.0)
+
+    def apply(self, updates):
+        """限月 → 価格 の辞書（まとめ済みのバッチ）を反映し、変化した限月数を返す"""
+        rows = []
+        prices = []
+        for prompt, price in updates.items():
+            i = self._positions.get(str(prompt))
+            if i is not None:
+                rows.append(i)
+                prices.append(price)
+        if not rows:
+            return 0
+
+        rows = np.array(rows, dtype=np.intp)
+        prices = np.array(prices, dtype='float64')
+        with self._lock:
+            delta = np.where(self._priced[rows], prices - self.price[rows], 0.0)
+            self.price[rows] = prices
+            self.hold_total += float(self._qty['hold'][rows] @ delta)
+            self.actual_total += float(self._qty['actual'][rows] @ delta)
+
+            # 非ゼロのペアだけ再計算: PL(i,j) = (ΔP_i - ΔP_j) × 重み(i,j)
+            change = self._change()
+            for strategy, pairs in self.pairs.items():
+                pairs.values = (change[pairs.rows] - change[pairs.cols]) * self._pair_weight[strategy]
+
+            self.version += 1
+            self.batches += 1
+            self.updates += len(rows)
+            self.updated_at = time.time()
+        return len(rows)
+
+    def spread(self):
+        """Cash-3M Spread（基準時点・ライブ）とSpread P/L"""
+        if self.cash is None or self.m3 is None:
+            return None
+        with self._lock:
+            spread_start = self.base_price[self.cash] - self.base_price[self.m3]
+            spread_live = self.price[self.cash] - self.price[self.m3]
+
+        def spread_qty(qty):
+            a, b = qty[self.cash], qty[self.m3]
+            return min(abs(a), abs(b)) if a * b < 0 else 0.0
+
+        change = spread_live - spread_start
+        return {
+            'spread_start': spread_start,
+            'spread_live': spread_live,
+            'spread_change': change,
+            'spread_pl_hold': spread_qty(self.qty_hold) * change,
+            'spread_pl_actual': spread_qty(self.qty_actual) * change,
+        }
+
+    def snapshot(self):
+        """表示用の現在値（限月別P/L表、合計、ペアP/Lのコピー）"""
+        with self._lock:
+            change = self.price - self.base_price
+            table = pd.DataFrame({
+                'Prompt': self.prompts,
+                'ライブ価格': self.price.copy(),
+                '価格変動': change,
+                'Hold P/L': self.qty_hold * change,
+                'Actual P/L': self.qty_actual * change,
+            })
+            return {
+                'table': table,
+                'total_hold_pl': self.hold_total,
+                'total_actual_pl': self.actual_total,
+                'strategy_effect': self.actual_total - self.hold_total,
+                'pairs': {k: SparsePairs(v.n, v.rows, v.cols, v.values.copy()) for k, v in self.pairs.items()},
+                'version': self.version,
+                'updates': self.updates,
+                'batches': self.batches,
+                'updated_at': self.updated_at,
+            }
+
+
+class PriceFeed:
+    """ソースのティックをまとめ、flush_interval 秒ごとに LivePL へ反映する"""
+
+    def __init__(self, live, source, flush_interval=0.5):
+        self.live = live
+        self.source = source
+        self.flush_interval = flush_interval
+        self.received = 0
+        self.error = None
+        self._pending = {}
+        self._stop = None
+
+    async def _consume(self):
+        async for prompt, price in self.source.ticks():
+            self._pending[prompt] = price  # 同じ限月は最新値のみ
+            self.received += 1
+
+    async def _flush(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._pending:
+                batch, self._pending = self._pending, {}
+                self.live.apply(batch)
+
+    async def run(self):
+        self._stop = asyncio.Event()
+        consumer = asyncio.create_task(self._consume())
+        flusher = asyncio.create_task(self._flush())
+        try:
+            await consumer
+        except Exception as e:  # ソースの異常終了は記録して停止
+            self.error = e
+        finally:
+            self._stop.set()
+            await flusher
+
+
+class FeedRunner:
+    """PriceFeed を専用スレッドのイベントループで実行する（Streamlitの再実行とは独立）"""
+
+    def __init__(self, feed):
+        self.feed = feed
+        self._loop = None
+        self._task = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self.feed.run())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        if self._loop is not None and self._task is not None and self.running:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join(timeout=2)
+
+
+# 実行中のライブセッション（ブラウザのセッションごとに1つ。キー: セッションの所有者ID）
+# 上限を超えたら最も長く使われていないセッションを停止する（閉じられたブラウザのセッションの回収）
+MAX_LIVE_SESSIONS = 8
+_session_lock = threading.Lock()
+_sessions = OrderedDict()
+
+
+def get_live_session(owner, key, create):
+    """所有者のライブセッション（LivePL, FeedRunner）を取得し、キーが変わったか停止していれば作り直す
+
+    owner: ブラウザのセッションごとのID（他のセッションのライブ評価には影響しない）
+    key: (データ, ソース, 開始, 終了) など、ライブ計算の前提を表すキー
+    create: (LivePL, FeedRunner) を返す関数
+    """
+    with _session_lock:
+        session = _sessions.pop(owner, None)
+        if session is None or session['key'] != key or not session['runner'].running:
+            if session is not None:
+                session['runner'].stop()
+            live, runner = create()
+            session = {'key': key, 'live': live, 'runner': runner}
+        _sessions[owner] = session
+        while len(_sessions) > MAX_LIVE_SESSIONS:
+            _, oldest = _sessions.popitem(last=False)
+            oldest['runner'].stop()
+        return session['live'], session['runner']
+
+
+def stop_live_session(owner):
+    """所有者の実行中のライブセッションを停止"""
+    with _session_lock:
+        session = _sessions.pop(owner, None)
+    if session is not None:
+        session['runner'].stop()
+
+
+def start_live(pl_engine, start, end, source, cash_prompt=None, m3_prompt=None, flush_interval=0.5):
+    """分析期間の開始価格を基準に、終了時点の価格・数量からライブP/Lを開始"""
+    live = LivePL(
+        pl_engine.prompts,
+        base_price=pl_engine.price(start),
+        price=pl_engine.price(end),
+        qty_hold=pl_engine.qty(start),
+        qty_actual=pl_engine.qty(end),
+        cash_prompt=cash_prompt,
+        m3_prompt=m3_prompt,
+    )
+    runner = FeedRunner(PriceFeed(live, source, flush_interval=flush_interval)).start()
+    return live, runner
+
+
+def main(argv=None):
+    from engine.loader import load_position_workbook
+
+    parser = argparse.ArgumentParser(description="テスト用のランダムな価格ティックをファイルへ追記します")
+    parser.add_argument('path', help="ティックを追記するファイル")
+    parser.add_argument('--workbook', required=True, help="限月と初期価格を取るワークブック（最後の日付列）")
+    parser.add_argument('--rate', type=float, default=20, help="1秒あたりのティック数")
+    parser.add_argument('--step', type=float, default=5, help="1ティックの価格変動の標準偏差")
+    args = parser.parse_args(argv)
+
+    df_price = load_position_workbook(args.workbook)['df_price']
+    prices = df_price.iloc[:, -1].fillna(0.0).to_dict()
+    prompts = list(prices)
+    with open(args.path, 'a', encoding='utf-8') as f:
+        while True:
+            prompt = random.choice(prompts)
+            prices[prompt] = round(prices[prompt] + random.gauss(0, args.step), 2)
+            f.write(f'{prompt},{prices[prompt]}\n')
+            f.flush()
+            time.sleep(1 / args.rate)
+
+
+if __name__ == '__main__':
+    main()
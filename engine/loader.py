@@ -0,0 +1,118 @@
+"""ポジションワークブックの読み込み
+
+openpyxlの読み取り専用（ストリーミング）モードでワークブックを一度だけ開き、
+価格・数量シートの検出、ヘッダー位置の判定、数値変換までを同じパスで行う。
+"""
+
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from engine.coerce import coerce_frame
+
+
+def detect_sheets(sheet_names):
+    """シート名から価格シートと数量シートを検出（見つからない場合は先頭から割り当て）"""
+    price_sheet = None
+    qty_sheet = None
+
+    for sheet in sheet_names:
+        if '価格' in sheet or 'price' in sheet.lower():
+            price_sheet = sheet
+        if '数量' in sheet or 'qty' in sheet.lower() or 'quantity' in sheet.lower():
+            qty_sheet = sheet
+
+    # デフォルトで最初の2つのシートを使用
+    if price_sheet is None and len(sheet_names) >= 1:
+        price_sheet = sheet_names[0]
+    if qty_sheet is None and len(sheet_names) >= 2:
+        qty_sheet = sheet_names[1]
+    elif qty_sheet is None and len(sheet_names) >= 1:
+        qty_sheet = sheet_names[0]
+
+    return price_sheet, qty_sheet
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _unique_labels(labels):
+    """重複した列名に .1, .2 ... を付与（pandas.read_excelと同じ規則）"""
+    seen = {}
+    unique = []
+    for label in labels:
+        if label in seen:
+            seen[label] += 1
+            unique.append(f'{label}.{seen[label]}')
+        else:
+            seen[label] = 0
+            unique.append(label)
+    return unique
+
+
+def raw_frame(rows):
+    """シートの行データからPrompt×日付列のDataFrameを作成（値はセルのまま）
+
+    先頭の空行・空列を読み飛ばし、最初の非空行をヘッダー、最初の非空列をPrompt列とする。
+    ヘッダーが空の列とPromptが空の行は除外する。
+    """
+    rows = [row for row in rows if not all(_is_blank(v) for v in row)]
+    if not rows:
+        return pd.DataFrame(dtype='float64')
+
+    width = max(len(row) for row in rows)
+    cells = np.full((len(rows), width), None, dtype=object)
+    for i, row in enumerate(rows):
+        cells[i, :len(row)] = row
+
+    # Prompt列 = 最初に値が現れる列
+    index_col = next(j for j in range(width) if not all(_is_blank(v) for v in cells[:, j]))
+
+    header = cells[0]
+    body = cells[1:]
+    value_cols = [j for j in range(index_col + 1, width) if not _is_blank(header[j])]
+    keep_rows = [i for i in range(len(body)) if not _is_blank(body[i, index_col])]
+
+    body = body[keep_rows]
+    labels = [str(v).strip() if isinstance(v, str) else v for v in header[value_cols]]
+    prompts = [str(v).strip() if isinstance(v, str) else v for v in body[:, index_col]]
+
+    return pd.DataFrame(body[:, value_cols], index=pd.Index(prompts, name=header[index_col]),
+                        columns=_unique_labels(labels))
+
+
+def load_position_workbook(source):
+    """価格・数量シートを検出し、数値変換済みのDataFrameとして読み込む
+
+    source: ファイルパス、バイト列、またはファイルライクオブジェクト
+    price_validity / qty_validity: 列ごとの数値判定（CoercedFrame.column_report）
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet_names = workbook.sheetnames
+        price_sheet, qty_sheet = detect_sheets(sheet_names)
+        if price_sheet is None or qty_sheet is None:
+            raise ValueError("価格または数量のシートが見つかりません。")
+
+        # 必要なシートだけを1回ずつ走査
+        frames = {}
+        for sheet in {price_sheet, qty_sheet}:
+            frames[sheet] = coerce_frame(raw_frame(workbook[sheet].iter_rows(values_only=True)))
+    finally:
+        workbook.close()
+
+    return {
+        'sheet_names': sheet_names,
+        'price_sheet': price_sheet,
+        'qty_sheet': qty_sheet,
+        'df_price': frames[price_sheet].values,
+        'df_qty': frames[qty_sheet].values,
+        'price_validity': frames[price_sheet].column_report(),
+        'qty_validity': frames[qty_sheet].column_report(),
+    }
@@ -0,0 +1,117 @@
+"""モンテカルロP/L分布とVaR
+
+価格シートの過去スナップショット列から限月間の価格変動の共分散を推定し、
+相関のある価格変動を乱数で生成してHold/Actualポジションの1期間P/L分布、
+VaR、期待ショートフォール（ES）を計算する。
+
+P/Lは価格変動と数量の内積なので、因子行列 F（Σ = F Fᵀ）をあらかじめ数量へ射影し
+（L = Fᵀ Q）、標準正規乱数 Z に対して P/L = Z L を計算する。
+価格変動 Z Fᵀ そのものを生成した場合と同じ分布で、パス数×限月数の行列を作らずに済む。
+乱数はチャンク単位で生成してメモリ使用量を抑え、必要に応じてプロセスプールに分散する。
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def price_change_matrix(prices, columns):
+    """指定した日付列（時系列順）の期間ごとの価格変動（prompts × periods、価格のない期間は NaN）"""
+    return np.diff(prices[list(columns)].to_numpy(dtype='float64'), axis=1)
+
+
+def estimate_covariance(price_changes):
+    """限月間の価格変動の共分散行列（prompts × prompts）
+
+    価格変動が NaN の期間は、その限月を含むペアごとに除外する（pairwise-complete）。
+    共通の期間が2つ未満のペアの共分散は0。
+    """
+    if price_changes.shape[1] < 2:
+        raise ValueError("共分散の推定には3つ以上の日付列（2期間以上の価格変動）が必要です。")
+    valid = ~np.isnan(price_changes)
+    if valid.all():
+        return np.cov(price_changes)
+
+    # ペア (i, j) ごとに両方の価格変動がある期間だけで共分散を計算
+    values = np.where(valid, price_changes, 0.0)
+    mask = valid.astype('float64')
+    n = mask @ mask.T
+    sums = values @ mask.T  # sums[i, j] = Σ_t x_it（j も有効な期間）
+    cross = values @ values.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (cross - sums * sums.T / n) / (n - 1)
+    cov[n < 2] = 0.0
+    return cov
+
+
+def covariance_factor(cov):
+    """Σ = F Fᵀ となる因子行列 F（半正定値の共分散にも対応する固有値分解）"""
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    keep = eigenvalues > eigenvalues.max() * 1e-12 if eigenvalues.size else eigenvalues > 0
+    return eigenvectors[:, keep] * np.sqrt(eigenvalues[keep])
+
+
+def _simulate_chunk(loadings, n_paths, seed):
+    """1チャンク分のP/Lサンプル（n_paths × ポジション数）"""
+    rng = np.random.default_rng(seed)
+    z = rng.standard_normal((n_paths, loadings.shape[0]))
+    return z @ loadings
+
+
+def simulate_pl(cov, quantities, n_paths=100_000, chunk_size=20_000, seed=42, workers=1):
+    """相関のある価格変動からP/Lサンプルを生成
+
+    quantities: 限月数 × ポジション数 の数量行列（列ごとにHold/Actualなど）
+    workers: 2以上でチャンクをプロセスプールに分散（結果はworkers数によらず同じ）
+    戻り値: n_paths × ポジション数 のP/Lサンプル
+    """
+    quantities = np.asarray(quantities, dtype='float64')
+    if quantities.ndim == 1:
+        quantities = quantities[:, None]
+    loadings = covariance_factor(cov).T @ quantities
+
+    # チャンクごとに独立した乱数系列を割り当てる
+    sizes = [chunk_size] * (n_paths // chunk_size)
+    if n_paths % chunk_size:
+        sizes.append(n_paths % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers and workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_simulate_chunk, [loadings] * len(sizes), sizes, seeds))
+    else:
+        chunks = [_simulate_chunk(loadings, size, s) for size, s in zip(sizes, seeds)]
+
+    if not chunks:
+        return np.zeros((0, quantities.shape[1]))
+    return np.vstack(chunks)
+
+
+def var_es(pl, level=0.99):
+    """VaRと期待ショートフォール（いずれも損失を正の値で返す）"""
+    pl = np.asarray(pl, dtype='float64')
+    threshold = np.quantile(pl, 1 - level, axis=0)
+    tail = np.where(pl <= threshold, pl, np.nan)
+    return -threshold, -np.nanmean(tail, axis=0)
+
+
+def monte_carlo_risk(pl_engine, columns, start, end, n_paths=100_000, level=0.99,
+                     chunk_size=20_000, seed=42, workers=1):
+    """Hold/Actualポジションの1期間P/L分布・VaR・ES
+
+    columns: 共分散推定に使う日付列（時系列順）
+    戻り値: (サマリー表, P/Lサンプル[n_paths × 2]（列: Hold, Actual）)
+    """
+    cov = estimate_covariance(price_change_matrix(pl_engine.prices, columns))
+    quantities = np.column_stack([pl_engine.qty(start), pl_engine.qty(end)])
+    samples = simulate_pl(cov, quantities, n_paths=n_paths, chunk_size=chunk_size, seed=seed, workers=workers)
+    var, es = var_es(samples, level)
+
+    summary = pd.DataFrame({
+        '平均': samples.mean(axis=0),
+        '標準偏差': samples.std(axis=0),
+        f'VaR({level:.1%})': var,
+        f'ES({level:.1%})': es,
+    }, index=['Hold', 'Actual'])
+    return summary, samples
@@ -0,0 +1,38 @@
+"""限月間スプレッドP/Lマトリクス
+
+PL(i,j) = ΔSpread(i,j) × min(|Qty_i|, |Qty_j|) × Direction(i,j) を
+NumPyのouter演算でn×n一括計算する。
+"""
+
+import numpy as np
+
+
+def pair_weight(qty):
+    """数量だけで決まるペアの重み min(|Qty_i|, |Qty_j|) × Direction(i,j)（対角線はNaN）"""
+    qty = np.asarray(qty, dtype='float64')
+
+    # Effective_Qty(i,j) = min(|Qty(i)|, |Qty(j)|)
+    abs_qty = np.abs(qty)
+    effective_qty = np.minimum.outer(abs_qty, abs_qty)
+
+    # Direction: iがLong・jがShort → +1、逆 → -1、同方向 → 0
+    sign = np.sign(qty)
+    direction = np.where(np.multiply.outer(sign, sign) < 0, sign[:, None], 0.0)
+
+    weight = effective_qty * direction
+    np.fill_diagonal(weight, np.nan)
+    return weight
+
+
+def pair_pl_matrix(price_change, qty):
+    """限月ペア間のスプレッドP/Lマトリクス（対角線はNaN）
+
+    price_change: 各限月の価格変動ベクトル（長さn）
+    qty: 各限月の数量ベクトル（長さn）
+    """
+    price_change = np.asarray(price_change, dtype='float64')
+
+    # ΔSpread(i,j) = ΔPrice(i) - ΔPrice(j)
+    spread_change = np.subtract.outer(price_change, price_change)
+    return spread_change * pair_weight(qty)
+
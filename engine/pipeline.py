@@ -0,0 +1,89 @@
+"""遅延評価・メモ化する計算段階
+
+読み込み → 数値変換 → P/L → Spread → ペアマトリクス → 図 のように、依存関係を明示した段階を
+登録しておき、表示するビューが要求した段階とその依存先だけを計算する。
+
+- 各段階は同じ実行内で1回だけ計算する（複数のビューから参照しても再計算しない）
+- key を指定した段階は、(データのキー, 段階名, key) で result_cache に保持し、再実行をまたいで再利用する
+- 計測モードでは、実際に要求された段階だけが profiler に記録される
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class Stage:
+    """計算段階（compute は依存先の値を引数に取る）"""
+    name: str
+    compute: object
+    depends: tuple
+    key: tuple = None
+    size: object = None
+
+
+class Pipeline:
+    """依存関係つきの計算段階を遅延評価する
+
+    cache: 再実行をまたぐキャッシュ（engine.cache.LRUCache）
+    key: キャッシュキーの先頭（データハッシュなど）
+    profiler: engine.profiling.StageProfiler
+    """
+
+    def __init__(self, cache=None, key=(), profiler=None):
+        self.cache = cache
+        self.key = tuple(key)
+        self.profiler = profiler
+        self.computed = []
+        self._stages = {}
+        self._values = {}
+        self._running = set()
+
+    def stage(self, name, compute, depends=(), key=None, size=None):
+        """段階を登録（同じ名前は置き換え、計算済みの値は破棄）
+
+        depends: 依存する段階名（compute の引数の順）
+        key: 再実行をまたいで再利用する条件（None なら同じ実行内だけメモ化）
+        size: 値から計測用の (行数, 列数) を返す関数
+        """
+        self._stages[name] = Stage(name, compute, tuple(depends), None if key is None else tuple(key), size)
+        self._values.pop(name, None)
+        return self
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def get(self, name):
+        """段階の値（未計算なら依存先から順に計算）"""
+        if name in self._values:
+            return self._values[name]
+        if name not in self._stages:
+            raise KeyError(f"計算段階 {name} が登録されていません")
+        if name in self._running:
+            raise ValueError(f"計算段階の依存関係が循環しています: {name}")
+
+        stage = self._stages[name]
+        self._running.add(name)
+        try:
+            args = [self.get(dependency) for dependency in stage.depends]
+        finally:
+            self._running.discard(name)
+
+        def compute():
+            return stage.compute(*args)
+
+        if self.profiler is not None:
+            with self.profiler.stage(name) as record:
+                value = self._compute(stage, compute)
+                if stage.size is not None:
+                    record['rows'], record['cols'] = stage.size(value)
+        else:
+            value = self._compute(stage, compute)
+
+        self._values[name] = value
+        self.computed.append(name)
+        return value
+
+    def _compute(self, stage, compute):
+        if stage.key is None or self.cache is None:
+            return compute()
+        return self.cache.get_or_compute(self.key + (stage.name,) + stage.key, compute)
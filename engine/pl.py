@@ -0,0 +1,241 @@
+"""限月別P/L計算エンジン
+
+価格・数量シートを一度だけfloat64行列へ変換し、任意の(開始, 終了)ペアについて
+価格変動・Hold P/L・Actual P/Lを列演算で計算する。
+
+価格の空欄（上場前・満了後の限月など）は0ではなく NaN のまま保持し、開始・終了いずれかの価格が
+ない限月はその期間のP/L（価格変動・Hold/Actual P/L は NaN）と合計・ペアP/Lから除外する。
+数量の空欄は0（ポジションなし）とする。
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from engine.coerce import coerce_frame
+from engine.pairs import pair_pl_matrix
+from engine.sparse import SparsePairs, SparsePositions
+
+
+def to_numeric_frame(df):
+    """DataFrame全体を数値へ一括変換（カンマ・全角数字・括弧の負数に対応、変換不可・欠損はNaN）"""
+    return coerce_frame(df).values
+
+
+def to_float_frame(df):
+    """DataFrame全体をfloat64へ一括変換（変換不可・欠損は0）"""
+    return to_numeric_frame(df).fillna(0.0)
+
+
+def align_frames(df_price, df_qty):
+    """価格と数量を共通のPrompt・日付列に揃えたfloat64行列として返す
+
+    Promptの順序は価格シートに従い、数量シートにないPrompt（合計行など）は除外する。
+    一方のシートにしかない日付列は、価格は NaN、数量は0で補完する。
+    """
+    df_price = df_price[~df_price.index.duplicated(keep='first')]
+    df_qty = df_qty[~df_qty.index.duplicated(keep='first')]
+
+    prompts = [p for p in df_price.index if p in df_qty.index]
+    columns = list(df_price.columns) + [c for c in df_qty.columns if c not in df_price.columns]
+
+    prices = to_numeric_frame(df_price.reindex(index=prompts, columns=columns))
+    quantities = to_float_frame(df_qty.reindex(index=prompts, columns=columns))
+    return prices, quantities
+
+
+class PLEngine:
+    """Tab1〜Tab4が共通で参照するP/L計算エンジン"""
+
+    def __init__(self, df_price, df_qty):
+        self.prices, self.quantities = align_frames(df_price, df_qty)
+        self.prompts = self.prices.index.tolist()
+        self.columns = self.prices.columns.tolist()
+        self._price_values = self.prices.to_numpy()
+        self._qty_values = self.quantities.to_numpy()
+        self._col_pos = {col: i for i, col in enumerate(self.columns)}
+        self._prompt_pos = {prompt: i for i, prompt in enumerate(self.prompts)}
+
+    def column_position(self, col):
+        """日付列の位置（prices・quantities の列番号）"""
+        try:
+            return self._col_pos[col]
+        except KeyError:
+            raise KeyError(f"日付列が見つかりません: {col}") from None
+
+    def _column(self, values, col, missing):
+        """指定列のベクトル（存在しない列は missing で埋める）"""
+        pos = self._col_pos.get(col)
+        if pos is None:
+            return np.full(len(self.prompts), missing)
+        return values[:, pos]
+
+    def _at(self, values, prompt, col, missing):
+        """指定Prompt・日付の値（存在しない場合は missing）"""
+        row = self._prompt_pos.get(prompt)
+        pos = self._col_pos.get(col)
+        if row is None or pos is None:
+            return missing
+        return float(values[row, pos])
+
+    def price(self, col):
+        """指定日付の価格ベクトル（価格のない限月は NaN）"""
+        return self._column(self._price_values, col, np.nan)
+
+    def qty(self, col):
+        """指定日付の数量ベクトル"""
+        return self._column(self._qty_values, col, 0.0)
+
+    def price_at(self, prompt, col):
+        """指定Prompt・日付の価格（価格がなければ NaN）"""
+        return self._at(self._price_values, prompt, col, np.nan)
+
+    def qty_at(self, prompt, col):
+        """指定Prompt・日付の数量"""
+        return self._at(self._qty_values, prompt, col, 0.0)
+
+    def price_change(self, start, end):
+        """価格変動ベクトル = 価格(end) - 価格(start)（いずれかの価格がない限月は NaN）"""
+        return self.price(end) - self.price(start)
+
+    def _priced(self, start, end):
+        """合計・ペアP/L用の価格変動（価格のない限月は0）と、開始・終了の両方に価格がある限月"""
+        price_change = self.price_change(start, end)
+        priced = ~np.isnan(price_change)
+        return np.where(priced, price_change, 0.0), priced
+
+    def unpriced(self, start, end):
+        """開始・終了いずれかの数量を持つが、価格がない限月（P/Lの合計から除外される）"""
+        _, priced = self._priced(start, end)
+        held = (self.qty(start) != 0) | (self.qty(end) != 0)
+        return [prompt for prompt, keep in zip(self.prompts, held & ~priced) if keep]
+
+    def hold_pl(self, start, end):
+        """Hold P/L = 数量(start) × 価格変動"""
+        return self.qty(start) * self.price_change(start, end)
+
+    def actual_pl(self, start, end):
+        """Actual P/L = 数量(end) × 価格変動"""
+        return self.qty(end) * self.price_change(start, end)
+
+    def pl_table(self, start, end):
+        """Tab1の限月別P/Lテーブル（合計行なし）"""
+        price_start = self.price(start)
+        price_end = self.price(end)
+        qty_start = self.qty(start)
+        qty_end = self.qty(end)
+        price_change = price_end - price_start
+
+        return pd.DataFrame({
+            'Prompt': self.prompts,
+            f'数量({start})': qty_start,
+            f'数量({end})': qty_end,
+            f'価格({start})': price_start,
+            f'価格({end})': price_end,
+            '価格変動': price_change,
+            'Hold P/L': qty_start * price_change,
+            'Actual P/L': qty_end * price_change,
+        })
+
+    def positions(self, col, priced=None):
+        """指定日付の非ゼロの数量だけを持つ疎なポジション（priced を指定するとその限月のみ）"""
+        qty = self.qty(col)
+        if priced is not None:
+            qty = np.where(priced, qty, 0.0)
+        return SparsePositions.from_dense(qty)
+
+    def strategy_totals(self, start, end):
+        """Tab3の戦略比較: Hold/Actual P/L合計と戦略効果（価格のある保有限月のみで計算）"""
+        price_change, priced = self._priced(start, end)
+        total_hold_pl = self.positions(start, priced).total_pl(price_change)
+        total_actual_pl = self.positions(end, priced).total_pl(price_change)
+        return {
+            'total_hold_pl': total_hold_pl,
+            'total_actual_pl': total_actual_pl,
+            'strategy_effect': total_actual_pl - total_hold_pl,
+        }
+
+    def pair_pl(self, start, end, strategy='actual'):
+        """限月間スプレッドP/Lマトリクス（strategy: 'actual' / 'hold' / 'diff'、価格のない限月のペアは0）"""
+        price_change, priced = self._priced(start, end)
+        qty_start = np.where(priced, self.qty(start), 0.0)
+        qty_end = np.where(priced, self.qty(end), 0.0)
+        if strategy == 'hold':
+            return pair_pl_matrix(price_change, qty_start)
+        if strategy == 'diff':
+            return pair_pl_matrix(price_change, qty_end) - pair_pl_matrix(price_change, qty_start)
+        return pair_pl_matrix(price_change, qty_end)
+
+    def sparse_pair_pl(self, start, end, strategy='actual'):
+        """非ゼロの限月ペアだけのスプレッドP/L（SparsePairs、strategy は pair_pl と同じ）"""
+        price_change, priced = self._priced(start, end)
+        actual = SparsePairs.from_positions(price_change, self.positions(end, priced))
+        if strategy == 'hold':
+            return SparsePairs.from_positions(price_change, self.positions(start, priced))
+        if strategy == 'diff':
+            return actual - SparsePairs.from_positions(price_change, self.positions(start, priced))
+        return actual
+
+    def multi_period(self, columns=None):
+        """連続する全スナップショットペアのP/Lを一括計算
+
+        columns: 時系列順の日付列（省略時はエンジンの全列）
+        価格のない限月・期間のP/Lは NaN（期間合計から除外）。
+        """
+        if columns is None:
+            columns = self.columns
+        columns = list(columns)
+        positions = [self.column_position(col) for col in columns]
+        prices = self._price_values[:, positions]
+        quantities = self._qty_values[:, positions]
+
+        # 期間ごとの価格変動（prompts × periods）
+        price_change = np.diff(prices, axis=1)
+        hold = quantities[:, :-1] * price_change
+        actual = quantities[:, 1:] * price_change
+
+        periods = [f'{start}→{end}' for start, end in zip(columns[:-1], columns[1:])]
+        return MultiPeriodPL(
+            prompts=self.prompts,
+            periods=periods,
+            price_change=price_change,
+            hold=hold,
+            actual=actual,
+        )
+
+
+@dataclass
+class MultiPeriodPL:
+    """複数期間P/Lの計算結果（行列はすべて prompts × periods、価格のないセルは NaN）"""
+
+    prompts: list
+    periods: list
+    price_change: np.ndarray
+    hold: np.ndarray
+    actual: np.ndarray
+
+    def frame(self, kind='actual'):
+        """限月×期間のP/L表（kind: 'actual' / 'hold' / 'price_change'）"""
+        return pd.DataFrame(getattr(self, kind), index=self.prompts, columns=self.periods)
+
+    def period_totals(self):
+        """期間ごとのHold/Actual P/L合計と戦略効果（価格のないセルは除外）"""
+        hold_total = np.nansum(self.hold, axis=0)
+        actual_total = np.nansum(self.actual, axis=0)
+        return pd.DataFrame({
+            'Hold P/L': hold_total,
+            'Actual P/L': actual_total,
+            'Strategy Effect': actual_total - hold_total,
+        }, index=self.periods)
+
+    def select(self, start, stop):
+        """期間 start〜stop-1（位置）だけを取り出した MultiPeriodPL（行列はビュー）"""
+        window = slice(start, stop)
+        return MultiPeriodPL(
+            prompts=self.prompts,
+            periods=self.periods[window],
+            price_change=self.price_change[:, window],
+            hold=self.hold[:, window],
+            actual=self.actual[:, window],
+        )
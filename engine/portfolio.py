@@ -0,0 +1,189 @@
+"""複数金属・複数ブックのポートフォリオ
+
+錫・銅・アルミ・ニッケル・亜鉛など複数の金属について、複数のブック（ワークブック）を
+1つの積み上げ配列にまとめて保持し、ポートフォリオ全体のP/Lと戦略効果を一括計算する。
+
+- 数量: 金属 × ブック × 限月 × 日付列（ブックにない限月・日付は0）
+- 価格: 金属 × 限月 × 日付列（同じ金属のブック間で価格カーブを共有。先に読み込んだブックの値を優先し、
+  欠けている限月・日付のみ他のブックで補完）。どのブックにも価格のないセルは NaN のまま保持し、
+  分析期間の開始・終了いずれかの価格がない限月はP/Lの集計から除外する（unpriced で確認できる）
+
+集計は限月単位の明細（long形式のDataFrame）に対する groupby で行う。
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from engine.pl import to_numeric_frame
+from engine.snapshots import snapshot_axis
+
+# 金属名と判定用の別名（ファイル名・ブック名から推定）
+METALS = ['錫', '銅', 'アルミ', 'ニッケル', '亜鉛']
+_METAL_NAMES = {
+    '錫': ('錫', 'tin'),
+    '銅': ('銅', 'copper'),
+    'アルミ': ('アルミ', 'aluminium', 'aluminum'),
+    'ニッケル': ('ニッケル', 'nickel'),
+    '亜鉛': ('亜鉛', 'zinc'),
+}
+_METAL_SYMBOLS = {'sn': '錫', 'cu': '銅', 'al': 'アルミ', 'ni': 'ニッケル', 'zn': '亜鉛'}
+
+VALUE_COLUMNS = ['Hold P/L', 'Actual P/L', '戦略効果']
+
+
+def guess_metal(name, default='錫'):
+    """ファイル名などから金属を推定（錫、Copper、CU_book1.xlsx など）"""
+    text = str(name).lower()
+    for metal, names in _METAL_NAMES.items():
+        if any(alias in text for alias in names):
+            return metal
+    for token in re.split(r'[^a-z]+', text):
+        if token in _METAL_SYMBOLS:
+            return _METAL_SYMBOLS[token]
+    return default
+
+
+def _unique(values):
+    return list(dict.fromkeys(values))
+
+
+@dataclass
+class Portfolio:
+    """金属 × ブック × 限月 × 日付列 の積み上げ配列
+
+    columns: 時系列順の日付列（全ブックの和集合）
+    prices: 金属 × 限月 × 日付列
+    quantities: 金属 × ブック × 限月 × 日付列
+    positions: 金属 × ブック × 限月（そのブックに限月の行があるか）
+    """
+    metals: list
+    books: list
+    prompts: list
+    columns: list
+    prices: np.ndarray
+    quantities: np.ndarray
+    positions: np.ndarray
+
+    def _col(self, col):
+        return self.columns.index(col)
+
+    def price_change(self, start, end):
+        """価格変動（金属 × 限月）"""
+        return self.prices[:, :, self._col(end)] - self.prices[:, :, self._col(start)]
+
+    def pl_arrays(self, start, end):
+        """Hold/Actual P/L（いずれも 金属 × ブック × 限月、価格のない限月は NaN）"""
+        price_change = self.price_change(start, end)[:, None, :]
+        hold = self.quantities[..., self._col(start)] * price_change
+        actual = self.quantities[..., self._col(end)] * price_change
+        return hold, actual
+
+    def _priced(self, start, end):
+        """開始・終了の両方に価格がある 金属 × ブック × 限月"""
+        return ~np.isnan(self.price_change(start, end))[:, None, :]
+
+    def unpriced(self, start, end):
+        """ブックに行があるが開始・終了いずれかの価格がない限月（P/Lの集計から除外される）"""
+        metal_idx, book_idx, prompt_idx = np.nonzero(self.positions & ~self._priced(start, end))
+        return pd.DataFrame({
+            '金属': np.array(self.metals, dtype=object)[metal_idx],
+            'ブック': np.array(self.books, dtype=object)[book_idx],
+            'Prompt': np.array(self.prompts, dtype=object)[prompt_idx],
+        })
+
+    def pl_frame(self, start, end):
+        """金属・ブック・限月ごとのP/L明細（ブックに行があり、価格のある限月のみ）"""
+        hold, actual = self.pl_arrays(start, end)
+        metal_idx, book_idx, prompt_idx = np.nonzero(self.positions & self._priced(start, end))
+        price_change = self.price_change(start, end)
+        qty_start = self.quantities[..., self._col(start)]
+        qty_end = self.quantities[..., self._col(end)]
+        cells = (metal_idx, book_idx, prompt_idx)
+        return pd.DataFrame({
+            '金属': np.array(self.metals, dtype=object)[metal_idx],
+            'ブック': np.array(self.books, dtype=object)[book_idx],
+            'Prompt': np.array(self.prompts, dtype=object)[prompt_idx],
+            f'数量({start})': qty_start[cells],
+            f'数量({end})': qty_end[cells],
+            '価格変動': price_change[metal_idx, prompt_idx],
+            'Hold P/L': hold[cells],
+            'Actual P/L': actual[cells],
+            '戦略効果': actual[cells] - hold[cells],
+        })
+
+    @staticmethod
+    def rollup(frame, by=('金属',)):
+        """pl_frame の明細を指定した単位（金属・ブック・Prompt の組み合わせ）で集計したP/Lと戦略効果"""
+        return frame.groupby(list(by), sort=False)[VALUE_COLUMNS].sum()
+
+    def totals(self, start, end):
+        """ポートフォリオ全体のHold/Actual P/L合計と戦略効果（Tab3と同じキー、価格のない限月は除外）"""
+        hold, actual = self.pl_arrays(start, end)
+        total_hold_pl = float(np.nansum(hold))
+        total_actual_pl = float(np.nansum(actual))
+        return {
+            'total_hold_pl': total_hold_pl,
+            'total_actual_pl': total_actual_pl,
+            'strategy_effect': total_actual_pl - total_hold_pl,
+        }
+
+
+def build_portfolio(entries):
+    """ブックごとの価格・数量を積み上げ配列にまとめる
+
+    entries: {'metal', 'book', 'df_price', 'df_qty'} のリスト（同じ金属・ブックが複数ある場合は数量を合算）
+    """
+    frames = []
+    for entry in entries:
+        df_price = entry['df_price']
+        df_qty = entry['df_qty']
+        df_price = df_price[~df_price.index.duplicated(keep='first')]
+        df_qty = df_qty[~df_qty.index.duplicated(keep='first')]
+        prompts = [p for p in df_price.index if p in df_qty.index]
+        columns = [c for c in df_price.columns if c in df_qty.columns]
+        frames.append((
+            entry['metal'],
+            entry['book'],
+            to_numeric_frame(df_price.reindex(index=prompts, columns=columns)),
+            to_numeric_frame(df_qty.reindex(index=prompts, columns=columns)).fillna(0.0),
+        ))
+
+    metals = _unique(metal for metal, _, _, _ in frames)
+    books = _unique(book for _, book, _, _ in frames)
+    prompts = _unique(p for _, _, price, _ in frames for p in price.index)
+    columns = snapshot_axis(_unique(c for _, _, price, _ in frames for c in price.columns)).columns
+
+    metal_pos = {metal: i for i, metal in enumerate(metals)}
+    book_pos = {book: i for i, book in enumerate(books)}
+    prompt_pos = {prompt: i for i, prompt in enumerate(prompts)}
+    col_pos = {col: i for i, col in enumerate(columns)}
+
+    prices = np.full((len(metals), len(prompts), len(columns)), np.nan)
+    quantities = np.zeros((len(metals), len(books), len(prompts), len(columns)))
+    positions = np.zeros((len(metals), len(books), len(prompts)), dtype=bool)
+
+    for metal, book, price, qty in frames:
+        m = metal_pos[metal]
+        b = book_pos[book]
+        rows = np.array([prompt_pos[p] for p in price.index], dtype=np.intp)
+        cols = np.array([col_pos[c] for c in price.columns], dtype=np.intp)
+        cell = np.ix_(rows, cols)
+
+        # 価格カーブは金属ごとに共有（未設定のセルのみ埋める）
+        shared = prices[m][cell]
+        prices[m][cell] = np.where(np.isnan(shared), price.to_numpy(), shared)
+        quantities[m, b][cell] += qty.to_numpy()
+        positions[m, b, rows] = True
+
+    return Portfolio(
+        metals=metals,
+        books=books,
+        prompts=prompts,
+        columns=columns,
+        prices=prices,
+        quantities=quantities,
+        positions=positions,
+    )
@@ -0,0 +1,99 @@
+"""処理段階ごとの時間・メモリ計測
+
+app.py の各段階（読み込み、列検出、P/L計算、図の生成など）を
+with profiler.stage('名前') で囲み、経過時間・ピークメモリ・行数/列数を記録する。
+無効時は何も計測しない。ピークメモリは tracemalloc で測るため、
+段階を入れ子にした場合は内側の段階で外側のピークがリセットされる。
+
+tracemalloc はプロセスで1つのため、計測中のセッション（owner）の集合で参照を数え、
+最後のセッションが finish() したときに停止する。複数のセッションが同時に計測している間は、
+ピークメモリに他のセッションの確保分も含まれる（リセットも共有される）。
+"""
+
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+# このモジュールが開始したメモリトレースを使っているセッション
+_tracing_owners = set()
+_tracing_lock = threading.Lock()
+# このモジュールが開始したメモリトレースか（外部で開始されたトレースは停止しない）
+_tracing_started_here = False
+
+
+class StageProfiler:
+    """段階ごとの経過時間・ピークメモリ・データサイズを記録する
+
+    owner: 計測するセッションの識別子（同じ owner の中断された実行の参照は次の実行で引き継ぐ。
+    省略時はこのインスタンス）
+    """
+
+    def __init__(self, enabled=True, trace_memory=True, owner=None):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.owner = id(self) if owner is None else owner
+        self.records = []
+        if self.trace_memory:
+            global _tracing_started_here
+            with _tracing_lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _tracing_started_here = True
+                _tracing_owners.add(self.owner)
+        else:
+            # 同じセッションの前回の実行が finish() 前に中断された場合の参照を外す
+            self.finish()
+
+    @contextmanager
+    def stage(self, name, rows=None, cols=None):
+        """with 文で囲んだ処理を1段階として記録
+
+        行数・列数は引数で渡すか、with で受け取った辞書に後から設定する。
+        """
+        record = {'stage': name, 'rows': rows, 'cols': cols}
+        if not self.enabled:
+            yield record
+            return
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - started
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                record['peak_mb'] = max(peak - memory_start, 0) / 1024 ** 2
+            self.records.append(record)
+
+    def frame(self):
+        """記録した段階の一覧"""
+        columns = ['stage', 'seconds', 'peak_mb', 'rows', 'cols']
+        return pd.DataFrame(self.records).reindex(columns=columns)
+
+    def total_seconds(self):
+        return sum(record['seconds'] for record in self.records)
+
+    def write_log(self, path, **context):
+        """記録をJSON Lines形式でファイルに追記（context は各行に付与）"""
+        timestamp = datetime.now().isoformat(timespec='seconds')
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in self.records:
+                row = {'timestamp': timestamp, **context, **record}
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+
+    def finish(self):
+        """メモリトレースの参照を外す（このモジュールが開始したトレースは、使うセッションがなくなれば停止）"""
+        global _tracing_started_here
+        with _tracing_lock:
+            _tracing_owners.discard(self.owner)
+            if _tracing_started_here and not _tracing_owners:
+                tracemalloc.stop()
+                _tracing_started_here = False
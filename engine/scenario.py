@@ -0,0 +1,61 @@
+"""価格ショック・シナリオ分析
+
+限月カーブに平行シフト・傾き（Cash〜期先のティルト）・限月別の個別ショックを与え、
+シナリオ数×限月数のショック行列と数量ベクトルの行列積で
+全シナリオのHold/Actual P/Lを一括計算する。
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def tilt_weights(n_prompts):
+    """ティルトの限月別ウェイト（Cash: -0.5 → 最期先: +0.5 の線形）"""
+    if n_prompts <= 1:
+        return np.zeros(n_prompts)
+    return np.linspace(-0.5, 0.5, n_prompts)
+
+
+def shock_grid(n_prompts, parallel_shifts, tilts):
+    """平行シフト×ティルトの全組み合わせのショック行列
+
+    tilt t は最期先とCashの価格差（期先 - Cash）を t だけ変化させる。
+    戻り値: (shocks[scenarios × prompts], parallel[scenarios], tilt[scenarios])
+    """
+    parallel_shifts = np.asarray(parallel_shifts, dtype='float64')
+    tilts = np.asarray(tilts, dtype='float64')
+    parallel, tilt = np.meshgrid(parallel_shifts, tilts, indexing='ij')
+    parallel = parallel.ravel()
+    tilt = tilt.ravel()
+    shocks = parallel[:, None] + tilt[:, None] * tilt_weights(n_prompts)[None, :]
+    return shocks, parallel, tilt
+
+
+def scenario_pl(shocks, qty_hold, qty_actual):
+    """全シナリオのHold/Actual P/L（scenarios × prompts · prompts の行列積1回）
+
+    戻り値: (hold[scenarios], actual[scenarios])
+    """
+    shocks = np.atleast_2d(np.asarray(shocks, dtype='float64'))
+    quantities = np.column_stack([
+        np.asarray(qty_hold, dtype='float64'),
+        np.asarray(qty_actual, dtype='float64'),
+    ])
+    pl = shocks @ quantities
+    return pl[:, 0], pl[:, 1]
+
+
+def scenario_grid_pl(pl_engine, start, end, parallel_shifts, tilts):
+    """平行シフト×ティルトのシナリオ別P/L表
+
+    Hold は開始時点、Actual は終了時点の数量ベクトル（Tab1と同じ）を使用する。
+    """
+    shocks, parallel, tilt = shock_grid(len(pl_engine.prompts), parallel_shifts, tilts)
+    hold, actual = scenario_pl(shocks, pl_engine.qty(start), pl_engine.qty(end))
+    return pd.DataFrame({
+        '平行シフト': parallel,
+        'ティルト': tilt,
+        'Hold P/L': hold,
+        'Actual P/L': actual,
+        '差分': actual - hold,
+    })
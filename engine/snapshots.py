@@ -0,0 +1,167 @@
+"""スナップショット（日付列）の時間軸
+
+日付列のラベル（1月末、2026年3月末、3/31、Excelのシリアル値、datetime の見出しなど）を
+一度だけ日付に変換し、時系列順に並べた列と DatetimeIndex として保持する。
+期間の選択は並べ替え済みの日付に対する二分探索で行い、列を再走査しない。
+
+年のないラベル（1月末、3/31 など）は、シート上の並び順で月日が前の列より前に戻ったときに
+翌年とみなす。基準の年は年付きのラベルがあればその最初の年、なければ当年。
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# Excelのシリアル値として扱う範囲（1954年〜2119年）
+_SERIAL_MIN = 20000
+_SERIAL_MAX = 80000
+_EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+
+_DUPLICATE_SUFFIX = re.compile(r'\.\d+$')
+_MONTH_END = re.compile(r'^(?:(\d{4})\s*年\s*)?(\d{1,2})\s*月\s*末$')
+_MONTH_DAY = re.compile(r'^(?:(\d{4})\s*年\s*)?(\d{1,2})\s*月\s*(\d{1,2})\s*日$')
+_SLASH_MONTH_DAY = re.compile(r'^(\d{1,2})/(\d{1,2})$')
+_FULL_DATE = re.compile(r'^\d{4}[-/.]\d{1,2}[-/.]\d{1,2}')
+
+
+def _from_serial(value):
+    if _SERIAL_MIN <= value <= _SERIAL_MAX:
+        return _EXCEL_EPOCH + pd.Timedelta(days=float(value))
+    return None
+
+
+def parse_snapshot_label(label):
+    """日付列のラベルを解釈
+
+    戻り値: (年, 月, 日) または Timestamp、解釈できなければ None。
+    年のないラベルは年が None、月末ラベルは日が None のタプルで返す。
+    """
+    if isinstance(label, (datetime, date, pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(label)
+    if isinstance(label, (int, float, np.integer, np.floating)) and not isinstance(label, bool):
+        return _from_serial(label)
+    if not isinstance(label, str):
+        return None
+
+    text = _DUPLICATE_SUFFIX.sub('', label.strip())
+    if text.isdigit():
+        return _from_serial(int(text))
+
+    match = _MONTH_END.match(text)
+    if match:
+        year, month = match.groups()
+        return (int(year) if year else None, int(month), None)
+    match = _MONTH_DAY.match(text)
+    if match:
+        year, month, day = match.groups()
+        return (int(year) if year else None, int(month), int(day))
+    match = _SLASH_MONTH_DAY.match(text)
+    if match:
+        return (None, int(match.group(1)), int(match.group(2)))
+    if _FULL_DATE.match(text):
+        parsed = pd.to_datetime(text, errors='coerce')
+        return None if pd.isna(parsed) else parsed
+    return None
+
+
+def _to_timestamp(year, month, day):
+    """年月日（日が None なら月末）の Timestamp、存在しない日付は None"""
+    if not 1 <= month <= 12:
+        return None
+    if day is None:
+        return pd.Timestamp(year=year, month=month, day=1) + pd.offsets.MonthEnd(0)
+    try:
+        return pd.Timestamp(year=year, month=month, day=day)
+    except ValueError:
+        return None
+
+
+def needs_reference_year(labels):
+    """年のないラベルがあり、年付きのラベルがない（日付が当年に依存する）か"""
+    parsed = [parse_snapshot_label(label) for label in labels]
+    tuples = [p for p in parsed if isinstance(p, tuple)]
+    if not any(year is None for year, _, _ in tuples):
+        return False
+    return not any(isinstance(p, pd.Timestamp) or p[0] is not None for p in parsed if p is not None)
+
+
+def label_dates(labels, reference_year=None):
+    """ラベルごとの日付（解釈できないラベルは NaT、シート上の並び順のまま）"""
+    parsed = [parse_snapshot_label(label) for label in labels]
+
+    if reference_year is None:
+        years = [p.year if isinstance(p, pd.Timestamp) else p[0] for p in parsed if p is not None]
+        years = [year for year in years if year is not None]
+        reference_year = years[0] if years else date.today().year
+
+    dates = []
+    year = reference_year
+    previous = None
+    for item in parsed:
+        if item is None:
+            dates.append(pd.NaT)
+            continue
+        if isinstance(item, pd.Timestamp):
+            dates.append(item)
+            continue
+        item_year, month, day = item
+        if item_year is None:
+            # 前の年なしラベルより月日が前に戻ったら翌年
+            key = (month, 32 if day is None else day)
+            if previous is not None and key < previous:
+                year += 1
+            previous = key
+            item_year = year
+        dates.append(_to_timestamp(item_year, month, day) or pd.NaT)
+    return pd.DatetimeIndex(dates)
+
+
+@dataclass
+class SnapshotAxis:
+    """時系列順の日付列と対応する日付
+
+    columns: 時系列順の日付列（日付を解釈できない列はシート上の順で末尾）
+    dates: columns と同じ並びの日付（解釈できない列は NaT）
+    """
+    columns: list
+    dates: pd.DatetimeIndex
+
+    @property
+    def n_dated(self):
+        """日付を解釈できた列の数（columns の先頭から）"""
+        return int(self.dates.notna().sum())
+
+    def position(self, column):
+        return self.columns.index(column)
+
+    def between(self, start, end):
+        """開始列から終了列まで（両端を含む）の列"""
+        i, j = sorted((self.position(start), self.position(end)))
+        return self.columns[i:j + 1]
+
+    def range(self, start_date, end_date):
+        """日付が [start_date, end_date] に入る列（二分探索）"""
+        dated = self.dates[:self.n_dated]
+        i = dated.searchsorted(pd.Timestamp(start_date), side='left')
+        j = dated.searchsorted(pd.Timestamp(end_date), side='right')
+        return self.columns[i:j]
+
+
+def snapshot_axis(columns, reference_year=None):
+    """日付列を時系列順に並べた SnapshotAxis
+
+    日付を解釈できた列は日付順（同じ日付はシート上の順）、解釈できない列はその後ろにシート上の順で並べる。
+    """
+    columns = list(columns)
+    dates = label_dates(columns, reference_year)
+    dated = [i for i in range(len(columns)) if not pd.isna(dates[i])]
+    undated = [i for i in range(len(columns)) if pd.isna(dates[i])]
+    dated.sort(key=lambda i: dates[i])
+    order = dated + undated
+    return SnapshotAxis(
+        columns=[columns[i] for i in order],
+        dates=pd.DatetimeIndex([dates[i] for i in order]),
+    )
@@ -0,0 +1,166 @@
+"""非ゼロの限月だけを保持する疎なポジション表現
+
+LMEの日次プロンプトのように限月数が多くほとんどの限月の数量が0のカーブでは、
+密な限月 × 限月 のペアマトリクスの大半が0になる。ペアのスプレッドP/L
+PL(i,j) = ΔSpread(i,j) × min(|Qty_i|, |Qty_j|) × Direction(i,j) は i と j が逆方向の
+ポジションを持つときだけ非ゼロなので、Long の限月 × Short の限月 の組だけを計算する。
+
+- SparsePositions: 非ゼロの限月の位置と数量（P/L は保有限月だけで計算）
+- SparsePairs: 非ゼロの限月ペア（i < j の1組につき1件、PL(i,j) = PL(j,i)）
+
+計算量・メモリは カーブの限月数 ではなく 保有限月数（Long数 × Short数）に比例する。
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class SparsePositions:
+    """非ゼロの数量を持つ限月（index は限月の位置の昇順）"""
+    n: int
+    index: np.ndarray
+    qty: np.ndarray
+
+    @classmethod
+    def from_dense(cls, qty):
+        qty = np.asarray(qty, dtype='float64')
+        index = np.flatnonzero(qty)
+        return cls(n=len(qty), index=index, qty=qty[index])
+
+    def to_dense(self):
+        dense = np.zeros(self.n)
+        dense[self.index] = self.qty
+        return dense
+
+    @property
+    def long(self):
+        return self.index[self.qty > 0]
+
+    @property
+    def short(self):
+        return self.index[self.qty < 0]
+
+    def pl(self, price_change):
+        """保有限月ごとのP/L（index と同じ並び）"""
+        return self.qty * np.asarray(price_change, dtype='float64')[self.index]
+
+    def total_pl(self, price_change):
+        return float(self.qty @ np.asarray(price_change, dtype='float64')[self.index])
+
+    def pair_weights(self):
+        """非ゼロのペアの重み min(|Qty_i|, |Qty_j|) × Direction(i,j)
+
+        戻り値: (rows, cols, weights)。Long の限月 × Short の限月 の全組について、
+        rows < cols の向きで Direction = sign(Qty_rows)。
+        """
+        is_long = self.qty > 0
+        long_idx, long_qty = self.index[is_long], self.qty[is_long]
+        short_idx, short_qty = self.index[~is_long], -self.qty[~is_long]
+
+        rows = np.repeat(long_idx, len(short_idx))
+        cols = np.tile(short_idx, len(long_idx))
+        weights = np.minimum.outer(long_qty, short_qty).ravel()
+        # rows < cols に揃える（Short が先になる組は向きが逆なので符号も反転）
+        swap = rows > cols
+        rows, cols = np.where(swap, cols, rows), np.where(swap, rows, cols)
+        return rows, cols, np.where(swap, -weights, weights)
+
+
+@dataclass
+class SparsePairs:
+    """非ゼロの限月ペアのスプレッドP/L（rows < cols、同じペアは1件）
+
+    密なマトリクスでは PL(i,j) と PL(j,i) の両方に同じ値が入り、それ以外のセルは0（対角線は NaN）。
+    """
+    n: int
+    rows: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+
+    @classmethod
+    def from_positions(cls, price_change, positions):
+        price_change = np.asarray(price_change, dtype='float64')
+        rows, cols, weights = positions.pair_weights()
+        return cls(positions.n, rows, cols, (price_change[rows] - price_change[cols]) * weights)
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    def _coalesce(self):
+        """同じペアの値を合計して1件にまとめる"""
+        keys = self.rows * self.n + self.cols
+        unique, inverse = np.unique(keys, return_inverse=True)
+        values = np.bincount(inverse, weights=self.values, minlength=len(unique))
+        return SparsePairs(self.n, unique // self.n, unique % self.n, values)
+
+    def __sub__(self, other):
+        return SparsePairs(
+            self.n,
+            np.concatenate([self.rows, other.rows]),
+            np.concatenate([self.cols, other.cols]),
+            np.concatenate([self.values, -other.values]),
+        )._coalesce()
+
+    def to_dense(self):
+        """密なマトリクス（対角線は NaN）"""
+        dense = np.zeros((self.n, self.n))
+        np.add.at(dense, (self.rows, self.cols), self.values)
+        np.add.at(dense, (self.cols, self.rows), self.values)
+        np.fill_diagonal(dense, np.nan)
+        return dense
+
+    def total(self):
+        """密なマトリクス全体の合計（From/To 両方向を含む）"""
+        return 2.0 * float(self.values.sum())
+
+    def subset(self, mask):
+        """mask の限月だけのカーブに絞ったペア（位置は絞り込み後の番号）"""
+        mask = np.asarray(mask, dtype=bool)
+        keep = mask[self.rows] & mask[self.cols]
+        position = np.cumsum(mask) - 1
+        return SparsePairs(int(mask.sum()), position[self.rows[keep]], position[self.cols[keep]], self.values[keep])
+
+    def aggregate(self, codes, n_buckets):
+        """バケット × バケット に集約（密なマトリクスのセル値の合計）
+
+        限月ペアが1つもないセル（1限月だけのバケットの対角など）は NaN。
+        """
+        codes = np.asarray(codes, dtype=np.intp)
+        size = n_buckets * n_buckets
+        code_rows, code_cols = codes[self.rows], codes[self.cols]
+        totals = (np.bincount(code_rows * n_buckets + code_cols, weights=self.values, minlength=size)
+                  + np.bincount(code_cols * n_buckets + code_rows, weights=self.values, minlength=size))
+
+        # セル内の限月ペア数（対角は同じ限月同士を除く）はバケットの限月数だけで決まる
+        sizes = np.bincount(codes, minlength=n_buckets).astype('float64')
+        counts = np.outer(sizes, sizes) - np.diag(sizes)
+        totals = totals.reshape(n_buckets, n_buckets)
+        totals[counts == 0] = np.nan
+        return totals
+
+    def top(self, k=20, prompt_mask=None, legs='any', sign=None):
+        """絶対値の大きい限月ペア上位k件（非ゼロのペアのみ、部分選択）
+
+        prompt_mask: 対象とする限月（bool、長さn）。legs='any' ならいずれか、'both' なら両方が対象のペア
+        sign: 'positive'（利益のみ）/ 'negative'（損失のみ）/ None
+        戻り値: (rows, cols, values) いずれも絶対値の降順
+        """
+        keep = self.values != 0
+        if prompt_mask is not None:
+            prompt_mask = np.asarray(prompt_mask, dtype=bool)
+            combine = np.logical_or if legs == 'any' else np.logical_and
+            keep &= combine(prompt_mask[self.rows], prompt_mask[self.cols])
+        if sign == 'positive':
+            keep &= self.values > 0
+        elif sign == 'negative':
+            keep &= self.values < 0
+
+        rows, cols, values = self.rows[keep], self.cols[keep], self.values[keep]
+        if len(values) > k:
+            selected = np.argpartition(-np.abs(values), k - 1)[:k]
+            rows, cols, values = rows[selected], cols[selected], values[selected]
+        order = np.argsort(-np.abs(values), kind='stable')
+        return rows[order], cols[order], values[order]
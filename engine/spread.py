@@ -0,0 +1,170 @@
+"""Spread計算
+
+Cash-3Mの単一ペアに加えて、任意の限月ペア（または隣接限月すべて）について
+Spread水準・Spread変動・Spread Qty・Hold/Actual Spread P/Lを
+全スナップショット列にわたって一括計算する。
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+def _find_prompt(prompts, keyword):
+    """Prompt名の検出（完全一致を優先し、なければ部分一致の最後を使用）"""
+    keyword = keyword.lower()
+    for prompt in prompts:
+        if str(prompt).strip().lower() == keyword:
+            return prompt
+
+    found = None
+    for prompt in prompts:
+        if keyword in str(prompt).lower():
+            found = prompt
+    return found
+
+
+def find_cash_3m(prompts):
+    """Prompt名からCashと3Mを検出"""
+    return _find_prompt(prompts, 'cash'), _find_prompt(prompts, '3m')
+
+
+def cash_3m_spread(pl_engine, start, end, cash_prompt, m3_prompt):
+    """Cash-3MのSpread・Spread Qty・Spread P/Lを計算"""
+    # Spread計算
+    spread_start = pl_engine.price_at(cash_prompt, start) - pl_engine.price_at(m3_prompt, start)
+    spread_end = pl_engine.price_at(cash_prompt, end) - pl_engine.price_at(m3_prompt, end)
+    spread_change = spread_end - spread_start
+
+    # Spread Qty計算（Cashと3Mが逆方向の場合のみ、絶対値の小さい方）
+    def spread_qty(col):
+        cash_qty = pl_engine.qty_at(cash_prompt, col)
+        m3_qty = pl_engine.qty_at(m3_prompt, col)
+        return min(abs(cash_qty), abs(m3_qty)) if cash_qty * m3_qty < 0 else 0
+
+    spread_qty_start = spread_qty(start)
+    spread_qty_end = spread_qty(end)
+
+    return {
+        'spread_start': spread_start,
+        'spread_end': spread_end,
+        'spread_change': spread_change,
+        'spread_qty_start': spread_qty_start,
+        'spread_qty_end': spread_qty_end,
+        'spread_pl_hold': spread_qty_start * spread_change,
+        'spread_pl_actual': spread_qty_end * spread_change,
+    }
+
+
+def spread_table(spread, start, end):
+    """Tab2の項目・値テーブル（値は数値のまま）"""
+    return pd.DataFrame({
+        '項目': [
+            f'Spread({start})',
+            f'Spread({end})',
+            'Spread変動',
+            f'Spread Qty({start})',
+            f'Spread Qty({end})',
+            'Spread P/L(Hold)',
+            'Spread P/L(Actual)'
+        ],
+        '値': [
+            spread['spread_start'],
+            spread['spread_end'],
+            spread['spread_change'],
+            spread['spread_qty_start'],
+            spread['spread_qty_end'],
+            spread['spread_pl_hold'],
+            spread['spread_pl_actual'],
+        ],
+    })
+
+
+def adjacent_pairs(prompts):
+    """隣接する限月のペア（Cash-3M、3M-M+4、…）"""
+    return list(zip(prompts[:-1], prompts[1:]))
+
+
+@dataclass
+class SpreadSeries:
+    """限月ペアごとのSpread計算結果
+
+    levels / effective_qty は pairs × snapshots、
+    changes / hold / actual は pairs × periods の行列。
+    """
+
+    pairs: list
+    columns: list
+    levels: np.ndarray
+    effective_qty: np.ndarray
+    changes: np.ndarray
+    hold: np.ndarray
+    actual: np.ndarray
+
+    @property
+    def labels(self):
+        return [f'{near}-{far}' for near, far in self.pairs]
+
+    @property
+    def periods(self):
+        return [f'{start}→{end}' for start, end in zip(self.columns[:-1], self.columns[1:])]
+
+    def level_frame(self):
+        """Spread水準（pairs × snapshots）"""
+        return pd.DataFrame(self.levels, index=self.labels, columns=self.columns)
+
+    def frame(self, kind='actual'):
+        """ペア×期間の表（kind: 'actual' / 'hold' / 'changes'）"""
+        return pd.DataFrame(getattr(self, kind), index=self.labels, columns=self.periods)
+
+    def summary(self):
+        """ペアごとの全期間合計"""
+        return pd.DataFrame({
+            'Spread(開始)': self.levels[:, 0],
+            'Spread(終了)': self.levels[:, -1],
+            'Spread変動': self.levels[:, -1] - self.levels[:, 0],
+            'Spread Qty(開始)': self.effective_qty[:, 0],
+            'Spread Qty(終了)': self.effective_qty[:, -1],
+            'Spread P/L(Hold)': np.nansum(self.hold, axis=1),
+            'Spread P/L(Actual)': np.nansum(self.actual, axis=1),
+        }, index=pd.Index(self.labels, name='ペア'))
+
+
+def spread_series(pl_engine, pairs, columns):
+    """指定した限月ペアのSpreadを全スナップショット列について一括計算
+
+    pairs: (期近, 期先) のリスト
+    columns: 時系列順の日付列
+    各期間のSpread P/Lは Tab2 と同じく Spread Qty(期首 or 期末) × Spread変動。
+    いずれかの限月の価格がない期間は NaN（全期間合計から除外）。
+    """
+    positions = {prompt: i for i, prompt in enumerate(pl_engine.prompts)}
+    missing = [p for pair in pairs for p in pair if p not in positions]
+    if missing:
+        raise KeyError(f"限月が見つかりません: {', '.join(map(str, missing))}")
+
+    near = np.array([positions[a] for a, _ in pairs], dtype=int)
+    far = np.array([positions[b] for _, b in pairs], dtype=int)
+    cols = [pl_engine.column_position(col) for col in columns]
+
+    prices = pl_engine.prices.to_numpy()[:, cols]
+    quantities = pl_engine.quantities.to_numpy()[:, cols]
+
+    levels = prices[near] - prices[far]
+    changes = np.diff(levels, axis=1)
+
+    # Spread Qty: 逆方向のポジションの場合のみ、絶対値の小さい方
+    qty_near = quantities[near]
+    qty_far = quantities[far]
+    effective_qty = np.where(qty_near * qty_far < 0, np.minimum(np.abs(qty_near), np.abs(qty_far)), 0.0)
+
+    return SpreadSeries(
+        pairs=list(pairs),
+        columns=list(columns),
+        levels=levels,
+        effective_qty=effective_qty,
+        changes=changes,
+        hold=effective_qty[:, :-1] * changes,
+        actual=effective_qty[:, 1:] * changes,
+    )
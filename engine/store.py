@@ -0,0 +1,277 @@
+"""スナップショットと計算済みP/Lの履歴ストア（SQLite）
+
+取り込んだ価格・数量スナップショットと、連続する日付列間のP/L（Hold / Actual）を
+ローカルのSQLiteファイルに保存する。金属・限月・日付のインデックスで
+「限月Xの直近250日のP/L」のような問い合わせをワークブックを再解析せずに行う。
+
+スナップショットは解釈した日付（YYYY-MM-DD）をキーに保存するため、翌年の同じラベル（1月末など）が
+前年の行を上書きしない。年付きのラベルがないワークブックは基準の年（year）の指定が必要。
+
+使い方:
+    python -m engine.store import 数量価格.xlsx --metal 錫 --book 本店 [--year 2026] [--db history.sqlite]
+    python -m engine.store query --metal 錫 --prompt 3M [--last 250] [--db history.sqlite]
+"""
+
+import argparse
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from engine.cache import content_hash
+from engine.loader import load_position_workbook
+from engine.pl import PLEngine
+from engine.snapshots import needs_reference_year, snapshot_axis
+
+DEFAULT_DB = 'history.sqlite'
+
+# スキーマの版（PRAGMA user_version）。2: スナップショットを解釈した日付で保存
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS imports (
+    source_hash TEXT PRIMARY KEY,
+    name TEXT,
+    metal TEXT NOT NULL,
+    book TEXT NOT NULL,
+    imported_at TEXT NOT NULL,
+    n_prompts INTEGER,
+    n_snapshots INTEGER
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    metal TEXT NOT NULL,
+    book TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    label TEXT NOT NULL,
+    snapshot_date TEXT,
+    prompt_order INTEGER,
+    price REAL,
+    qty REAL,
+    PRIMARY KEY (metal, book, prompt, snapshot)
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_metal_prompt_date ON snapshots (metal, prompt, snapshot_date);
+CREATE TABLE IF NOT EXISTS pl (
+    metal TEXT NOT NULL,
+    book TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    start_snapshot TEXT NOT NULL,
+    end_snapshot TEXT NOT NULL,
+    end_date TEXT,
+    price_change REAL,
+    hold_pl REAL,
+    actual_pl REAL,
+    PRIMARY KEY (metal, book, prompt, end_snapshot)
+);
+CREATE INDEX IF NOT EXISTS idx_pl_metal_prompt_date ON pl (metal, prompt, end_date);
+"""
+
+
+def _iso(timestamp):
+    return None if pd.isna(timestamp) else timestamp.strftime('%Y-%m-%d')
+
+
+def _value(x):
+    """SQLiteに保存する値（欠損は NULL）"""
+    return None if np.isnan(x) else float(x)
+
+
+class HistoryStore:
+    """SQLiteファイルの履歴ストア（接続は操作ごとに開閉）"""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'snapshots'"
+            ).fetchone()
+            if exists and version < SCHEMA_VERSION:
+                raise ValueError(
+                    f"{self.path} は旧形式の履歴ストアです（日付列をラベルで保存）。"
+                    "新しいファイルを指定して取り込み直してください"
+                )
+            conn.executescript(_SCHEMA)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    @contextmanager
+    def _connect(self):
+        """トランザクション（正常終了でコミット、例外でロールバック）と接続のクローズ"""
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def has_import(self, source_hash):
+        """同じ内容のワークブックを取り込み済みか"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT 1 FROM imports WHERE source_hash = ?', (source_hash,)).fetchone()
+        return row is not None
+
+    def import_frames(self, df_price, df_qty, metal, book, source_hash=None, name=None, year=None):
+        """価格・数量のDataFrameを取り込み、その金属・ブックの期間別P/Lを再計算
+
+        同じ金属・ブック・限月・日付（日付を解釈できない列はラベル）の値は上書きする。
+        価格が空欄のセルは NULL で保存する。
+        year: 年のないラベルの基準の年。年付きのラベルがないワークブックでは必須（ValueError）。
+        source_hash を指定した場合、取り込み済みなら何もせず False を返す。
+        """
+        if source_hash is not None and self.has_import(source_hash):
+            return False
+
+        pl_engine = PLEngine(df_price, df_qty)
+        if year is None and needs_reference_year(pl_engine.columns):
+            raise ValueError("日付列のラベルに年がありません。基準の年を指定してください")
+        axis = snapshot_axis(pl_engine.columns, reference_year=year)
+        dates = dict(zip(axis.columns, axis.dates))
+        prompts = [str(p) for p in pl_engine.prompts]
+
+        rows = []
+        for col in axis.columns:
+            snapshot_date = _iso(dates[col])
+            snapshot = snapshot_date or str(col)
+            for order, (prompt, price, qty) in enumerate(zip(prompts, pl_engine.price(col), pl_engine.qty(col))):
+                rows.append((metal, book, prompt, snapshot, str(col), snapshot_date, order, _value(price), float(qty)))
+
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            if source_hash is not None:
+                conn.execute(
+                    'INSERT OR REPLACE INTO imports VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (source_hash, name, metal, book, datetime.now().isoformat(timespec='seconds'),
+                     len(prompts), len(axis.columns)),
+                )
+            self._recompute_pl(conn, metal, book)
+        return True
+
+    def import_workbook(self, path, metal, book, year=None):
+        """ワークブックファイルを取り込む（内容が同じファイルは再取り込みしない）"""
+        data = Path(path).read_bytes()
+        source_hash = content_hash(data)
+        if self.has_import(source_hash):
+            return False
+        workbook = load_position_workbook(data)
+        return self.import_frames(workbook['df_price'], workbook['df_qty'], metal, book,
+                                  source_hash=source_hash, name=Path(path).name, year=year)
+
+    def _snapshot_frames(self, conn, metal, book):
+        """保存済みスナップショットの価格・数量（限月 × 時系列順の日付列）"""
+        df = pd.read_sql_query(
+            'SELECT prompt, snapshot, snapshot_date, prompt_order, price, qty FROM snapshots '
+            'WHERE metal = ? AND book = ?',
+            conn, params=(metal, book),
+        )
+        if df.empty:
+            empty = pd.DataFrame(dtype='float64')
+            return empty, empty, {}
+
+        # 日付のある列は日付順、ない列はその後ろ
+        df['_undated'] = df['snapshot_date'].isna()
+        columns = (df.drop_duplicates('snapshot')
+                   .sort_values(['_undated', 'snapshot_date'], kind='stable')['snapshot'].tolist())
+        prompts = df.groupby('prompt', sort=False)['prompt_order'].min().sort_values(kind='stable').index.tolist()
+        dates = df.drop_duplicates('snapshot').set_index('snapshot')['snapshot_date'].to_dict()
+
+        df_price = df.pivot(index='prompt', columns='snapshot', values='price').reindex(index=prompts, columns=columns)
+        df_qty = df.pivot(index='prompt', columns='snapshot', values='qty').reindex(index=prompts, columns=columns)
+        df_price.index.name = df_qty.index.name = 'Prompt'
+        df_price.columns.name = df_qty.columns.name = None
+        return df_price, df_qty, dates
+
+    def _recompute_pl(self, conn, metal, book):
+        """金属・ブックの連続する日付列間のP/Lを保存済みスナップショットから再計算"""
+        df_price, df_qty, dates = self._snapshot_frames(conn, metal, book)
+        conn.execute('DELETE FROM pl WHERE metal = ? AND book = ?', (metal, book))
+        if df_price.shape[1] < 2:
+            return
+
+        columns = list(df_price.columns)
+        result = PLEngine(df_price, df_qty).multi_period(columns)
+        rows = []
+        for k, (start, end) in enumerate(zip(columns[:-1], columns[1:])):
+            for i, prompt in enumerate(result.prompts):
+                rows.append((metal, book, prompt, start, end, dates[end], _value(result.price_change[i, k]),
+                             _value(result.hold[i, k]), _value(result.actual[i, k])))
+        conn.executemany('INSERT INTO pl VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def load_frames(self, metal, book):
+        """保存済みの価格・数量DataFrame（PLEngine にそのまま渡せる形式）"""
+        with self._connect() as conn:
+            df_price, df_qty, _ = self._snapshot_frames(conn, metal, book)
+        return df_price, df_qty
+
+    def prompt_pl(self, metal, prompt, last=250, book=None):
+        """限月の直近 last 日分の期間別P/L（全ブック合計、日付の昇順）"""
+        query = ('SELECT end_date AS 日付, AVG(price_change) AS 価格変動, '
+                 'SUM(hold_pl) AS "Hold P/L", SUM(actual_pl) AS "Actual P/L" '
+                 'FROM pl WHERE metal = ? AND prompt = ? AND end_date IS NOT NULL')
+        params = [metal, str(prompt)]
+        if book is not None:
+            query += ' AND book = ?'
+            params.append(book)
+        query += ' GROUP BY end_date ORDER BY end_date DESC LIMIT ?'
+        params.append(int(last))
+
+        with self._connect() as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+        df['日付'] = pd.to_datetime(df['日付'])
+        df = df.iloc[::-1].set_index('日付').astype('float64')  # 価格のない期間（NULL）は NaN
+        df['戦略効果'] = df['Actual P/L'] - df['Hold P/L']
+        return df
+
+    def catalog(self):
+        """保存済みの金属・ブックごとの限月数・日付列数・期間"""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                'SELECT metal AS 金属, book AS ブック, COUNT(DISTINCT prompt) AS 限月数, '
+                'COUNT(DISTINCT snapshot) AS 日付列数, MIN(snapshot_date) AS 開始, MAX(snapshot_date) AS 終了 '
+                'FROM snapshots GROUP BY metal, book ORDER BY metal, book',
+                conn,
+            )
+
+    def prompts(self, metal):
+        """金属の保存済み限月（限月の並び順）"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT prompt FROM snapshots WHERE metal = ? GROUP BY prompt ORDER BY MIN(prompt_order)',
+                (metal,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スナップショットとP/Lの履歴ストア")
+    parser.add_argument('--db', default=DEFAULT_DB, help="SQLiteファイル")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_import = sub.add_parser('import', help="ワークブックを取り込む")
+    p_import.add_argument('workbooks', nargs='+', help="取り込むExcelファイル")
+    p_import.add_argument('--metal', required=True, help="金属（錫、銅など）")
+    p_import.add_argument('--book', help="ブック名（省略時はファイル名）")
+    p_import.add_argument('--year', type=int, help="年のないラベル（1月末など）の基準の年")
+
+    p_query = sub.add_parser('query', help="限月の期間別P/Lを表示")
+    p_query.add_argument('--metal', required=True)
+    p_query.add_argument('--prompt', required=True)
+    p_query.add_argument('--last', type=int, default=250, help="直近の日数")
+    p_query.add_argument('--book')
+
+    args = parser.parse_args(argv)
+    store = HistoryStore(args.db)
+    if args.command == 'import':
+        for path in args.workbooks:
+            imported = store.import_workbook(path, args.metal, args.book or Path(path).stem, year=args.year)
+            print(f"{path}: {'取り込み完了' if imported else '取り込み済み（スキップ）'}")
+        print(store.catalog().to_string(index=False))
+    else:
+        print(store.prompt_pl(args.metal, args.prompt, last=args.last, book=args.book).to_string())
+
+
+if __name__ == '__main__':
+    main()
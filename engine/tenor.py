@@ -0,0 +1,88 @@
+"""限月ラベルのテナー分類
+
+限月ラベル（Cash、3M、M+4 … や日次プロンプトの日付）を月・年のバケットに分類する。
+大きなペアマトリクスの集約表示やランキングの絞り込みに使う。
+
+- 相対限月: Cash = 0か月、3M = 3か月、M+n = nか月 → 月: Cash / M+n、年: 1年目, 2年目 …
+- 日付: 2026-03-18 や datetime → 月: 2026-03、年: 2026
+- それ以外のラベルは「その他」
+"""
+
+import re
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# 粗い順（ドリルダウンで細かくしていく）
+BUCKET_LEVELS = ['year', 'month', 'prompt']
+BUCKET_LEVEL_NAMES = {'year': '年', 'month': '月', 'prompt': '限月'}
+OTHER_BUCKET = 'その他'
+
+_RELATIVE_MONTH = re.compile(r'^\s*(?:M\s*\+\s*(\d+)|(\d+)\s*M)\s*$', re.IGNORECASE)
+_DATE_LIKE = re.compile(r'^\s*\d{4}[-/]\d{1,2}([-/]\d{1,2})?')
+
+
+def month_offset(prompt):
+    """相対限月の月数（Cash → 0、3M → 3、M+4 → 4）、該当しなければ None"""
+    if not isinstance(prompt, str):
+        return None
+    if prompt.strip().lower() == 'cash':
+        return 0
+    match = _RELATIVE_MONTH.match(prompt)
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+def prompt_date(prompt):
+    """日次プロンプトの日付（Timestamp）、日付でなければ None"""
+    if isinstance(prompt, (datetime, date, pd.Timestamp)):
+        return pd.Timestamp(prompt)
+    if isinstance(prompt, str) and _DATE_LIKE.match(prompt):
+        parsed = pd.to_datetime(prompt, errors='coerce')
+        return None if pd.isna(parsed) else parsed
+    return None
+
+
+def tenor_bucket(prompt, level):
+    """限月を指定した粒度（'prompt' / 'month' / 'year'）のバケット名に変換"""
+    if level == 'prompt':
+        return str(prompt)
+
+    offset = month_offset(prompt)
+    if offset is not None:
+        if level == 'month':
+            return 'Cash' if offset == 0 else f'M+{offset}'
+        return f'{offset // 12 + 1}年目'
+
+    timestamp = prompt_date(prompt)
+    if timestamp is not None:
+        return f'{timestamp:%Y-%m}' if level == 'month' else f'{timestamp:%Y}'
+
+    return OTHER_BUCKET
+
+
+def bucket_codes(prompts, level):
+    """各限月のバケット番号とバケット名（限月の並び順で初出順）
+
+    戻り値: (codes[len(prompts)], labels)
+    """
+    names = [tenor_bucket(prompt, level) for prompt in prompts]
+    labels = list(dict.fromkeys(names))
+    positions = {label: i for i, label in enumerate(labels)}
+    return np.array([positions[name] for name in names], dtype=np.intp), labels
+
+
+def auto_bucket_level(prompts, max_buckets):
+    """バケット数が max_buckets 以下になる最も細かい粒度"""
+    for level in reversed(BUCKET_LEVELS):
+        if len(set(tenor_bucket(prompt, level) for prompt in prompts)) <= max_buckets:
+            return level
+    return BUCKET_LEVELS[0]
+
+
+def finer_level(level):
+    """ドリルダウン先の粒度（最も細かい場合は None）"""
+    position = BUCKET_LEVELS.index(level)
+    return BUCKET_LEVELS[position + 1] if position + 1 < len(BUCKET_LEVELS) else None
@@ -0,0 +1,156 @@
+import { useEffect, useMemo, useState } from 'react'
+import { PLData, calculatePLData } from '@/utils/calculations'
+
+// Python計算エンジンのAPI（python -m engine.api）。未設定ならブラウザで計算する
+export const API_URL = (process.env.NEXT_PUBLIC_PL_API_URL || '').replace(/\/$/, '')
+
+export interface WorkbookMeta {
+  id: string
+  prompts: string[]
+  columns: string[]
+  dateStart: string
+  dateEnd: string
+  cashPrompt: string | null
+  m3Prompt: string | null
+}
+
+// 数値配列（encoding=binary のときは Plotly の typed array 形式）
+export interface TypedArray {
+  dtype: 'f4' | 'f8'
+  bdata: string
+  shape?: string
+}
+
+export type Column = (number | null)[] | string[] | TypedArray
+
+export type ColumnTable = Record<string, Column>
+
+async function readJson<T>(res: Response): Promise<T> {
+  const body = await res.json()
+  if (!res.ok) {
+    throw new Error(body.error || res.statusText)
+  }
+  return body as T
+}
+
+export async function uploadWorkbook(file: File): Promise<WorkbookMeta> {
+  const res = await fetch(`${API_URL}/workbooks`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' },
+    body: await file.arrayBuffer(),
+  })
+  return readJson<WorkbookMeta>(res)
+}
+
+export async function fetchTab<T>(workbookId: string, tab: string, params: Record<string, string>): Promise<T> {
+  const query = new URLSearchParams({ ...params, encoding: 'binary' })
+  const res = await fetch(`${API_URL}/workbooks/${workbookId}/${tab}?${query}`)
+  return readJson<T>(res)
+}
+
+function isTyped(column: Column): column is TypedArray {
+  return !Array.isArray(column)
+}
+
+function decodeTyped(column: TypedArray): Float32Array | Float64Array {
+  const binary = atob(column.bdata)
+  const bytes = new Uint8Array(binary.length)
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i)
+  }
+  return column.dtype === 'f4' ? new Float32Array(bytes.buffer) : new Float64Array(bytes.buffer)
+}
+
+// 1次元の列（NaN は null）
+export function decodeColumn(column: Column): (number | string | null)[] {
+  if (!isTyped(column)) {
+    return column
+  }
+  return Array.from(decodeTyped(column), v => (Number.isNaN(v) ? null : v))
+}
+
+// 行列（NaN は null、対角線など）
+export function decodeMatrix(column: Column | (number | null)[][]): (number | null)[][] {
+  if (Array.isArray(column) && Array.isArray(column[0])) {
+    return column as (number | null)[][]
+  }
+  const values = decodeColumn(column as Column) as (number | null)[]
+  const width = isTyped(column as Column) && (column as TypedArray).shape
+    ? Number((column as TypedArray).shape!.split(',')[1])
+    : values.length
+  const rows: (number | null)[][] = []
+  for (let i = 0; i < values.length; i += width) {
+    rows.push(values.slice(i, i + width))
+  }
+  return rows
+}
+
+// 列指向の表を行オブジェクトの配列に変換
+export function toRows<T>(table: ColumnTable): T[] {
+  const names = Object.keys(table)
+  const columns = names.map(name => decodeColumn(table[name]))
+  const length = columns.length ? columns[0].length : 0
+  const rows: T[] = []
+  for (let i = 0; i < length; i++) {
+    const row: Record<string, unknown> = {}
+    names.forEach((name, j) => {
+      row[name] = columns[j][i]
+    })
+    rows.push(row as T)
+  }
+  return rows
+}
+
+// タブの計算結果をAPIから取得（workbookId が null なら取得しない）
+export function useTabData<T>(
+  workbookId: string | null | undefined,
+  tab: string,
+  params: Record<string, string>
+): { data: T | null; error: string } {
+  const [data, setData] = useState<T | null>(null)
+  const [error, setError] = useState<string>('')
+  const key = JSON.stringify(params)
+
+  useEffect(() => {
+    if (!workbookId) {
+      setData(null)
+      return
+    }
+    let cancelled = false
+    fetchTab<T>(workbookId, tab, JSON.parse(key))
+      .then(result => {
+        if (!cancelled) {
+          setData(result)
+          setError('')
+        }
+      })
+      .catch((err: Error) => {
+        if (!cancelled) {
+          setError(err.message)
+        }
+      })
+    return () => {
+      cancelled = true
+    }
+  }, [workbookId, tab, key])
+
+  return { data, error }
+}
+
+// 限月別P/L（APIを使う場合はサーバーの計算結果、使わない場合はブラウザで計算）
+export function usePLData(
+  priceData: any,
+  qtyData: any,
+  dateStart: string,
+  dateEnd: string,
+  workbookId: string | null | undefined
+): PLData[] {
+  const remote = useTabData<{ table: ColumnTable }>(workbookId, 'tab1', { start: dateStart, end: dateEnd })
+
+  return useMemo(() => {
+    if (workbookId) {
+      return remote.data ? toRows<PLData>(remote.data.table) : []
+    }
+    return calculatePLData(priceData, qtyData, dateStart, dateEnd)
+  }, [priceData, qtyData, dateStart, dateEnd, workbookId, remote.data])
+}